@@ -1,17 +1,50 @@
 from django.contrib import admin
 
-from .models import Event, Semester, Excuse
+from .ledger import invalidate_ledger
+from .models import AttendanceRecord, Event, Semester, Excuse, OutgoingEmail
+
+class AttendanceRecordInline(admin.TabularInline):
+  model = AttendanceRecord
+  fields = ['sister', 'status', 'is_required', 'required_override']
+  # A dropdown of every sister on every row makes the page huge
+  raw_id_fields = ['sister']
+  extra = 0
 
 class EventAdmin(admin.ModelAdmin):
   fieldsets = [
-    (None, {'fields': ['name', 'date', 'is_mandatory', 'points', 'semester', 'sisters_excused', 'sisters_freebied', 'sisters_required']})
+    (None, {'fields': ['name', 'date', 'is_mandatory', 'points', 'semester']}),
+    # See Event for how these decide who's required
+    ('Eligibility', {'fields': ['eligible_statuses', 'eligible_class_year', 'is_finalized']}),
   ]
+  inlines = [AttendanceRecordInline]
   list_display = ('name', 'date', 'is_mandatory', 'points', 'semester')
 
   list_filter = ['semester', 'date', 'points', 'is_mandatory']
   search_fields = ['name']
 
+  # Changing an event can change every sister's percentage for its
+  # semester, so the ledger has to be recomputed once the attendance
+  # records have been saved.
+  def save_related(self, request, form, formsets, change):
+    super(EventAdmin, self).save_related(request, form, formsets, change)
+    invalidate_ledger(form.instance.semester_id)
+    if 'semester' in form.changed_data and form.initial.get('semester'):
+      # The event moved out of another semester too
+      invalidate_ledger(form.initial['semester'])
+
+  def delete_model(self, request, obj):
+    semester_id = obj.semester_id
+    super(EventAdmin, self).delete_model(request, obj)
+    invalidate_ledger(semester_id)
+
+# Mostly for checking on emails that failed to send
+class OutgoingEmailAdmin(admin.ModelAdmin):
+  list_display = ('subject', 'recipient', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+  list_filter = ['status']
+  search_fields = ['recipient', 'subject']
+
 
 admin.site.register(Event, EventAdmin)
 admin.site.register(Semester)
 admin.site.register(Excuse)
+admin.site.register(OutgoingEmail, OutgoingEmailAdmin)
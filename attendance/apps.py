@@ -5,3 +5,7 @@ from django.apps import AppConfig
 
 class AttendanceConfig(AppConfig):
     name = 'attendance'
+
+    def ready(self):
+        # Connects the signal receivers
+        from . import signals
@@ -0,0 +1,182 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AttendanceRecord, Event, Excuse, SyncedCheckin
+from .ledger import refresh_ledger
+from general.models import Sister
+
+# Batch check-in sync for kiosks that queue taps while offline.
+#
+# A kiosk sends every tap it queued at once, each with its own
+# idempotency key. The whole batch is applied in one transaction, with a
+# fixed number of queries however many taps there are, and keys that
+# were already synced are ignored, so a kiosk can safely resend a batch
+# when it never saw the response.
+
+# A single queued tap.
+# action is SyncedCheckin.CHECKIN or SyncedCheckin.UNCHECK.
+Checkin = namedtuple('Checkin', ['key', 'event_id', 'sister_id', 'action', 'client_timestamp'])
+
+# Raised when a batch isn't in the expected format.
+class InvalidCheckin(ValueError):
+  pass
+
+# Returns a list of Checkins from the decoded JSON batch, which is a list
+# of objects with event, sister, action, timestamp, and key fields.
+# Raises InvalidCheckin if any entry is malformed.
+def parse_checkins(entries):
+  if not isinstance(entries, list):
+    raise InvalidCheckin("Expected a list of check-ins")
+  actions = dict(SyncedCheckin.ACTION)
+  checkins = []
+  for entry in entries:
+    try:
+      key = entry['key']
+      event_id = int(entry['event'])
+      sister_id = int(entry['sister'])
+      action = entry['action']
+      client_timestamp = parse_datetime(entry['timestamp'])
+    except (KeyError, TypeError, ValueError):
+      raise InvalidCheckin("Malformed check-in: %r" % (entry,))
+    if not key or len(key) > 64 or action not in actions or client_timestamp is None:
+      raise InvalidCheckin("Malformed check-in: %r" % (entry,))
+    if timezone.is_naive(client_timestamp):
+      client_timestamp = timezone.make_aware(client_timestamp)
+    checkins.append(Checkin(key, event_id, sister_id, action, client_timestamp))
+  return checkins
+
+# Applies the checkins in one transaction and returns a dict with
+#   applied: keys that were applied
+#   ignored: keys that were already synced (or repeated in the batch), or
+#     taps older than one already synced for that sister at that event
+#   rejected: keys for events or sisters that don't exist
+# Taps for the same sister at the same event are applied in the order
+# they happened on the kiosk, so only the last one matters, even across
+# batches: a kiosk that comes back online late can't undo newer taps.
+# Unchecking follows the same rules as views.uncheck_sister: a sister
+# with an approved excuse goes back to excused or freebied.
+# Raises IntegrityError if another request is syncing the same keys.
+def sync_checkins(checkins):
+  result = {'applied': [], 'ignored': [], 'rejected': []}
+
+  with transaction.atomic():
+    synced_keys = set(SyncedCheckin.objects
+      .filter(key__in=[checkin.key for checkin in checkins])
+      .values_list('key', flat=True))
+    new_checkins = []
+    for checkin in checkins:
+      if checkin.key in synced_keys:
+        result['ignored'].append(checkin.key)
+      else:
+        synced_keys.add(checkin.key)
+        new_checkins.append(checkin)
+
+    event_semesters = dict(Event.objects
+      .filter(id__in=set(checkin.event_id for checkin in new_checkins))
+      .values_list('id', 'semester_id'))
+    sister_ids = set(Sister.objects
+      .filter(id__in=set(checkin.sister_id for checkin in new_checkins))
+      .values_list('id', flat=True))
+    valid_checkins = []
+    for checkin in new_checkins:
+      if checkin.event_id in event_semesters and checkin.sister_id in sister_ids:
+        valid_checkins.append(checkin)
+      else:
+        result['rejected'].append(checkin.key)
+
+    # The newest tap already synced for each sister at each event
+    latest_timestamps = {}
+    if valid_checkins:
+      pairs = set((checkin.event_id, checkin.sister_id) for checkin in valid_checkins)
+      for synced in SyncedCheckin.objects \
+          .filter(
+            event_id__in=set(event_id for event_id, sister_id in pairs),
+            sister_id__in=set(sister_id for event_id, sister_id in pairs)) \
+          .values('event_id', 'sister_id') \
+          .annotate(latest=Max('client_timestamp')) \
+          .order_by():
+        latest_timestamps[(synced['event_id'], synced['sister_id'])] = synced['latest']
+    current_checkins = []
+    for checkin in valid_checkins:
+      latest = latest_timestamps.get((checkin.event_id, checkin.sister_id))
+      if latest is not None and checkin.client_timestamp < latest:
+        result['ignored'].append(checkin.key)
+      else:
+        current_checkins.append(checkin)
+        result['applied'].append(checkin.key)
+
+    # Claim the keys first, so that a concurrent sync of the same keys
+    # fails on the unique constraint instead of applying them twice.
+    # Stale taps are claimed too, so resending them is still ignored.
+    SyncedCheckin.objects.bulk_create([
+      SyncedCheckin(key=checkin.key, event_id=checkin.event_id,
+        sister_id=checkin.sister_id, action=checkin.action,
+        client_timestamp=checkin.client_timestamp)
+      for checkin in valid_checkins
+    ])
+
+    last_actions = {}
+    for checkin in sorted(current_checkins, key=lambda checkin: checkin.client_timestamp):
+      last_actions[(checkin.event_id, checkin.sister_id)] = checkin.action
+    _apply_actions(last_actions)
+
+  touched = defaultdict(set)
+  for event_id, sister_id in last_actions:
+    touched[event_semesters[event_id]].add(sister_id)
+  for semester_id, semester_sister_ids in touched.items():
+    refresh_ledger(semester_id, semester_sister_ids)
+
+  return result
+
+# Sets the attendance status for each (event_id, sister_id) pair in
+# actions, which maps the pair to the action to apply.
+def _apply_actions(actions):
+  if not actions:
+    return
+  event_ids = set(event_id for event_id, sister_id in actions)
+  sister_ids = set(sister_id for event_id, sister_id in actions)
+  records = dict(
+    ((record.event_id, record.sister_id), record) for record in
+    AttendanceRecord.objects.filter(event_id__in=event_ids, sister_id__in=sister_ids))
+
+  # Approved excuses for the sisters being unchecked, latest last
+  unchecked = set(pair for pair, action in actions.items()
+    if action == SyncedCheckin.UNCHECK and pair in records
+    and records[pair].status == AttendanceRecord.ATTENDED)
+  excused_statuses = {}
+  if unchecked:
+    for event_id, sister_id, is_freebie in Excuse.objects \
+        .filter(status=Excuse.APPROVED,
+          event_id__in=set(event_id for event_id, sister_id in unchecked),
+          sister_id__in=set(sister_id for event_id, sister_id in unchecked)) \
+        .order_by('id') \
+        .values_list('event_id', 'sister_id', 'is_freebie'):
+      if is_freebie:
+        excused_statuses[(event_id, sister_id)] = AttendanceRecord.FREEBIED
+      else:
+        excused_statuses[(event_id, sister_id)] = AttendanceRecord.EXCUSED
+
+  new_records = []
+  # Maps each new status to the ids of the records that should have it
+  updates = defaultdict(list)
+  for pair, action in actions.items():
+    record = records.get(pair)
+    if action == SyncedCheckin.CHECKIN:
+      if record is None:
+        event_id, sister_id = pair
+        new_records.append(AttendanceRecord(
+          event_id=event_id, sister_id=sister_id, status=AttendanceRecord.ATTENDED))
+      elif record.status != AttendanceRecord.ATTENDED:
+        updates[AttendanceRecord.ATTENDED].append(record.id)
+    elif pair in unchecked:
+      updates[excused_statuses.get(pair, AttendanceRecord.ABSENT)].append(record.id)
+
+  AttendanceRecord.objects.bulk_create(new_records)
+  for status, record_ids in updates.items():
+    AttendanceRecord.objects.filter(id__in=record_ids).update(status=status)
@@ -0,0 +1,122 @@
+from __future__ import unicode_literals
+
+import csv
+from itertools import groupby
+
+from django.utils import timezone
+
+from .models import AttendanceRecord, Event
+from .scoring import EventStatus, Score, get_earned_points, get_extra_points
+from general.models import Sister
+
+# CSV export of a semester's attendance: one row per sister, one column
+# per event, then her totals.
+#
+# Each event column holds one of these codes:
+#   A  attended
+#   E  excused
+#   F  used her freebie
+#   M  missed (required, didn't attend, event already happened)
+#   R  required, event hasn't happened yet
+#   (blank) not required
+#
+# Rows are generated one sister at a time from two ordered queries that
+# are read with iterator(), so memory doesn't grow with the number of
+# sisters times the number of events.
+
+CODES = {
+  AttendanceRecord.ATTENDED: 'A',
+  AttendanceRecord.EXCUSED: 'E',
+  AttendanceRecord.FREEBIED: 'F',
+}
+
+# A file-like object that just returns what's written to it, so that
+# csv.writer can format one row at a time.
+class Echo(object):
+  def write(self, value):
+    return value
+
+# Returns the file name to save the semester's export as,
+# e.g. attendance-fall-2017.csv
+def get_export_filename(semester):
+  return 'attendance-%s-%d.csv' % (semester.term.lower(), semester.year)
+
+# Yields the lines of the CSV export for the semester.
+def iter_attendance_csv(semester_id):
+  writer = csv.writer(Echo())
+  for row in iter_attendance_rows(semester_id):
+    yield writer.writerow(row)
+
+# Yields the rows of the export for the semester: a header row, then one
+# row per sister with any attendance information, ordered by name.
+def iter_attendance_rows(semester_id):
+  time_threshold = timezone.now()
+  events = list(Event.objects.filter(semester_id=semester_id).order_by('date', 'id'))
+  rule_events = [event for event in events if event.uses_eligibility_rule()]
+  extra_points = get_extra_points(None, semester_id)
+
+  yield ['Sister', 'Class Year'] + [str(event) for event in events] + \
+    ['Earned Points', 'Total Points', 'Extra Points', 'Percentage']
+
+  # Both queries are ordered by name then id, so each sister's records
+  # come up right when she does.
+  records = AttendanceRecord.objects \
+    .filter(event__semester_id=semester_id) \
+    .order_by('sister__display_name', 'sister_id') \
+    .values_list('sister_id', 'event_id', 'status', 'is_required', 'required_override') \
+    .iterator()
+  records_by_sister = groupby(records, key=lambda record: record[0])
+  next_records = next(records_by_sister, None)
+
+  for sister in Sister.objects.order_by('display_name', 'id').iterator():
+    sister_records = {}
+    if next_records is not None and next_records[0] == sister.id:
+      for sister_id, event_id, status, is_required, required_override in next_records[1]:
+        sister_records[event_id] = (status, is_required, required_override)
+      next_records = next(records_by_sister, None)
+
+    is_required_by_rule = any(
+      event.is_eligible(sister.status, sister.class_year) for event in rule_events)
+    if not sister_records and not is_required_by_rule and sister.id not in extra_points:
+      # Nothing to report for her this semester
+      continue
+
+    yield get_sister_row(sister, events, sister_records, extra_points.get(sister.id, 0), time_threshold)
+
+# Returns the export row for one sister.
+# records maps event id to (status, is_required, required_override)
+# for each of her attendance records in the semester.
+def get_sister_row(sister, events, records, extra, time_threshold):
+  codes = []
+  earned_points = 0
+  total_points = 0
+  for event in events:
+    status, is_required, required_override = records.get(
+      event.id, (AttendanceRecord.ABSENT, False, None))
+    if event.uses_eligibility_rule():
+      if required_override is not None:
+        is_required = required_override
+      else:
+        is_required = event.is_eligible(sister.status, sister.class_year)
+    event_status = EventStatus(is_required=is_required, status=status)
+
+    if event.date > time_threshold:
+      codes.append(CODES.get(status, 'R' if is_required else ''))
+      continue
+    if is_required or status == AttendanceRecord.ATTENDED:
+      codes.append(CODES.get(status, 'M'))
+    else:
+      codes.append('')
+    # Same totals as scoring.get_scores
+    if is_required and event.is_mandatory:
+      total_points += event.points
+    earned_points += get_earned_points(event.points, event_status)
+
+  score = Score(earned_points=earned_points + extra, total_points=total_points, extra_points=extra)
+  fraction = score.fraction()
+  if fraction is None:
+    percentage = ''
+  else:
+    percentage = '%.1f%%' % (fraction*100)
+  return [str(sister), sister.class_year] + codes + \
+    [score.earned_points, score.total_points, score.extra_points, percentage]
@@ -0,0 +1,156 @@
+from __future__ import unicode_literals
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from .models import AttendanceLedger, AttendanceRecord, Event, ExtraPoints
+from .scoring import get_scores
+from general.models import Sister
+
+# The attendance ledger stores each sister's Score for a semester
+# (see AttendanceLedger), so the sisters page reads one row per sister
+# instead of scoring everyone on every page view.
+#
+# Views that change attendance call refresh_ledger for the sisters they
+# touched, or invalidate_ledger when a whole event changed. Rows that are
+# missing or out of date are recomputed the next time they're read.
+
+# Recomputes the ledger rows for the given sisters in the given semester.
+# Returns a dict mapping each sister id to her AttendanceLedger row.
+def refresh_ledger(semester_id, sister_ids):
+  sister_ids = list(sister_ids)
+  try:
+    with transaction.atomic():
+      return _refresh_rows(semester_id, sister_ids)
+  except IntegrityError:
+    # Someone else created some of these rows at the same time. They
+    # exist now, so this time they're locked and recomputed like the rest.
+    with transaction.atomic():
+      return _refresh_rows(semester_id, sister_ids)
+
+# Does the work of refresh_ledger inside its transaction.
+# The existing rows are locked before the scores are computed, so that
+# when two refreshes of the same sister overlap (e.g. a check-in and an
+# uncheck), the one that writes last also reads last, and an older
+# score never overwrites a newer one.
+# Raises IntegrityError if another refresh created one of the missing
+# rows first.
+def _refresh_rows(semester_id, sister_ids):
+  rows = dict(
+    (row.sister_id, row) for row in
+    AttendanceLedger.objects.select_for_update()
+      .filter(semester_id=semester_id, sister_id__in=sister_ids))
+  time_threshold = timezone.now()
+  scores = get_scores(sister_ids, semester_id, time_threshold)
+  valid_until = get_next_event_date(semester_id, time_threshold)
+
+  new_rows = []
+  changed_rows = []
+  for sister_id in sister_ids:
+    score = scores[sister_id]
+    row = rows.get(sister_id)
+    if row is None:
+      row = AttendanceLedger(sister_id=sister_id, semester_id=semester_id)
+      new_rows.append(row)
+    elif _matches(row, score, valid_until):
+      # Nothing changed, so don't write anything
+      continue
+    else:
+      changed_rows.append(row)
+    row.earned_points = score.earned_points
+    row.total_points = score.total_points
+    row.extra_points = score.extra_points
+    row.percentage = score.fraction()
+    row.valid_until = valid_until
+    rows[sister_id] = row
+
+  # Every row expires when the next event starts, so after that the
+  # whole chapter is usually rewritten at once
+  _update_rows(changed_rows, valid_until)
+  AttendanceLedger.objects.bulk_create(new_rows)
+  return rows
+
+# Returns a dict mapping each sister id to her up-to-date AttendanceLedger
+# row for the semester, recomputing only rows that are missing or stale.
+def get_ledger(semester_id, sister_ids):
+  sister_ids = list(sister_ids)
+  now = timezone.now()
+  rows = {}
+  stale_ids = set(sister_ids)
+  for row in AttendanceLedger.objects.filter(semester_id=semester_id, sister_id__in=sister_ids):
+    rows[row.sister_id] = row
+    if row.valid_until is None or row.valid_until > now:
+      stale_ids.discard(row.sister_id)
+
+  if stale_ids:
+    rows.update(refresh_ledger(semester_id, stale_ids))
+  return rows
+
+# Marks every ledger row for the semester as out of date, so each is
+# recomputed the next time it's read.
+# Used when an event changed in a way that can affect every sister.
+def invalidate_ledger(semester_id):
+  AttendanceLedger.objects \
+    .filter(semester_id=semester_id) \
+    .update(valid_until=timezone.now())
+
+# Returns the date of the first event in the semester after time_threshold,
+# or None if there isn't one.
+def get_next_event_date(semester_id, time_threshold):
+  next_event = Event.objects \
+    .filter(semester_id=semester_id, date__gt=time_threshold) \
+    .order_by('date') \
+    .values_list('date', flat=True) \
+    .first()
+  return next_event
+
+# Returns the ids of every sister who has a ledger row, attendance
+# information, or extra points in the semester, or who is required by
+# one of its events.
+def get_ledger_sister_ids(semester_id):
+  sister_ids = set(AttendanceLedger.objects
+    .filter(semester_id=semester_id)
+    .values_list('sister_id', flat=True))
+  sister_ids.update(AttendanceRecord.objects
+    .filter(event__semester_id=semester_id)
+    .values_list('sister_id', flat=True))
+  sister_ids.update(ExtraPoints.objects
+    .filter(semester_id=semester_id)
+    .values_list('sister_id', flat=True))
+  # Sisters required by an eligibility rule don't need a record
+  eligibility_q = None
+  for event in Event.objects.filter(semester_id=semester_id, is_finalized=False).exclude(eligible_statuses=''):
+    if eligibility_q is None:
+      eligibility_q = event.get_eligibility_q()
+    else:
+      eligibility_q |= event.get_eligibility_q()
+  if eligibility_q is not None:
+    sister_ids.update(Sister.objects
+      .filter(eligibility_q)
+      .values_list('id', flat=True))
+  return sister_ids
+
+# Saves the numbers on the given existing ledger rows, which all have
+# the given valid_until, with a single UPDATE.
+def _update_rows(rows, valid_until):
+  if not rows:
+    return
+  def value_for_each_row(field_name):
+    return Case(
+      *[When(id=row.id, then=Value(getattr(row, field_name))) for row in rows],
+      output_field=AttendanceLedger._meta.get_field(field_name))
+  AttendanceLedger.objects.filter(id__in=[row.id for row in rows]).update(
+    earned_points=value_for_each_row('earned_points'),
+    total_points=value_for_each_row('total_points'),
+    extra_points=value_for_each_row('extra_points'),
+    percentage=value_for_each_row('percentage'),
+    valid_until=valid_until)
+
+# Returns true if the ledger row already has the given Score.
+def _matches(row, score, valid_until):
+  return row.earned_points == score.earned_points and \
+    row.total_points == score.total_points and \
+    row.extra_points == score.extra_points and \
+    row.percentage == score.fraction() and \
+    row.valid_until == valid_until
@@ -0,0 +1,33 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.export import get_export_filename, iter_attendance_csv
+from attendance.models import Semester
+
+# Writes the same CSV export as the sisters page's download link, one
+# file per semester.
+# Usage: python manage.py export_attendance [--semester ID ...] [--output-dir DIR]
+class Command(BaseCommand):
+  help = 'Exports each semester\'s attendance to a CSV file.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--semester', type=int, action='append', dest='semester_ids',
+      help='ID of a semester to export. Can be given more than once. Defaults to every semester.')
+    parser.add_argument('--output-dir', default='.', dest='output_dir',
+      help='Directory to write the files to. Defaults to the current directory.')
+
+  def handle(self, *args, **options):
+    if options['semester_ids']:
+      semesters = Semester.objects.filter(id__in=options['semester_ids'])
+      if len(semesters) != len(set(options['semester_ids'])):
+        raise CommandError('Unknown semester in %s' % options['semester_ids'])
+    else:
+      semesters = Semester.objects.all()
+
+    for semester in semesters:
+      path = os.path.join(options['output_dir'], get_export_filename(semester))
+      with open(path, 'w') as output:
+        for line in iter_attendance_csv(semester.id):
+          output.write(line)
+      self.stdout.write('%s: wrote %s' % (semester, path))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from attendance.models import finalize_past_events
+
+# Saves the snapshot of who was required at every event that uses an
+# eligibility rule and has already started (see Event), so that pages
+# reading those events never have to.
+# Usage: python manage.py finalize_past_events
+# Meant to run from cron, e.g. every few minutes.
+class Command(BaseCommand):
+  help = 'Finalizes who was required at events that have already started.'
+
+  def handle(self, *args, **options):
+    events = finalize_past_events()
+    self.stdout.write('Finalized %d events' % len(events))
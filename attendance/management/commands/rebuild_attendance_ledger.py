@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from attendance.ledger import get_ledger_sister_ids, get_next_event_date
+from attendance.models import AttendanceLedger, Semester
+from attendance.scoring import get_scores
+
+# Rebuilds the attendance ledger from scratch and reports any rows that
+# didn't match the live calculation.
+# Usage: python manage.py rebuild_attendance_ledger [--semester ID ...] [--check]
+class Command(BaseCommand):
+  help = 'Rebuilds the attendance ledger and checks it against the live calculation.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--semester', type=int, action='append', dest='semester_ids',
+      help='ID of a semester to rebuild. Can be given more than once. Defaults to every semester.')
+    parser.add_argument('--check', action='store_true', dest='check',
+      help="Only compare the ledger with the live calculation; don't rewrite it.")
+
+  def handle(self, *args, **options):
+    if options['semester_ids']:
+      semesters = Semester.objects.filter(id__in=options['semester_ids'])
+      if len(semesters) != len(set(options['semester_ids'])):
+        raise CommandError('Unknown semester in %s' % options['semester_ids'])
+    else:
+      semesters = Semester.objects.all()
+
+    num_mismatched = 0
+    for semester in semesters:
+      num_mismatched += self.rebuild(semester, options['check'])
+
+    if options['check'] and num_mismatched:
+      raise CommandError('%d ledger rows did not match the live calculation.' % num_mismatched)
+
+  # Compares the ledger rows for the semester with the live calculation
+  # and, unless check_only is set, replaces them.
+  # Returns the number of up-to-date rows that didn't match.
+  def rebuild(self, semester, check_only):
+    time_threshold = timezone.now()
+    sister_ids = get_ledger_sister_ids(semester.id)
+    scores = get_scores(sister_ids, semester.id, time_threshold)
+    rows = dict(
+      (row.sister_id, row) for row in
+      AttendanceLedger.objects.filter(semester=semester).select_related('sister'))
+
+    # Rows that are missing or past their valid_until are expected to
+    # differ; they get recomputed the next time they're read anyway.
+    num_stale = 0
+    num_mismatched = 0
+    for sister_id, score in scores.items():
+      row = rows.get(sister_id)
+      if row is None or (row.valid_until is not None and row.valid_until <= time_threshold):
+        num_stale += 1
+      elif (row.earned_points, row.total_points, row.extra_points, row.percentage) != \
+          (score.earned_points, score.total_points, score.extra_points, score.fraction()):
+        num_mismatched += 1
+        self.stdout.write('%s: %s has %s/%s points in the ledger but %s/%s live' % (
+          semester, row.sister, row.earned_points, row.total_points,
+          score.earned_points, score.total_points))
+
+    if not check_only:
+      valid_until = get_next_event_date(semester.id, time_threshold)
+      with transaction.atomic():
+        AttendanceLedger.objects.filter(semester=semester).delete()
+        AttendanceLedger.objects.bulk_create([
+          AttendanceLedger(
+            sister_id=sister_id,
+            semester=semester,
+            earned_points=score.earned_points,
+            total_points=score.total_points,
+            extra_points=score.extra_points,
+            percentage=score.fraction(),
+            valid_until=valid_until)
+          for sister_id, score in scores.items()
+        ])
+
+    self.stdout.write('%s: %d sisters, %d stale or missing, %d mismatched' % (
+      semester, len(scores), num_stale, num_mismatched))
+    return num_mismatched
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from attendance.outbox import send_queued_emails
+
+# Sends the emails queued by the attendance views.
+# Usage: python manage.py send_queued_emails [--batch-size N] [--loop [--interval SECONDS]]
+# Without --loop, sends everything that's due and exits, e.g. from cron.
+class Command(BaseCommand):
+  help = 'Sends queued attendance emails, retrying ones that failed.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=50, dest='batch_size',
+      help='Number of emails to send over each SMTP connection.')
+    parser.add_argument('--loop', action='store_true', dest='loop',
+      help='Keep running, checking for new emails every --interval seconds.')
+    parser.add_argument('--interval', type=int, default=10, dest='interval',
+      help='Seconds to wait between checks when running with --loop.')
+
+  def handle(self, *args, **options):
+    while True:
+      total_sent = 0
+      total_failed = 0
+      # Stop once a batch doesn't send anything, so that emails
+      # that keep failing aren't retried over and over in one run
+      while True:
+        num_sent, num_failed = send_queued_emails(options['batch_size'])
+        total_sent += num_sent
+        total_failed += num_failed
+        if num_sent == 0:
+          break
+      if total_sent or total_failed:
+        self.stdout.write('Sent %d emails, %d failed' % (total_sent, total_failed))
+
+      if not options['loop']:
+        break
+      time.sleep(options['interval'])
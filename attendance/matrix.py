@@ -0,0 +1,136 @@
+from __future__ import unicode_literals
+
+import numpy
+
+from django.utils import timezone
+
+from .models import AttendanceRecord, Event
+from .scoring import TARGET_PERCENTAGE, Score, get_event_statuses, get_extra_points
+
+# Attendance matrix for chapter-wide statistics.
+#
+# Loads a semester into a dense sister x event matrix of statuses, plus a
+# matching matrix of which sisters were required, so that every sister's
+# points, per-event turnout and the spread of percentages come out of a
+# few NumPy operations instead of a Python loop per sister.
+#
+# NumPy is optional: views only import this module if it's installed.
+
+# Upper edges of the buckets that sisters below TARGET_PERCENTAGE are
+# counted in, for get_below_target_distribution.
+BELOW_TARGET_BINS = (0, .5, .6, .7, .8, TARGET_PERCENTAGE)
+
+class AttendanceMatrix(object):
+  # sister_ids: list of n sister ids, one per row.
+  # events: list of m events, one per column.
+  # statuses: n x m int8 array of AttendanceRecord statuses.
+  # required: n x m bool array, whether each sister was required at each event.
+  # extra_points: length n array of each sister's extra points.
+  def __init__(self, sister_ids, events, statuses, required, extra_points):
+    self.sister_ids = sister_ids
+    self.events = events
+    self.statuses = statuses
+    self.required = required
+    self.extra_points = extra_points
+    self.points = numpy.array([event.points for event in events], dtype=float)
+    self.is_mandatory = numpy.array([event.is_mandatory for event in events], dtype=bool)
+
+  # Returns each sister's earned points, including extra points,
+  # following the same rules as scoring.get_earned_points.
+  def get_earned_points(self):
+    attended = self.statuses == AttendanceRecord.ATTENDED
+    full = attended | (self.required & (self.statuses == AttendanceRecord.FREEBIED))
+    excused = self.required & (self.statuses == AttendanceRecord.EXCUSED)
+    return full.dot(self.points) \
+      + Event.VALUE_OF_EXCUSED_ABSENCE*excused.dot(self.points) \
+      + self.extra_points
+
+  # Returns each sister's points for mandatory events she was required at.
+  def get_total_points(self):
+    return (self.required & self.is_mandatory).dot(self.points)
+
+  # Returns each sister's earned / total points, with NaN for
+  # sisters who had no mandatory points to earn.
+  def get_fractions(self):
+    total_points = self.get_total_points()
+    fractions = numpy.full(len(self.sister_ids), numpy.nan)
+    has_total = total_points > 0
+    fractions[has_total] = self.get_earned_points()[has_total]/total_points[has_total]
+    return fractions
+
+  # Returns a dict mapping sister id to Score, like scoring.get_scores.
+  def get_scores(self):
+    earned_points = self.get_earned_points()
+    total_points = self.get_total_points()
+    return dict(
+      (sister_id, Score(
+        earned_points=earned_points[i],
+        total_points=total_points[i],
+        extra_points=self.extra_points[i]))
+      for i, sister_id in enumerate(self.sister_ids))
+
+  # Returns a list of (event, num_attended, num_required, fraction) for
+  # each event, where fraction is the share of required sisters who
+  # attended, or None if no one was required.
+  def get_turnout(self):
+    attended = self.statuses == AttendanceRecord.ATTENDED
+    num_attended = attended.sum(axis=0)
+    num_required = self.required.sum(axis=0)
+    num_required_attended = (attended & self.required).sum(axis=0)
+    turnout = []
+    for j, event in enumerate(self.events):
+      fraction = None
+      if num_required[j]:
+        fraction = float(num_required_attended[j])/num_required[j]
+      turnout.append((event, int(num_attended[j]), int(num_required[j]), fraction))
+    return turnout
+
+  # Returns a list of (q, fraction) for each percentile q of the sisters'
+  # fractions, leaving out sisters without one. Empty if no one has one.
+  def get_percentiles(self, qs=(10, 25, 50, 75, 90)):
+    fractions = self.get_fractions()
+    fractions = fractions[~numpy.isnan(fractions)]
+    if not len(fractions):
+      return []
+    return list(zip(qs, numpy.percentile(fractions, qs).tolist()))
+
+  # Returns a list of (low, high, count) for each BELOW_TARGET_BINS bucket,
+  # counting the sisters with low <= fraction < high.
+  def get_below_target_distribution(self):
+    fractions = self.get_fractions()
+    fractions = fractions[~numpy.isnan(fractions)]
+    fractions = fractions[fractions < TARGET_PERCENTAGE]
+    counts, edges = numpy.histogram(fractions, bins=BELOW_TARGET_BINS)
+    return [
+      (BELOW_TARGET_BINS[i], BELOW_TARGET_BINS[i + 1], int(count))
+      for i, count in enumerate(counts)
+    ]
+
+# Returns the AttendanceMatrix for the given sisters in the semester,
+# counting only events up to time_threshold (default: now), like
+# scoring.get_scores. Runs the same few queries as get_scores.
+def load_matrix(sister_ids, semester_id, time_threshold=None):
+  if time_threshold is None:
+    time_threshold = timezone.now()
+  sister_ids = list(sister_ids)
+  events = list(Event.objects
+    .filter(semester_id=semester_id, date__lte=time_threshold)
+    .order_by('date', 'id'))
+
+  rows = dict((sister_id, i) for i, sister_id in enumerate(sister_ids))
+  columns = dict((event.id, j) for j, event in enumerate(events))
+  statuses = numpy.zeros((len(sister_ids), len(events)), dtype=numpy.int8)
+  required = numpy.zeros((len(sister_ids), len(events)), dtype=bool)
+
+  event_statuses = get_event_statuses(events, sister_ids)
+  if event_statuses:
+    pairs = list(event_statuses.items())
+    row_indices = [rows[sister_id] for (event_id, sister_id), event_status in pairs]
+    column_indices = [columns[event_id] for (event_id, sister_id), event_status in pairs]
+    statuses[row_indices, column_indices] = [event_status.status for pair, event_status in pairs]
+    required[row_indices, column_indices] = [event_status.is_required for pair, event_status in pairs]
+
+  extra_points = get_extra_points(sister_ids, semester_id)
+  extra_points = numpy.array(
+    [extra_points.get(sister_id, 0) for sister_id in sister_ids], dtype=float)
+  return AttendanceMatrix(sister_ids, events, statuses, required, extra_points)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0001_initial'),
+        ('attendance', '0002_extrapoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('earned_points', models.FloatField(default=0)),
+                ('total_points', models.IntegerField(default=0)),
+                ('extra_points', models.IntegerField(default=0)),
+                ('percentage', models.FloatField(null=True)),
+                ('valid_until', models.DateTimeField(null=True)),
+                ('semester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='attendance.Semester')),
+                ('sister', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='general.Sister')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='attendanceledger',
+            unique_together=set([('sister', 'semester')]),
+        ),
+    ]
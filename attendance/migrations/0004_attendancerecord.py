@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0001_initial'),
+        ('attendance', '0003_attendanceledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.IntegerField(choices=[(0, 'Absent'), (1, 'Attended'), (2, 'Excused'), (3, 'Freebied')], default=0)),
+                ('is_required', models.BooleanField(default=False)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='attendance.Event')),
+                ('sister', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='general.Sister')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='attendancerecord',
+            unique_together=set([('event', 'sister')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='attendancerecord',
+            index_together=set([('event', 'status'), ('sister', 'event')]),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Attendance statuses, in the order the old lists were checked in
+# when a sister was on more than one of them.
+ABSENT = 0
+ATTENDED = 1
+EXCUSED = 2
+FREEBIED = 3
+STATUS_LISTS = [
+  (ATTENDED, 'sisters_attended'),
+  (FREEBIED, 'sisters_freebied'),
+  (EXCUSED, 'sisters_excused'),
+]
+
+# Copies the four attendance lists on Event into AttendanceRecord rows.
+def copy_lists_to_records(apps, schema_editor):
+  Event = apps.get_model('attendance', 'Event')
+  AttendanceRecord = apps.get_model('attendance', 'AttendanceRecord')
+
+  records = {}
+  def get_record(event_id, sister_id):
+    key = (event_id, sister_id)
+    if key not in records:
+      records[key] = AttendanceRecord(event_id=event_id, sister_id=sister_id, status=ABSENT)
+    return records[key]
+
+  required = Event.sisters_required.through.objects.values_list('event_id', 'sister_id')
+  for event_id, sister_id in required.iterator():
+    get_record(event_id, sister_id).is_required = True
+
+  # Go from lowest to highest precedence so the highest one wins
+  for status, field in reversed(STATUS_LISTS):
+    pairs = getattr(Event, field).through.objects.values_list('event_id', 'sister_id')
+    for event_id, sister_id in pairs.iterator():
+      get_record(event_id, sister_id).status = status
+
+  AttendanceRecord.objects.bulk_create(records.values(), batch_size=500)
+
+# Copies AttendanceRecord rows back into the four attendance lists.
+def copy_records_to_lists(apps, schema_editor):
+  Event = apps.get_model('attendance', 'Event')
+  AttendanceRecord = apps.get_model('attendance', 'AttendanceRecord')
+
+  required = Event.sisters_required.through
+  required.objects.bulk_create([
+    required(event_id=event_id, sister_id=sister_id)
+    for event_id, sister_id in AttendanceRecord.objects
+      .filter(is_required=True)
+      .values_list('event_id', 'sister_id')
+  ], batch_size=500)
+
+  for status, field in STATUS_LISTS:
+    through = getattr(Event, field).through
+    through.objects.bulk_create([
+      through(event_id=event_id, sister_id=sister_id)
+      for event_id, sister_id in AttendanceRecord.objects
+        .filter(status=status)
+        .values_list('event_id', 'sister_id')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0004_attendancerecord'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_lists_to_records, copy_records_to_lists),
+    ]
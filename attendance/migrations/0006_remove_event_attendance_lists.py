@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:31
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0005_copy_attendance_lists'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='event',
+            name='sisters_attended',
+        ),
+        migrations.RemoveField(
+            model_name='event',
+            name='sisters_excused',
+        ),
+        migrations.RemoveField(
+            model_name='event',
+            name='sisters_freebied',
+        ),
+        migrations.RemoveField(
+            model_name='event',
+            name='sisters_required',
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0001_initial'),
+        ('attendance', '0006_remove_event_attendance_lists'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncedCheckin',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('action', models.CharField(choices=[('checkin', 'Check in'), ('uncheck', 'Uncheck')], max_length=7)),
+                ('client_timestamp', models.DateTimeField()),
+                ('synced_at', models.DateTimeField(auto_now_add=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='attendance.Event')),
+                ('sister', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='general.Sister')),
+            ],
+        ),
+    ]
@@ -1,9 +1,10 @@
 from __future__ import unicode_literals
 
-from django.db import models
+from django.db import models, transaction
 from django.utils.encoding import python_2_unicode_compatible
 from django.contrib.auth.models import User
 from general.models import Sister
+from django.utils import timezone
 from django.utils.timezone import localtime
 from django.forms import ModelForm
 
@@ -32,20 +33,34 @@ class Semester(models.Model):
 
 @python_2_unicode_compatible
 class Event(models.Model):
+  # Fraction of an event's points earned with an excused absence.
+  VALUE_OF_EXCUSED_ABSENCE = .75
+
   name = models.CharField(max_length=200)
-  date = models.DateTimeField()
+  date = models.DateTimeField(db_index=True)
   is_mandatory = models.BooleanField(default=False)
   is_activated = models.BooleanField(default=False)
   semester = models.ForeignKey(Semester)
 
-  # TODO: Change name to sisters_eligible_to_attend
-  # instead of sisters_required
-  sisters_required = models.ManyToManyField(Sister, blank=True, related_name='sisters_required')
-  sisters_attended = models.ManyToManyField(Sister, blank=True, related_name='sisters_attended')
-  sisters_excused = models.ManyToManyField(Sister, blank=True, related_name='sisters_excused')
-  
-  # List of sisters who used their freebie for this event.
-  sisters_freebied = models.ManyToManyField(Sister, blank=True, related_name='sisters_freebied')
+  # What each sister did is stored in AttendanceRecord, one row per sister.
+  #
+  # Which sisters are required to attend is either
+  #   - an eligibility rule: every sister whose status is one of
+  #     eligible_statuses (and whose class year is eligible_class_year,
+  #     if set), checked against Sister whenever it's needed, or
+  #   - a snapshot: the AttendanceRecords with is_required set.
+  # Events use the rule from activation until they're finalized, which
+  # saves the rule's result as a snapshot (see finalize_event). That
+  # happens from the event details page, or once the event has started
+  # (see finalize_past_events): by the finalize_past_events command, and
+  # before any sister is saved. Pages that only read an event evaluate
+  # the rule and never write the snapshot.
+  # Events without a rule always use the snapshot.
+
+  # Comma-separated Sister statuses, e.g. "0,2". Blank means no rule.
+  eligible_statuses = models.CharField(max_length=50, blank=True, default='')
+  eligible_class_year = models.IntegerField(null=True, blank=True)
+  is_finalized = models.BooleanField(default=False)
 
   points = models.IntegerField()
  
@@ -58,6 +73,92 @@ class Event(models.Model):
     formatted_date = '{dt:%a} {dt.month}/{dt.day}/{dt.year} at {dt:%I}:{dt:%M}{dt:%p}'.format(dt=aware_date)
     return self.name + " | " + formatted_date
 
+  # Returns the sisters who are required to attend this event.
+  def get_required_sisters(self):
+    if not self.uses_eligibility_rule():
+      return Sister.objects.filter(
+        attendancerecord__event=self, attendancerecord__is_required=True)
+
+    included_ids = []
+    excluded_ids = []
+    for sister_id, required_override in AttendanceRecord.objects \
+        .filter(event=self, required_override__isnull=False) \
+        .values_list('sister_id', 'required_override'):
+      if required_override:
+        included_ids.append(sister_id)
+      else:
+        excluded_ids.append(sister_id)
+    return Sister.objects \
+      .filter(self.get_eligibility_q() | models.Q(id__in=included_ids)) \
+      .exclude(id__in=excluded_ids)
+
+  # Returns true if which sisters are required is decided by the
+  # eligibility rule rather than a snapshot.
+  def uses_eligibility_rule(self):
+    return bool(self.eligible_statuses) and not self.is_finalized
+
+  # Returns the list of Sister statuses in the eligibility rule.
+  def get_eligible_statuses(self):
+    if not self.eligible_statuses:
+      return []
+    return [int(status) for status in self.eligible_statuses.split(',')]
+
+  # Sets the eligibility rule. Doesn't save the event.
+  def set_eligibility_rule(self, statuses, class_year=None):
+    self.eligible_statuses = format_eligible_statuses(statuses)
+    self.eligible_class_year = class_year
+
+  # Returns a Q object that matches the sisters the eligibility rule
+  # makes required, before any overrides.
+  def get_eligibility_q(self):
+    q = models.Q(status__in=self.get_eligible_statuses())
+    if self.eligible_class_year is not None:
+      q &= models.Q(class_year=self.eligible_class_year)
+    return q
+
+  # Returns true if the eligibility rule makes a sister with the given
+  # status and class year required, before any overrides.
+  def is_eligible(self, status, class_year):
+    if self.eligible_class_year is not None and class_year != self.eligible_class_year:
+      return False
+    return status in self.get_eligible_statuses()
+
+# A single sister's attendance at a single event.
+# Sisters who aren't required can still have a record, e.g. if they
+# attended anyway (which earns bonus points).
+class AttendanceRecord(models.Model):
+  ABSENT = 0
+  ATTENDED = 1
+  EXCUSED = 2
+  # Used their freebie for this event
+  FREEBIED = 3
+  STATUS = (
+    (ABSENT, 'Absent'),
+    (ATTENDED, 'Attended'),
+    (EXCUSED, 'Excused'),
+    (FREEBIED, 'Freebied'),
+  )
+
+  event = models.ForeignKey(Event)
+  sister = models.ForeignKey(Sister)
+  status = models.IntegerField(choices=STATUS, default=ABSENT)
+  # TODO: Change name to is_eligible_to_attend
+  # Only used once the event's roster is a snapshot (see Event).
+  is_required = models.BooleanField(default=False)
+  # While the event uses an eligibility rule, True or False requires or
+  # excuses this sister regardless of the rule. None follows the rule.
+  required_override = models.NullBooleanField()
+
+  class Meta:
+    # There should only be one entry for an event-sister pair
+    unique_together = ('event', 'sister')
+    # (event, status) for counting an event's attendance,
+    # (sister, event) for looking up one sister's record.
+    index_together = [
+      ('event', 'status'),
+      ('sister', 'event'),
+    ]
+
 
 class Excuse(models.Model):
   PENDING = 0
@@ -79,6 +180,11 @@ class Excuse(models.Model):
   # and do not need to attend.
   is_freebie = models.BooleanField(default=False)
 
+  class Meta:
+    # For finding the pending excuses without scanning every excuse
+    # ever filed; they're then sorted by the event's (indexed) date.
+    index_together = [('status', 'event')]
+
 class ExtraPoints(models.Model):
   # ExtraPoints represents giving a sister extra points for a certain semester.
 
@@ -92,4 +198,153 @@ class ExtraPoints(models.Model):
 class ExtraPointsForm(ModelForm):
   class Meta:
     model = ExtraPoints
-    fields = ['semester', 'sister', 'points', 'reason']
\ No newline at end of file
+    fields = ['semester', 'sister', 'points', 'reason']
+
+# A sister's attendance totals for one semester, kept up to date by
+# attendance/ledger.py so that pages listing many sisters don't have to
+# score every sister from scratch.
+# The numbers are the same ones scoring.get_scores returns.
+class AttendanceLedger(models.Model):
+  sister = models.ForeignKey(Sister)
+  semester = models.ForeignKey(Semester)
+
+  # Includes extra_points, like scoring.Score.earned_points
+  earned_points = models.FloatField(default=0)
+  total_points = models.IntegerField(default=0)
+  extra_points = models.IntegerField(default=0)
+  # Null if there were no mandatory points to earn
+  percentage = models.FloatField(null=True)
+
+  # The totals only count events that have already happened, so they
+  # go out of date once the next event starts, even if nothing is saved.
+  # Null means there were no upcoming events in the semester.
+  valid_until = models.DateTimeField(null=True)
+
+  class Meta:
+    # There should only be one entry for a sister-semester pair
+    unique_together = ('sister', 'semester')
+
+# A check-in or uncheck that a kiosk queued while offline and later sent
+# to the batch sync endpoint (see attendance/checkin_sync.py).
+# Kept so that a batch that gets sent twice isn't applied twice.
+class SyncedCheckin(models.Model):
+  CHECKIN = 'checkin'
+  UNCHECK = 'uncheck'
+  ACTION = (
+    (CHECKIN, 'Check in'),
+    (UNCHECK, 'Uncheck'),
+  )
+
+  # Chosen by the kiosk, unique for every tap
+  key = models.CharField(max_length=64, unique=True)
+  event = models.ForeignKey(Event)
+  sister = models.ForeignKey(Sister)
+  action = models.CharField(choices=ACTION, max_length=7)
+  # When the tap happened on the kiosk
+  client_timestamp = models.DateTimeField()
+  # When the tap reached the server
+  synced_at = models.DateTimeField(auto_now_add=True)
+
+# An email waiting to be sent by the send_queued_emails command
+# (see attendance/outbox.py), so that views don't wait on SMTP.
+class OutgoingEmail(models.Model):
+  PENDING = 0
+  SENT = 1
+  # Gave up after too many attempts
+  FAILED = 2
+  STATUS = (
+    (PENDING, 'Pending'),
+    (SENT, 'Sent'),
+    (FAILED, 'Failed'),
+  )
+
+  subject = models.CharField(max_length=200)
+  body = models.TextField()
+  from_email = models.CharField(max_length=200)
+  recipient = models.EmailField()
+  status = models.IntegerField(choices=STATUS, default=PENDING)
+
+  # Number of times sending has failed so far
+  attempts = models.IntegerField(default=0)
+  # Don't try sending before this time
+  next_attempt_at = models.DateTimeField(default=timezone.now)
+  # Set by the worker that claimed the email (see outbox.send_queued_emails)
+  claimed_by = models.CharField(max_length=32, blank=True, db_index=True)
+  last_error = models.TextField(blank=True)
+  created_at = models.DateTimeField(auto_now_add=True)
+  sent_at = models.DateTimeField(null=True, blank=True)
+
+  class Meta:
+    # For finding the emails that are due
+    index_together = [('status', 'next_attempt_at')]
+
+
+##########################
+##### HELPER METHODS #####
+##########################
+
+# Returns the list of Sister statuses as stored in Event.eligible_statuses.
+def format_eligible_statuses(statuses):
+  return ','.join(str(status) for status in sorted(statuses))
+
+# Sets the sister's attendance status for the event, creating her
+# attendance record if she doesn't have one yet.
+def set_attendance_status(event, sister, status):
+  AttendanceRecord.objects.update_or_create(
+    event=event, sister=sister, defaults={'status': status})
+
+# Makes exactly the given sisters required to attend the event.
+# Records that already exist keep their status.
+def set_required_sisters(event, sisters):
+  set_required_sisters_for_events([event], sisters)
+
+# Makes exactly the given sisters required to attend each of the events.
+# Records that already exist keep their status, and the missing ones are
+# written with bulk inserts, so the number of queries doesn't depend on
+# how many events or sisters there are.
+def set_required_sisters_for_events(events, sisters):
+  event_ids = set(event.id for event in events)
+  sister_ids = set(sister.id for sister in sisters)
+  records = AttendanceRecord.objects.filter(event_id__in=event_ids)
+  with transaction.atomic():
+    records.exclude(sister_id__in=sister_ids).update(is_required=False)
+    records.filter(sister_id__in=sister_ids).update(is_required=True)
+    existing = set(records.values_list('event_id', 'sister_id'))
+    AttendanceRecord.objects.bulk_create([
+      AttendanceRecord(event_id=event_id, sister_id=sister_id, is_required=True)
+      for event_id in event_ids
+      for sister_id in sister_ids
+      if (event_id, sister_id) not in existing
+    ], batch_size=500)
+
+# Saves which sisters the event's eligibility rule currently requires
+# as its snapshot, so that later changes to sisters' statuses don't
+# change who was required. Does nothing if the event doesn't use a rule.
+def finalize_event(event):
+  if not event.uses_eligibility_rule():
+    return
+  with transaction.atomic():
+    # Lock the event, so that two finalizations of it take turns instead
+    # of both inserting the same records
+    list(Event.objects.select_for_update().filter(id=event.id).values_list('id'))
+    set_required_sisters(event, list(event.get_required_sisters()))
+    event.is_finalized = True
+    event.save(update_fields=['is_finalized'])
+
+# Finalizes every event that uses an eligibility rule and has already
+# started, so that who was required at a past event doesn't change when
+# sisters' statuses or class years do later.
+# Runs before a sister is saved and from the finalize_past_events
+# command, never from pages that only read events.
+# Returns the events it finalized.
+def finalize_past_events():
+  with transaction.atomic():
+    # The events are locked and re-read, so a concurrent run waits here
+    # and then skips the ones this run finalized
+    events = list(Event.objects
+      .select_for_update()
+      .filter(is_finalized=False, date__lte=timezone.now())
+      .exclude(eligible_statuses=''))
+    for event in events:
+      finalize_event(event)
+  return events
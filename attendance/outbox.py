@@ -0,0 +1,117 @@
+from __future__ import unicode_literals
+
+import datetime
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+# Email outbox.
+#
+# Views call queue_email, which only saves an OutgoingEmail, so it commits
+# or rolls back together with whatever else the view saved. The
+# send_queued_emails management command sends the queue in batches over
+# a single SMTP connection, retrying failures with exponential backoff.
+# Each batch is claimed before it's sent, so workers that overlap (e.g.
+# two cron runs) never send the same email twice.
+
+# Number of failed attempts before an email is marked as FAILED.
+MAX_ATTEMPTS = 5
+# Seconds to wait after the first failure; doubles after each one.
+RETRY_DELAY = 60
+# Seconds a worker has to send the emails it claimed. If it dies first,
+# they're due again after this long.
+CLAIM_TIMEOUT = 600
+
+# Queues an email to be sent by the next send_queued_emails run.
+# Returns the OutgoingEmail.
+def queue_email(subject, body, recipient):
+  email = _build_email(subject, body, recipient)
+  email.save()
+  return email
+
+# Queues many emails with one insert.
+# emails is a list of (subject, body, recipient) tuples.
+def queue_emails(emails):
+  OutgoingEmail.objects.bulk_create([
+    _build_email(subject, body, recipient)
+    for subject, body, recipient in emails
+  ])
+
+# Returns an unsaved OutgoingEmail from the site's address.
+def _build_email(subject, body, recipient):
+  return OutgoingEmail(
+    subject=subject,
+    body=body,
+    from_email=settings.EMAIL_HOST_USER,
+    recipient=recipient)
+
+# Sends up to batch_size emails that are due, over one connection.
+# Returns the number sent and the number that failed.
+def send_queued_emails(batch_size=50):
+  now = timezone.now()
+  emails = _claim_emails(batch_size, now)
+  if not emails:
+    return 0, 0
+
+  num_sent = 0
+  connection = get_connection(fail_silently=False)
+  try:
+    connection.open()
+  except Exception as e:
+    # Couldn't reach the server, so the whole batch failed
+    for email in emails:
+      _record_failure(email, e, now)
+    return 0, len(emails)
+
+  try:
+    for email in emails:
+      message = EmailMessage(
+        email.subject, email.body, email.from_email, [email.recipient],
+        connection=connection)
+      try:
+        message.send()
+      except Exception as e:
+        _record_failure(email, e, now)
+      else:
+        email.status = OutgoingEmail.SENT
+        email.sent_at = timezone.now()
+        email.save(update_fields=['status', 'sent_at'])
+        num_sent += 1
+  finally:
+    connection.close()
+  return num_sent, len(emails) - num_sent
+
+# Claims up to batch_size emails that are due and returns them.
+# Claiming pushes their next attempt CLAIM_TIMEOUT into the future with
+# a conditional UPDATE, so another worker's claim can't match the same
+# rows, whichever commits first.
+def _claim_emails(batch_size, now):
+  claim = uuid.uuid4().hex
+  with transaction.atomic():
+    due_ids = list(OutgoingEmail.objects
+      .filter(status=OutgoingEmail.PENDING, next_attempt_at__lte=now)
+      .order_by('next_attempt_at', 'id')
+      .values_list('id', flat=True)[:batch_size])
+    OutgoingEmail.objects \
+      .filter(id__in=due_ids, status=OutgoingEmail.PENDING, next_attempt_at__lte=now) \
+      .update(claimed_by=claim, next_attempt_at=now + datetime.timedelta(seconds=CLAIM_TIMEOUT))
+  return list(OutgoingEmail.objects
+    .filter(claimed_by=claim)
+    .order_by('id'))
+
+# Schedules the next attempt for an email that couldn't be sent,
+# or gives up on it after MAX_ATTEMPTS.
+def _record_failure(email, error, now):
+  email.attempts += 1
+  email.last_error = '%s: %s' % (error.__class__.__name__, error)
+  if email.attempts >= MAX_ATTEMPTS:
+    email.status = OutgoingEmail.FAILED
+  else:
+    delay = RETRY_DELAY * 2**(email.attempts - 1)
+    email.next_attempt_at = now + datetime.timedelta(seconds=delay)
+  email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
@@ -0,0 +1,246 @@
+from __future__ import unicode_literals
+
+import math
+from collections import defaultdict, namedtuple
+
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import AttendanceRecord, Event, ExtraPoints
+from general.models import Sister
+
+# Attendance scoring.
+# Everything here works on whole sets of sisters and events at once,
+# so the number of queries doesn't depend on how many sisters or
+# events there are.
+
+##################
+##### STATUS #####
+##################
+
+# How a sister relates to a single event.
+# is_required: whether the sister was required to attend.
+# status: one of the AttendanceRecord statuses.
+EventStatus = namedtuple('EventStatus', ['is_required', 'status'])
+
+# For sisters without an attendance record.
+NOT_REQUIRED = EventStatus(is_required=False, status=AttendanceRecord.ABSENT)
+
+# Returns a dict mapping (event_id, sister_id) to the EventStatus of that
+# sister at that event.
+# events is a queryset or list of events.
+# If sister_ids is given, only those sisters are looked up.
+# Pairs that don't appear in the dict are NOT_REQUIRED.
+# Events that use an eligibility rule (see Event) are checked against
+# the sisters' current statuses.
+# Runs at most three queries: the events (if given a queryset), their
+# attendance records, and the sisters for any eligibility rules.
+# Never writes, even for past events that aren't finalized yet.
+def get_event_statuses(events, sister_ids=None):
+  events = list(events)
+  records = AttendanceRecord.objects.filter(event__in=events)
+  if sister_ids is not None:
+    records = records.filter(sister_id__in=sister_ids)
+  statuses = {}
+  overrides = {}
+  for event_id, sister_id, is_required, required_override, status in \
+      records.values_list('event_id', 'sister_id', 'is_required', 'required_override', 'status'):
+    statuses[(event_id, sister_id)] = EventStatus(is_required=is_required, status=status)
+    if required_override is not None:
+      overrides[(event_id, sister_id)] = required_override
+
+  rule_events = [event for event in events if event.uses_eligibility_rule()]
+  if rule_events:
+    _apply_eligibility_rules(rule_events, sister_ids, statuses, overrides)
+  return statuses
+
+# Updates statuses (from get_event_statuses) so that each of rule_events
+# requires the sisters its eligibility rule and overrides say it does.
+def _apply_eligibility_rules(rule_events, sister_ids, statuses, overrides):
+  eligible_statuses = set()
+  for event in rule_events:
+    eligible_statuses.update(event.get_eligible_statuses())
+  sisters = Sister.objects.filter(status__in=eligible_statuses)
+  if sister_ids is not None:
+    sisters = sisters.filter(id__in=sister_ids)
+  sister_fields = list(sisters.values_list('id', 'status', 'class_year'))
+
+  # The sisters with a record at each rule event, so that each event
+  # only looks at its own records
+  rule_event_ids = set(event.id for event in rule_events)
+  record_sister_ids = defaultdict(list)
+  for event_id, sister_id in statuses:
+    if event_id in rule_event_ids:
+      record_sister_ids[event_id].append(sister_id)
+
+  for event in rule_events:
+    eligible_ids = set(
+      sister_id for sister_id, status, class_year in sister_fields
+      if event.is_eligible(status, class_year))
+    for sister_id in record_sister_ids[event.id]:
+      key = (event.id, sister_id)
+      is_required = overrides.get(key, sister_id in eligible_ids)
+      statuses[key] = statuses[key]._replace(is_required=is_required)
+    # Sisters the rule requires who don't have a record yet
+    for sister_id in eligible_ids:
+      if (event.id, sister_id) not in statuses:
+        statuses[(event.id, sister_id)] = EventStatus(
+          is_required=True, status=AttendanceRecord.ABSENT)
+
+# Returns the number of points a sister earned for a single event.
+# Attending or using a freebie earns all of the points, and an excused
+# absence earns Event.VALUE_OF_EXCUSED_ABSENCE of them.
+# Sisters who weren't required only get points by attending (a bonus).
+def get_earned_points(points, event_status):
+  if event_status.is_required:
+    if event_status.status in (AttendanceRecord.ATTENDED, AttendanceRecord.FREEBIED):
+      return points
+    elif event_status.status == AttendanceRecord.EXCUSED:
+      return Event.VALUE_OF_EXCUSED_ABSENCE*points
+  elif event_status.status == AttendanceRecord.ATTENDED:
+    return points
+  return 0
+
+##################
+##### SCORES #####
+##################
+
+# The attendance percentage sisters are expected to keep up.
+TARGET_PERCENTAGE = .85
+
+# A sister's points for a semester.
+# earned_points: points earned from events, plus extra_points.
+# total_points: points for mandatory events she was required at.
+# extra_points: points given to her through ExtraPoints.
+class Score(namedtuple('Score', ['earned_points', 'total_points', 'extra_points'])):
+  __slots__ = ()
+
+  # Returns earned points / total points as a float,
+  # or None if there were no mandatory points to earn.
+  def fraction(self):
+    if self.total_points == 0:
+      return None
+    return float(self.earned_points)/float(self.total_points)
+
+# Returns a dict mapping each sister id in sister_ids to her Score in the
+# given semester, counting only events up to time_threshold (default: now).
+# Runs a fixed number of queries, however many sisters and events there are.
+def get_scores(sister_ids, semester_id, time_threshold=None):
+  if time_threshold is None:
+    time_threshold = timezone.now()
+  sister_ids = list(sister_ids)
+
+  #date__lte means 'date is less than or equal to'
+  past_events = list(Event.objects.filter(semester_id=semester_id, date__lte=time_threshold))
+  events = dict((event.id, event) for event in past_events)
+
+  earned_points = dict((sister_id, 0) for sister_id in sister_ids)
+  total_points = dict((sister_id, 0) for sister_id in sister_ids)
+  for (event_id, sister_id), event_status in get_event_statuses(past_events, sister_ids).items():
+    event = events[event_id]
+    if event_status.is_required and event.is_mandatory:
+      total_points[sister_id] += event.points
+    earned_points[sister_id] += get_earned_points(event.points, event_status)
+
+  extra_points = get_extra_points(sister_ids, semester_id)
+
+  scores = {}
+  for sister_id in sister_ids:
+    extra = extra_points.get(sister_id, 0)
+    scores[sister_id] = Score(
+      earned_points=earned_points[sister_id] + extra,
+      total_points=total_points[sister_id],
+      extra_points=extra)
+  return scores
+
+# Returns a dict mapping sister id to the total extra points she was
+# given in the semester. Sisters without extra points are left out.
+# If sister_ids is None, every sister is included.
+def get_extra_points(sister_ids, semester_id):
+  totals = ExtraPoints.objects.filter(semester_id=semester_id)
+  if sister_ids is not None:
+    totals = totals.filter(sister_id__in=sister_ids)
+  totals = totals \
+    .values('sister_id') \
+    .annotate(total=Sum('points')) \
+    .order_by()
+  return dict((row['sister_id'], row['total']) for row in totals)
+
+# Returns the Score for a single sister.
+def get_score(sister, semester_id, time_threshold=None):
+  return get_scores([sister.id], semester_id, time_threshold)[sister.id]
+
+#####################
+##### FORECASTS #####
+#####################
+
+# Where a sister's percentage could end up by the end of the semester,
+# counting the mandatory events still to come that she's required at.
+# remaining_points: points for those events.
+# points_needed: the fewest of those points she has to earn to finish at
+#   the target percentage, or None if she can't reach it anymore.
+# best_fraction: her final fraction if she attends all of them.
+# worst_fraction: her final fraction if she misses all of them, except
+#   for excuses and freebies that were already approved.
+# Both fractions are None if there are no mandatory points at all.
+class Forecast(namedtuple('Forecast', ['remaining_points', 'points_needed', 'best_fraction', 'worst_fraction'])):
+  __slots__ = ()
+
+  # Whether she can no longer reach the target percentage.
+  def is_at_risk(self):
+    return self.points_needed is None
+
+# Returns a dict mapping each sister id in sister_ids to a pair of
+#   remaining points: points for the future mandatory events she's
+#     required at
+#   guaranteed points: the part of those she'll earn without attending,
+#     from approved excuses and freebies
+# future_events is a list of events that haven't happened yet.
+def get_future_points(future_events, sister_ids):
+  events = dict((event.id, event) for event in future_events if event.is_mandatory)
+  future_points = dict((sister_id, (0, 0)) for sister_id in sister_ids)
+  for (event_id, sister_id), event_status in get_event_statuses(list(events.values()), sister_ids).items():
+    if not event_status.is_required:
+      continue
+    points = events[event_id].points
+    remaining_points, guaranteed_points = future_points[sister_id]
+    future_points[sister_id] = (
+      remaining_points + points,
+      guaranteed_points + get_earned_points(points, event_status))
+  return future_points
+
+# Returns the Forecast for a sister with the given Score so far and
+# future points from get_future_points.
+def get_forecast(score, remaining_points, guaranteed_points=0, target=TARGET_PERCENTAGE):
+  total_points = score.total_points + remaining_points
+  if total_points == 0:
+    return Forecast(remaining_points=0, points_needed=0, best_fraction=None, worst_fraction=None)
+
+  # Rounded first so that floating point error doesn't round up
+  # a whole number of points
+  points_needed = round(target*total_points - score.earned_points, 6)
+  if points_needed > remaining_points:
+    points_needed = None
+  else:
+    points_needed = max(0, int(math.ceil(points_needed)))
+  return Forecast(
+    remaining_points=remaining_points,
+    points_needed=points_needed,
+    best_fraction=float(score.earned_points + remaining_points)/total_points,
+    worst_fraction=float(score.earned_points + guaranteed_points)/total_points)
+
+# Returns a dict mapping each sister id in sister_ids to her Forecast for
+# the semester, from the events after time_threshold (default: now).
+# scores maps sister id to Score so far; by default it's get_scores.
+# Runs a fixed number of queries, however many sisters and events there are.
+def get_forecasts(sister_ids, semester_id, scores=None, time_threshold=None):
+  if time_threshold is None:
+    time_threshold = timezone.now()
+  sister_ids = list(sister_ids)
+  if scores is None:
+    scores = get_scores(sister_ids, semester_id, time_threshold)
+  future_events = Event.objects.filter(semester_id=semester_id, date__gt=time_threshold)
+  future_points = get_future_points(future_events, sister_ids)
+  return dict(
+    (sister_id, get_forecast(scores[sister_id], *future_points[sister_id]))
+    for sister_id in sister_ids)
@@ -0,0 +1,48 @@
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+
+from .models import Semester
+
+# Semester directory.
+#
+# Every attendance page needs the list of semesters (for the semester
+# tabs) and usually the latest one, but semesters only change twice a
+# year. So the list is kept in Django's cache, and cleared by the
+# post_save and post_delete receivers in signals.py whenever a semester
+# changes.
+#
+# With the default per-process cache, only the process that saved the
+# semester sees the change right away; the others see it once
+# CACHE_TIMEOUT runs out. A shared cache (e.g. memcached) doesn't have
+# that problem.
+
+CACHE_KEY = 'attendance:semesters'
+# Seconds
+CACHE_TIMEOUT = 60*60
+
+# Returns a list of every semester, latest first (Semester's ordering).
+def get_semesters():
+  semesters = cache.get(CACHE_KEY)
+  if semesters is None:
+    semesters = list(Semester.objects.all())
+    cache.set(CACHE_KEY, semesters, CACHE_TIMEOUT)
+  return semesters
+
+# Returns the latest semester.
+# Raises IndexError if there aren't any, like Semester.objects.all()[0].
+def get_latest_semester():
+  return get_semesters()[0]
+
+# Returns the semester with the given id.
+# Raises Semester.DoesNotExist if there isn't one, like Semester.objects.get.
+def get_semester(semester_id):
+  semester_id = int(semester_id)
+  for semester in get_semesters():
+    if semester.id == semester_id:
+      return semester
+  raise Semester.DoesNotExist('Semester matching query does not exist.')
+
+# Forgets the cached semesters, so the next read gets them from the database.
+def clear_semester_cache():
+  cache.delete(CACHE_KEY)
@@ -0,0 +1,32 @@
+from __future__ import unicode_literals
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import AttendanceLedger, Semester, finalize_past_events
+from .semesters import clear_semester_cache
+from general.models import Sister
+
+# Past events that use an eligibility rule have to be finalized while
+# the database still has the sister's old status and class year, or
+# she'd be added to (or dropped from) events she was never required at.
+@receiver(pre_save, sender=Sister)
+def finalize_events_before_sister_changes(sender, instance, **kwargs):
+  finalize_past_events()
+
+# Events that use an eligibility rule decide who's required from the
+# sisters' current statuses and class years, so saving a sister can
+# change her totals without any attendance changing.
+@receiver(post_save, sender=Sister)
+def invalidate_sister_ledger(sender, instance, **kwargs):
+  AttendanceLedger.objects \
+    .filter(sister_id=instance.id) \
+    .update(valid_until=timezone.now())
+
+# The semester directory (see semesters.py) is cached, so it has to be
+# cleared whenever a semester is added, changed, or deleted.
+@receiver(post_save, sender=Semester)
+@receiver(post_delete, sender=Semester)
+def clear_semesters(sender, **kwargs):
+  clear_semester_cache()
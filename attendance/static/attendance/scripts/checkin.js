@@ -0,0 +1,47 @@
+// Checks sisters in and out on the event details page without reloading
+// the whole roster. Each check in / uncheck form has a data-json-url that
+// returns the sister's new status and the event's percentages.
+// If anything goes wrong, the form is submitted normally instead.
+
+function submitCheckin(event) {
+  var form = event.target;
+  event.preventDefault();
+
+  var request = new XMLHttpRequest();
+  request.open('POST', form.getAttribute('data-json-url'));
+  request.setRequestHeader('X-CSRFToken',
+    form.querySelector('[name=csrfmiddlewaretoken]').value);
+  request.setRequestHeader('X-Requested-With', 'XMLHttpRequest');
+  request.onload = function() {
+    var contentType = request.getResponseHeader('Content-Type') || '';
+    if (request.status != 200 || contentType.indexOf('application/json') == -1) {
+      // e.g. logged out, so let the normal view deal with it
+      form.submit();
+      return;
+    }
+    updateRoster(JSON.parse(request.responseText));
+  };
+  request.onerror = function() {
+    form.submit();
+  };
+  request.send();
+}
+
+// Redraws one sister's row and the event's percentages
+function updateRoster(data) {
+  var row = document.querySelector('tr[data-sister-id="' + data.sister_id + '"]');
+  row.querySelector('.attended').style.display = data.is_attended ? '' : 'none';
+  row.querySelector('.not-attended').style.display = data.is_attended ? 'none' : '';
+  row.querySelector('.excused').textContent = data.excused_display;
+
+  document.getElementById('percent-attended').textContent = data.percent_attended;
+  document.getElementById('percent-excused').textContent = data.percent_excused;
+  document.getElementById('percent-absent').textContent = data.percent_absent;
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+  var forms = document.querySelectorAll('form.checkin-form');
+  for (var i = 0; i < forms.length; i++) {
+    forms[i].addEventListener('submit', submitCheckin);
+  }
+});
@@ -1,12 +1,31 @@
+import csv
 import datetime
+import json
+import os
+import shutil
+import tempfile
+
+from unittest import skipUnless
 
 from django.test import TestCase
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.auth.models import User
-
-from .models import Event, Semester, Excuse
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.utils.six import StringIO
+from django.test.utils import CaptureQueriesContext
+
+from .models import AttendanceLedger, AttendanceRecord, Event, Semester, Excuse, ExtraPoints, OutgoingEmail, SyncedCheckin, finalize_event, set_attendance_status, set_required_sisters
 from . import views
+from . import export
+from .views import matrix
+from . import ledger
+from . import outbox
+from . import scoring
+from .semesters import get_semesters
 from general.models import Sister
 
 test_email = 'axo.mit.attendance@gmail.com'
@@ -50,6 +69,17 @@ def create_semester(term, year):
   semester = Semester.objects.create(term=term, year=year)
   return semester
 
+# Records that the sisters are required to attend the event.
+def add_required(event, *sisters):
+  for sister in sisters:
+    AttendanceRecord.objects.update_or_create(
+      event=event, sister=sister, defaults={'is_required': True})
+
+# Sets the sisters' attendance status at the event.
+def add_status(event, status, *sisters):
+  for sister in sisters:
+    set_attendance_status(event, sister, status)
+
 # Creates and returns an excuse
 def create_excuse(event, sister, text, status=Excuse.PENDING):
   excuse = Excuse.objects.create(event=event, sister=sister, text=text, status=status)
@@ -110,8 +140,8 @@ class CalculatePercentageTests(TestCase):
     sister = create_sister("reb", Sister.ACTIVE, 2019)
     semester = create_semester(Semester.FALL, 2018)
     event = create_event("yo", -1, 30, semester=semester, is_mandatory=True)
-    event.sisters_required.add(sister)
-    event.sisters_attended.add(sister)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.ATTENDED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -121,8 +151,8 @@ class CalculatePercentageTests(TestCase):
     sister = create_sister("reb", Sister.ACTIVE, 2019)
     semester = create_semester(Semester.FALL, 2018)
     event = create_event("yo", -1, 30, semester=semester, is_mandatory=True)
-    event.sisters_required.add(sister)
-    event.sisters_freebied.add(sister)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.FREEBIED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -132,8 +162,8 @@ class CalculatePercentageTests(TestCase):
     sister = create_sister("reb", Sister.ACTIVE, 2019)
     semester = create_semester(Semester.FALL, 2018)
     event = create_event("yo", -2, 30, semester=semester, is_mandatory=True)
-    event.sisters_required.add(sister)
-    event.sisters_excused.add(sister)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.EXCUSED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -143,7 +173,7 @@ class CalculatePercentageTests(TestCase):
     sister = create_sister("reb", Sister.ACTIVE, 2019)
     semester = create_semester(Semester.FALL, 2018)
     event = create_event("yo", -6, 30, semester=semester, is_mandatory=True)
-    event.sisters_required.add(sister)
+    add_required(event, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -163,8 +193,8 @@ class CalculatePercentageTests(TestCase):
     sister = create_sister("reb", Sister.ACTIVE, 2019)
     semester = create_semester(Semester.FALL, 2018)
     event = create_event("yo", -1000, 30, semester=semester, is_mandatory=False)
-    event.sisters_required.add(sister)
-    event.sisters_attended.add(sister)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.ATTENDED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -177,9 +207,9 @@ class CalculatePercentageTests(TestCase):
     event_mandatory = create_event("chapter", -2, 20, semester=semester, is_mandatory=True)
     event_not = create_event("mixer", -5, 10, semester=semester, is_mandatory=False)
 
-    event_mandatory.sisters_required.add(sister)
-    event_not.sisters_required.add(sister)
-    event_not.sisters_attended.add(sister)
+    add_required(event_mandatory, sister)
+    add_required(event_not, sister)
+    add_status(event_not, AttendanceRecord.ATTENDED, sister)
     # Total points = 20, earned points = 10
 
     percentage = views.calculate_percentage(sister, semester.id)
@@ -192,10 +222,10 @@ class CalculatePercentageTests(TestCase):
     event_mandatory = create_event("chapter", -20, 20, semester=semester, is_mandatory=True)
     event_not = create_event("mixer", -6, 12, semester=semester, is_mandatory=False)
 
-    event_mandatory.sisters_required.add(sister)
-    event_mandatory.sisters_excused.add(sister)
-    event_not.sisters_required.add(sister)
-    event_not.sisters_attended.add(sister)
+    add_required(event_mandatory, sister)
+    add_status(event_mandatory, AttendanceRecord.EXCUSED, sister)
+    add_required(event_not, sister)
+    add_status(event_not, AttendanceRecord.ATTENDED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -211,12 +241,12 @@ class CalculatePercentageTests(TestCase):
     event_not_mandatory1 = create_event("mixer", -5, 12, semester=semester, is_mandatory=False)
     event_not_mandatory2 = create_event("mixer2", -12, 10, semester=semester, is_mandatory=False)
 
-    event_mandatory1.sisters_required.add(sister)
-    event_mandatory2.sisters_required.add(sister)
-    event_not_mandatory1.sisters_required.add(sister)
-    event_not_mandatory2.sisters_required.add(sister)
-    event_not_mandatory1.sisters_attended.add(sister)
-    event_not_mandatory2.sisters_attended.add(sister)
+    add_required(event_mandatory1, sister)
+    add_required(event_mandatory2, sister)
+    add_required(event_not_mandatory1, sister)
+    add_required(event_not_mandatory2, sister)
+    add_status(event_not_mandatory1, AttendanceRecord.ATTENDED, sister)
+    add_status(event_not_mandatory2, AttendanceRecord.ATTENDED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -233,11 +263,11 @@ class CalculatePercentageTests(TestCase):
     event_sem1_notmand = create_event("idkman", days=-1, points=15, semester=semester1, is_mandatory=False)
     event_sem2_mand = create_event("dva shifts", days=-20, points=20, semester=semester2, is_mandatory=True)
 
-    event_sem1_mand.sisters_required.add(sister)
-    event_sem1_notmand.sisters_required.add(sister)
-    event_sem2_mand.sisters_required.add(sister)
-    event_sem1_mand.sisters_excused.add(sister)
-    event_sem2_mand.sisters_attended.add(sister)
+    add_required(event_sem1_mand, sister)
+    add_required(event_sem1_notmand, sister)
+    add_required(event_sem2_mand, sister)
+    add_status(event_sem1_mand, AttendanceRecord.EXCUSED, sister)
+    add_status(event_sem2_mand, AttendanceRecord.ATTENDED, sister)
 
     # Get percentage for semester1
     percentage = views.calculate_percentage(sister, semester1.id)
@@ -262,29 +292,29 @@ class CalculatePercentageTests(TestCase):
     event_sem2_notmand = create_event("zeta psi mixer", days=-5, points=5, semester=semester2, is_mandatory=False)
 
     # sister required at everything except 2017 fireside
-    event_sem1_mand.sisters_required.add(sister)
-    event_sem1_mand2.sisters_required.add(sister)
-    event_sem1_mand3.sisters_required.add(sister)
-    event_sem1_notmand.sisters_required.add(sister)
-    event_sem2_mand.sisters_required.add(sister)
-    event_sem2_notmand.sisters_required.add(sister)
+    add_required(event_sem1_mand, sister)
+    add_required(event_sem1_mand2, sister)
+    add_required(event_sem1_mand3, sister)
+    add_required(event_sem1_notmand, sister)
+    add_required(event_sem2_mand, sister)
+    add_required(event_sem2_notmand, sister)
 
     # sister_other required at everything except 2018 my journey
-    event_sem1_mand.sisters_required.add(sister_other)
-    event_sem1_mand3.sisters_required.add(sister_other)
-    event_sem1_notmand.sisters_required.add(sister_other)
-    event_sem1_notmand2.sisters_required.add(sister_other)
-    event_sem2_mand.sisters_required.add(sister_other)
-    event_sem2_notmand.sisters_required.add(sister_other)
-
-    event_sem1_mand.sisters_attended.add(sister)
-    event_sem1_notmand.sisters_attended.add(sister)
-    event_sem2_mand.sisters_attended.add(sister)
-    event_sem1_mand3.sisters_freebied.add(sister)
-
-    event_sem1_mand.sisters_attended.add(sister_other)
-    event_sem1_notmand2.sisters_attended.add(sister_other)
-    event_sem2_mand.sisters_excused.add(sister_other)
+    add_required(event_sem1_mand, sister_other)
+    add_required(event_sem1_mand3, sister_other)
+    add_required(event_sem1_notmand, sister_other)
+    add_required(event_sem1_notmand2, sister_other)
+    add_required(event_sem2_mand, sister_other)
+    add_required(event_sem2_notmand, sister_other)
+
+    add_status(event_sem1_mand, AttendanceRecord.ATTENDED, sister)
+    add_status(event_sem1_notmand, AttendanceRecord.ATTENDED, sister)
+    add_status(event_sem2_mand, AttendanceRecord.ATTENDED, sister)
+    add_status(event_sem1_mand3, AttendanceRecord.FREEBIED, sister)
+
+    add_status(event_sem1_mand, AttendanceRecord.ATTENDED, sister_other)
+    add_status(event_sem1_notmand2, AttendanceRecord.ATTENDED, sister_other)
+    add_status(event_sem2_mand, AttendanceRecord.EXCUSED, sister_other)
 
     # Get percentage for semester1 for normal sister
     percentage = views.calculate_percentage(sister, semester1.id)
@@ -298,7 +328,7 @@ class CalculatePercentageTests(TestCase):
     sister = create_sister("siena", Sister.ACTIVE, 2018)
     semester = create_semester(Semester.FALL, 2017)
     event = create_event("chapter", 40, 20, semester=semester, is_mandatory=True)
-    event.sisters_required.add(sister)
+    add_required(event, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -308,8 +338,8 @@ class CalculatePercentageTests(TestCase):
     sister = create_sister("siena", Sister.ACTIVE, 2018)
     semester = create_semester(Semester.FALL, 2017)
     event = create_event("chapter", 1, 20, semester=semester, is_mandatory=True)
-    event.sisters_required.add(sister)
-    event.sisters_attended.add(sister)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.ATTENDED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -320,8 +350,8 @@ class CalculatePercentageTests(TestCase):
     semester = create_semester(Semester.FALL, 2017)
     event = create_event("chapter", 2, 20, semester=semester, is_mandatory=True)
 
-    event.sisters_required.add(sister)
-    event.sisters_excused.add(sister)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.EXCUSED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -332,8 +362,8 @@ class CalculatePercentageTests(TestCase):
     semester = create_semester(Semester.FALL, 2017)
     event = create_event("chapter", 2, 20, semester=semester, is_mandatory=True)
 
-    event.sisters_required.add(sister)
-    event.sisters_freebied.add(sister)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.FREEBIED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -345,8 +375,8 @@ class CalculatePercentageTests(TestCase):
     event = create_event("chapter", 2, 20, semester=semester, is_mandatory=True)
     event_past = create_event("idk", -2, 13, semester=semester, is_mandatory=True)
 
-    event.sisters_required.add(sister)
-    event.sisters_excused.add(sister)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.EXCUSED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -362,16 +392,16 @@ class CalculatePercentageTests(TestCase):
     event_future2 = create_event("mixer2", 6, 11, semester=semester, is_mandatory=False)
     event_future3 = create_event("a;oeiifj", 10, 3, semester=semester, is_mandatory=True)
 
-    event_past1.sisters_required.add(sister)
-    event_past1.sisters_attended.add(sister)
-    event_past2.sisters_required.add(sister)
-    event_past3.sisters_required.add(sister)
-    event_past3.sisters_freebied.add(sister)
-    event_future1.sisters_required.add(sister)
-    event_future2.sisters_required.add(sister)
-    event_future1.sisters_excused.add(sister)
-    event_future3.sisters_required.add(sister)
-    event_future3.sisters_freebied.add(sister)
+    add_required(event_past1, sister)
+    add_status(event_past1, AttendanceRecord.ATTENDED, sister)
+    add_required(event_past2, sister)
+    add_required(event_past3, sister)
+    add_status(event_past3, AttendanceRecord.FREEBIED, sister)
+    add_required(event_future1, sister)
+    add_required(event_future2, sister)
+    add_status(event_future1, AttendanceRecord.EXCUSED, sister)
+    add_required(event_future3, sister)
+    add_status(event_future3, AttendanceRecord.FREEBIED, sister)
 
     percentage = views.calculate_percentage(sister, semester.id)
 
@@ -393,19 +423,19 @@ class CalculatePercentageTests(TestCase):
     event_sem2_future_notmand =  create_event("something", days=40, points=20, semester=semester2, is_mandatory=False)
 
     # Past
-    event_sem1_mand.sisters_required.add(sister)
-    event_sem1_notmand.sisters_required.add(sister)
-    event_sem2_mand.sisters_required.add(sister)
-    event_sem1_mand.sisters_attended.add(sister)
-    event_sem1_notmand.sisters_attended.add(sister)
-    event_sem2_mand.sisters_excused.add(sister)
+    add_required(event_sem1_mand, sister)
+    add_required(event_sem1_notmand, sister)
+    add_required(event_sem2_mand, sister)
+    add_status(event_sem1_mand, AttendanceRecord.ATTENDED, sister)
+    add_status(event_sem1_notmand, AttendanceRecord.ATTENDED, sister)
+    add_status(event_sem2_mand, AttendanceRecord.EXCUSED, sister)
 
     # Future
-    event_sem1_future_mand.sisters_required.add(sister)
-    event_sem2_future_mand.sisters_required.add(sister)
-    event_sem2_future_notmand.sisters_required.add(sister)
-    event_sem1_future_mand.sisters_excused.add(sister)
-    event_sem2_future_notmand.sisters_attended.add(sister)
+    add_required(event_sem1_future_mand, sister)
+    add_required(event_sem2_future_mand, sister)
+    add_required(event_sem2_future_notmand, sister)
+    add_status(event_sem1_future_mand, AttendanceRecord.EXCUSED, sister)
+    add_status(event_sem2_future_notmand, AttendanceRecord.ATTENDED, sister)
 
     # Get percentage for semester1
     percentage = views.calculate_percentage(sister, semester1.id)
@@ -417,6 +447,248 @@ class CalculatePercentageTests(TestCase):
     self.assertEqual(percentage, expected_percentage)
 
 
+#########################
+##### SCORING TESTS #####
+#########################
+class ScoringTests(TestCase):
+  def test_get_scores_matches_rules_for_many_sisters(self):
+    attended = create_sister("attended", Sister.ACTIVE, 2018)
+    excused = create_sister("excused", Sister.ACTIVE, 2018)
+    freebied = create_sister("freebied", Sister.ACTIVE, 2019)
+    absent = create_sister("absent", Sister.NEW_MEMBER, 2020)
+    semester = create_semester(Semester.FALL, 2017)
+    chapter = create_event("chapter", -3, 20, semester=semester, is_mandatory=True)
+    mixer = create_event("mixer", -2, 10, semester=semester, is_mandatory=False)
+
+    for sister in [attended, excused, freebied, absent]:
+      add_required(chapter, sister)
+    add_status(chapter, AttendanceRecord.ATTENDED, attended)
+    add_status(chapter, AttendanceRecord.EXCUSED, excused)
+    add_status(chapter, AttendanceRecord.FREEBIED, freebied)
+    # Not required at the mixer, so attending is a bonus
+    add_status(mixer, AttendanceRecord.ATTENDED, absent)
+    ExtraPoints.objects.create(sister=absent, semester=semester, points=3, reason="bro")
+
+    scores = scoring.get_scores([attended.id, excused.id, freebied.id, absent.id], semester.id)
+
+    self.assertEqual(scores[attended.id], scoring.Score(20, 20, 0))
+    self.assertEqual(scores[excused.id], scoring.Score(Event.VALUE_OF_EXCUSED_ABSENCE*20, 20, 0))
+    self.assertEqual(scores[freebied.id], scoring.Score(20, 20, 0))
+    self.assertEqual(scores[absent.id], scoring.Score(10 + 3, 20, 3))
+    for sister in [attended, excused, freebied, absent]:
+      self.assertEqual(scores[sister.id].fraction(), views.calculate_percentage(sister, semester.id))
+
+  def test_get_scores_not_required_freebie_earns_nothing(self):
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    semester = create_semester(Semester.FALL, 2018)
+    freebied = create_event("yo", -1, 30, semester=semester, is_mandatory=True)
+    excused = create_event("yo2", -2, 30, semester=semester, is_mandatory=True)
+    add_status(freebied, AttendanceRecord.FREEBIED, sister)
+    add_status(excused, AttendanceRecord.EXCUSED, sister)
+
+    score = scoring.get_score(sister, semester.id)
+
+    self.assertEqual(score, scoring.Score(0, 0, 0))
+    self.assertEqual(score.fraction(), None)
+
+  def test_get_scores_absent_record_earns_nothing(self):
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    semester = create_semester(Semester.FALL, 2018)
+    event = create_event("yo", -1, 30, semester=semester, is_mandatory=True)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.ABSENT, sister)
+
+    self.assertEqual(scoring.get_score(sister, semester.id).fraction(), 0.0)
+
+  def test_get_scores_query_count_does_not_depend_on_size(self):
+    semester = create_semester(Semester.FALL, 2017)
+    sisters = [create_sister("sis%d" % i, Sister.ACTIVE, 2018) for i in range(10)]
+    for i in range(6):
+      event = create_event("event%d" % i, -i - 1, 10, semester=semester, is_mandatory=True)
+      add_required(event, *sisters)
+      add_status(event, AttendanceRecord.ATTENDED, *sisters[:i])
+
+    # One query each for events, attendance records and extra points
+    with self.assertNumQueries(3):
+      scores = scoring.get_scores([s.id for s in sisters], semester.id)
+    with self.assertNumQueries(3):
+      scoring.get_score(sisters[0], semester.id)
+
+    self.assertEqual(scores[sisters[0].id], scoring.Score(50, 60, 0))
+    self.assertEqual(scores[sisters[9].id], scoring.Score(0, 60, 0))
+
+
+#########################
+##### SISTERS TESTS #####
+#########################
+class SistersTests(TestCase):
+  def get_sisters_page(self, semester, order_by_percent=False):
+    url = reverse('attendance:sisters') + '?semester=' + str(semester.id)
+    if order_by_percent:
+      url += '&order_by_percent=True'
+    return self.client.get(url)
+
+  def test_sisters_order_by_percent(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    semester = create_semester(Semester.FALL, 2017)
+    event = create_event("chapter", -1, 20, semester=semester, is_mandatory=True)
+    high = create_sister("high", Sister.ACTIVE, 2018)
+    low = create_sister("low", Sister.ACTIVE, 2018)
+    none = create_sister("none", Sister.ACTIVE, 2018)
+    alum = create_sister("alum", Sister.ALUM, 2015)
+    add_required(event, high, low)
+    add_status(event, AttendanceRecord.ATTENDED, high)
+
+    response = self.get_sisters_page(semester, order_by_percent=True)
+
+    sisters = response.context['sisters']
+    self.assertEqual([s.id for s in sisters], [low.id, high.id, none.id])
+    self.assertEqual(sisters[0].percentage, "0%")
+    self.assertEqual(sisters[1].percentage, "100%")
+    self.assertEqual(sisters[2].percentage, views.no_percentage_available_message)
+
+  def test_sisters_query_count_does_not_depend_on_chapter_size(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    semester = create_semester(Semester.FALL, 2017)
+    event = create_event("chapter", -1, 20, semester=semester, is_mandatory=True)
+
+    def add_sisters(prefix, count):
+      sisters = [create_sister(prefix + str(i), Sister.ACTIVE, 2018) for i in range(count)]
+      add_required(event, *sisters)
+      add_status(event, AttendanceRecord.ATTENDED, *sisters[1:])
+
+    add_sisters("small", 2)
+    # The semester directory is cached after it's first read
+    get_semesters()
+    with CaptureQueriesContext(connection) as small_chapter:
+      self.get_sisters_page(semester, order_by_percent=True)
+
+    add_sisters("big", 10)
+    with CaptureQueriesContext(connection) as big_chapter:
+      self.get_sisters_page(semester, order_by_percent=True)
+
+    self.assertEqual(len(small_chapter), len(big_chapter))
+
+
+########################
+##### LEDGER TESTS #####
+########################
+class LedgerTests(TestCase):
+  def test_checkin_and_uncheck_update_ledger(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    semester = create_semester(Semester.FALL, 2018)
+    event = create_event("yo", -1, 30, semester=semester, is_mandatory=True, is_activated=True)
+    add_required(event, sister)
+    self.assertEqual(ledger.get_ledger(semester.id, [sister.id])[sister.id].percentage, 0.0)
+
+    self.client.post(reverse('attendance:checkin_sister', args=(event.id, sister.id)))
+    row = AttendanceLedger.objects.get(sister=sister, semester=semester)
+    self.assertEqual(row.percentage, 1.0)
+    self.assertEqual(row.earned_points, 30)
+
+    self.client.post(reverse('attendance:uncheck_sister', args=(event.id, sister.id)))
+    row = AttendanceLedger.objects.get(sister=sister, semester=semester)
+    self.assertEqual(row.percentage, 0.0)
+
+  def test_extra_points_update_ledger(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    semester = create_semester(Semester.FALL, 2018)
+    event = create_event("yo", -1, 10, semester=semester, is_mandatory=True)
+    add_required(event, sister)
+    ledger.refresh_ledger(semester.id, [sister.id])
+
+    self.client.post(reverse('attendance:extra_points'),
+      {'semester': semester.id, 'sister': sister.id, 'points': 5, 'reason': 'bro'})
+
+    row = AttendanceLedger.objects.get(sister=sister, semester=semester)
+    self.assertEqual(row.extra_points, 5)
+    self.assertEqual(row.percentage, .5)
+
+  def test_ledger_recomputed_once_next_event_starts(self):
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    semester = create_semester(Semester.FALL, 2018)
+    event = create_event("yo", 1, 30, semester=semester, is_mandatory=True)
+    add_required(event, sister)
+
+    row = ledger.get_ledger(semester.id, [sister.id])[sister.id]
+    self.assertEqual(row.percentage, None)
+    self.assertEqual(row.valid_until, event.date)
+
+    # Time passes and the event happens
+    past = timezone.now() - datetime.timedelta(hours=1)
+    Event.objects.filter(id=event.id).update(date=past)
+    AttendanceLedger.objects.filter(sister=sister).update(valid_until=past)
+
+    row = ledger.get_ledger(semester.id, [sister.id])[sister.id]
+    self.assertEqual(row.total_points, 30)
+    self.assertEqual(row.percentage, 0.0)
+    self.assertEqual(row.valid_until, None)
+
+  def test_refresh_locks_rows_before_scoring(self):
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    semester = create_semester(Semester.FALL, 2018)
+    event = create_event("yo", -1, 10, semester=semester, is_mandatory=True)
+    add_required(event, sister)
+    ledger.refresh_ledger(semester.id, [sister.id])
+    add_status(event, AttendanceRecord.ATTENDED, sister)
+
+    with CaptureQueriesContext(connection) as queries:
+      ledger.refresh_ledger(semester.id, [sister.id])
+
+    # Overlapping refreshes of the same sister take turns on her row, so
+    # the one that writes last also read the attendance last
+    attendance_queries = [query['sql'] for query in queries.captured_queries
+      if 'FROM "attendance_' in query['sql']]
+    self.assertIn('FROM "attendance_attendanceledger"', attendance_queries[0])
+    self.assertEqual(AttendanceLedger.objects.get(sister=sister).earned_points, 10)
+
+  def test_rewriting_stale_ledger_does_not_depend_on_chapter_size(self):
+    semester = create_semester(Semester.FALL, 2018)
+    event = create_event("yo", 1, 30, semester=semester, is_mandatory=True)
+    past = timezone.now() - datetime.timedelta(hours=1)
+
+    def update_stale_ledger(num_sisters):
+      sisters = [create_sister("sis%d_%d" % (num_sisters, i), Sister.ACTIVE, 2019) for i in range(num_sisters)]
+      sister_ids = [sister.id for sister in sisters]
+      add_required(event, *sisters)
+      add_status(event, AttendanceRecord.ATTENDED, *sisters[1:])
+      Event.objects.filter(id=event.id).update(date=timezone.now() + datetime.timedelta(days=1))
+      ledger.get_ledger(semester.id, sister_ids)
+
+      # The event happens, so every row is stale and has a new percentage
+      Event.objects.filter(id=event.id).update(date=past)
+      AttendanceLedger.objects.filter(sister_id__in=sister_ids).update(valid_until=past)
+      # Reading the ledger, scoring, the next event, locking the rows,
+      # one UPDATE for all of them, and the transaction's savepoints
+      with self.assertNumQueries(9):
+        rows = ledger.get_ledger(semester.id, sister_ids)
+      self.assertEqual(rows[sister_ids[0]].percentage, 0.0)
+      self.assertEqual(rows[sister_ids[1]].percentage, 1.0)
+      self.assertEqual(AttendanceLedger.objects.get(sister_id=sister_ids[1]).percentage, 1.0)
+
+    update_stale_ledger(2)
+    update_stale_ledger(10)
+
+  def test_rebuild_command_checks_and_fixes_ledger(self):
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    semester = create_semester(Semester.FALL, 2018)
+    event = create_event("yo", -1, 30, semester=semester, is_mandatory=True)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.ATTENDED, sister)
+    ledger.refresh_ledger(semester.id, [sister.id])
+    AttendanceLedger.objects.filter(sister=sister).update(earned_points=0, percentage=0)
+
+    with self.assertRaises(CommandError):
+      call_command('rebuild_attendance_ledger', semester_ids=[semester.id], check=True, stdout=StringIO())
+    self.assertEqual(AttendanceLedger.objects.get(sister=sister).percentage, 0)
+
+    call_command('rebuild_attendance_ledger', stdout=StringIO())
+    self.assertEqual(AttendanceLedger.objects.get(sister=sister).percentage, 1.0)
+    call_command('rebuild_attendance_ledger', check=True, stdout=StringIO())
+
+
 ###################################
 ##### GET_SISTER_RECORD TESTS #####
 ###################################
@@ -477,8 +749,8 @@ class GetSisterRecordTests(TestCase):
     sister = create_sister('bro', Sister.ACTIVE, 2016)
     semester = create_semester(Semester.FALL, 2017)
     event = create_event("past", days=-3, points=10, semester=semester)
-    event.sisters_required.add(sister)
-    event.sisters_freebied.add(sister)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.FREEBIED, sister)
 
     context = views.get_sister_record(sister, semester.id)
 
@@ -537,9 +809,9 @@ class GetSisterRecordTests(TestCase):
     event_past1 = create_event("fondue", -2, 30, semester, is_mandatory=True)
     event_past2 = create_event("house cleaning", -50, 30, semester, is_mandatory=True)
 
-    event_past1.sisters_required.add(sister)
-    event_past1.sisters_attended.add(sister)
-    event_past2.sisters_required.add(sister)
+    add_required(event_past1, sister)
+    add_status(event_past1, AttendanceRecord.ATTENDED, sister)
+    add_required(event_past2, sister)
 
     context = views.get_sister_record(sister, semester.id)
 
@@ -618,6 +890,64 @@ class GetSisterRecordTests(TestCase):
     self.assertEqual(context['overall_total_points'], 0) # Didn't make sister required
 
 
+  def test_get_sister_record_earned_points_and_attendance(self):
+    sister = create_sister("lee", Sister.ACTIVE, 2019)
+    semester = create_semester(Semester.SPRING, 2016)
+    attended = create_event("fondue", -4, 30, semester, is_mandatory=True)
+    excused = create_event("chapter", -3, 20, semester, is_mandatory=True)
+    missed = create_event("cleaning", -2, 10, semester, is_mandatory=True)
+    bonus = create_event("mixer", -1, 8, semester)
+    for event in [attended, excused, missed]:
+      add_required(event, sister)
+    add_status(attended, AttendanceRecord.ATTENDED, sister)
+    add_status(excused, AttendanceRecord.EXCUSED, sister)
+    add_status(bonus, AttendanceRecord.ATTENDED, sister)
+
+    context = views.get_sister_record(sister, semester.id)
+
+    past_events = context['past_events']
+    self.assertEqual([e.earned_points for e in past_events], [30, Event.VALUE_OF_EXCUSED_ABSENCE*20, 0, "--"])
+    self.assertEqual([e.attendance for e in past_events], ["Attended", "Excused", "Missed", "Attended"])
+    self.assertEqual(context['overall_earned_points'], 30 + Event.VALUE_OF_EXCUSED_ABSENCE*20)
+    self.assertEqual(context['overall_total_points'], 60)
+    # The bonus event counts towards the percentage
+    expected = views.format_percentage(views.calculate_percentage(sister, semester.id))
+    self.assertEqual(context['percentage'], expected)
+
+  def test_get_sister_record_does_not_write(self):
+    sister = create_sister("lee", Sister.ACTIVE, 2019)
+    semester = create_semester(Semester.SPRING, 2016)
+
+    def add_events(count):
+      for i in range(count):
+        past = create_event("past", -i - 1, 10, semester, is_mandatory=True)
+        add_required(past, sister)
+        future = create_event("future", i + 1, 10, semester, is_mandatory=True)
+        create_excuse(future, sister, "sick")
+
+    add_events(1)
+    # A past event whose rule hasn't been finalized yet is only read
+    rule_event = create_event("rule", -1, 10, semester, is_mandatory=True, is_activated=True)
+    rule_event.set_eligibility_rule([Sister.ACTIVE])
+    rule_event.save()
+    # The semester directory is cached after it's first read
+    get_semesters()
+    with CaptureQueriesContext(connection) as few_events:
+      views.get_sister_record(sister, semester.id)
+
+    add_events(5)
+    with CaptureQueriesContext(connection) as many_events:
+      context = views.get_sister_record(sister, semester.id)
+      # Excuses shouldn't need to load their events again
+      [str(item.event) for item in context['future_events_and_excuses']]
+
+    self.assertEqual(len(few_events), len(many_events))
+    for query in few_events.captured_queries + many_events.captured_queries:
+      self.assertTrue(query['sql'].startswith('SELECT'), query['sql'])
+    self.assertFalse(Event.objects.get(id=rule_event.id).is_finalized)
+    self.assertEqual(context['overall_total_points'], 70)
+
+
 ##########################
 ##### ACTIVATE TESTS #####
 ##########################
@@ -717,14 +1047,14 @@ class ActivateTests(TestCase):
     event_new = Event.objects.get(id=event.id)
     self.assertEqual(event_new.is_activated, True)
     # Sisters 1, 4, 5, and 6 should be required to attend
-    self.assertEqual(len(event_new.sisters_required.all()),  4)
-    self.assertEqual(sister1 in event_new.sisters_required.all(), True)
-    self.assertEqual(sister2 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister3 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister4 in event_new.sisters_required.all(), True)
-    self.assertEqual(sister5 in event_new.sisters_required.all(), True)
-    self.assertEqual(sister6 in event_new.sisters_required.all(), True)
-    self.assertEqual(sister10 in event_new.sisters_required.all(), False)
+    self.assertEqual(len(event_new.get_required_sisters()),  4)
+    self.assertEqual(sister1 in event_new.get_required_sisters(), True)
+    self.assertEqual(sister2 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister3 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister4 in event_new.get_required_sisters(), True)
+    self.assertEqual(sister5 in event_new.get_required_sisters(), True)
+    self.assertEqual(sister6 in event_new.get_required_sisters(), True)
+    self.assertEqual(sister10 in event_new.get_required_sisters(), False)
 
   # Activate an event for only new members
   def test_activate_new_members(self):
@@ -752,15 +1082,15 @@ class ActivateTests(TestCase):
     event_new = Event.objects.get(id=event.id)
     self.assertEqual(event_new.is_activated, True)
     # Sisters 4 and 7 should be required to attend
-    self.assertEqual(len(event_new.sisters_required.all()),  2)
-    self.assertEqual(sister1 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister2 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister3 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister4 in event_new.sisters_required.all(), True)
-    self.assertEqual(sister5 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister6 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister7 in event_new.sisters_required.all(), True)
-    self.assertEqual(sister10 in event_new.sisters_required.all(), False)
+    self.assertEqual(len(event_new.get_required_sisters()),  2)
+    self.assertEqual(sister1 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister2 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister3 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister4 in event_new.get_required_sisters(), True)
+    self.assertEqual(sister5 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister6 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister7 in event_new.get_required_sisters(), True)
+    self.assertEqual(sister10 in event_new.get_required_sisters(), False)
 
   # Activate an event for a specific class year
   def test_activate_class_year(self):
@@ -792,18 +1122,18 @@ class ActivateTests(TestCase):
     self.assertEqual(event_new.is_activated, True)
     # Sisters 1 and 8should be required to attend
     # Abroad and alum don't attend)
-    self.assertEqual(len(event_new.sisters_required.all()),  2)
-    self.assertEqual(sister1 in event_new.sisters_required.all(), True)
-    self.assertEqual(sister2 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister3 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister4 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister5 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister6 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister7 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister8 in event_new.sisters_required.all(), True)
-    self.assertEqual(sister9 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister10 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister11 in event_new.sisters_required.all(), False)
+    self.assertEqual(len(event_new.get_required_sisters()),  2)
+    self.assertEqual(sister1 in event_new.get_required_sisters(), True)
+    self.assertEqual(sister2 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister3 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister4 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister5 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister6 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister7 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister8 in event_new.get_required_sisters(), True)
+    self.assertEqual(sister9 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister10 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister11 in event_new.get_required_sisters(), False)
 
   # Activate an event for a class year that doesn't have anyone in it
   def test_activate_class_year_no_one_in_it(self):
@@ -828,10 +1158,949 @@ class ActivateTests(TestCase):
     # Event should be activated
     event_new = Event.objects.get(id=event.id)
     self.assertEqual(event_new.is_activated, True)
-    self.assertEqual(len(event_new.sisters_required.all()),  0)
-    self.assertEqual(sister1 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister2 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister3 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister4 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister5 in event_new.sisters_required.all(), False)
-    self.assertEqual(sister10 in event_new.sisters_required.all(), False)
+    self.assertEqual(len(event_new.get_required_sisters()),  0)
+    self.assertEqual(sister1 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister2 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister3 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister4 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister5 in event_new.get_required_sisters(), False)
+    self.assertEqual(sister10 in event_new.get_required_sisters(), False)
+
+
+#########################
+##### CHECKIN TESTS #####
+#########################
+class CheckinTests(TestCase):
+  def get_status(self, event, sister):
+    return AttendanceRecord.objects.get(event=event, sister=sister).status
+
+  def test_checkin_replaces_excuse_and_uncheck_restores_it(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    event = create_event("chapter", -1, 20, is_mandatory=True, is_activated=True)
+    add_required(event, sister)
+    excuse = Excuse.objects.create(event=event, sister=sister, text="sick", is_freebie=True)
+
+    self.client.post(reverse('attendance:excuse_approve', args=(excuse.id,)))
+    self.assertEqual(self.get_status(event, sister), AttendanceRecord.FREEBIED)
+
+    self.client.post(reverse('attendance:checkin_sister', args=(event.id, sister.id)))
+    self.assertEqual(self.get_status(event, sister), AttendanceRecord.ATTENDED)
+
+    self.client.post(reverse('attendance:uncheck_sister', args=(event.id, sister.id)))
+    self.assertEqual(self.get_status(event, sister), AttendanceRecord.FREEBIED)
+
+  def test_excuse_approve_keeps_attendance(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    event = create_event("chapter", -1, 20, is_mandatory=True, is_activated=True)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.ATTENDED, sister)
+    excuse = create_excuse(event, sister, "sick")
+
+    self.client.post(reverse('attendance:excuse_approve', args=(excuse.id,)))
+
+    self.assertEqual(self.get_status(event, sister), AttendanceRecord.ATTENDED)
+
+  def test_event_details_shows_required_sisters(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    attended = create_sister("attended", Sister.ACTIVE, 2019)
+    excused = create_sister("excused", Sister.ACTIVE, 2019)
+    absent = create_sister("absent", Sister.ACTIVE, 2019)
+    not_required = create_sister("not_required", Sister.ACTIVE, 2019)
+    event = create_event("chapter", -1, 20, is_mandatory=True, is_activated=True)
+    add_required(event, attended, excused, absent)
+    add_status(event, AttendanceRecord.ATTENDED, attended)
+    add_status(event, AttendanceRecord.EXCUSED, excused)
+
+    response = self.client.get(reverse('attendance:event_details', args=(event.id,)))
+
+    self.assertEqual(response.context['percent_attended'], 33)
+    self.assertEqual(response.context['percent_excused'], 33)
+    self.assertEqual(response.context['percent_absent'], 33)
+    self.assertContains(response, reverse('attendance:uncheck_sister', args=(event.id, attended.id)))
+    self.assertContains(response, reverse('attendance:checkin_sister', args=(event.id, excused.id)))
+    self.assertContains(response, reverse('attendance:checkin_sister', args=(event.id, absent.id)))
+    self.assertNotContains(response, reverse('attendance:checkin_sister', args=(event.id, not_required.id)))
+
+  def test_event_details_query_count_does_not_depend_on_roster_size(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    event = create_event("chapter", -1, 20, is_mandatory=True, is_activated=True)
+    url = reverse('attendance:event_details', args=(event.id,))
+
+    def add_sisters(prefix, count):
+      sisters = [create_sister(prefix + str(i), Sister.ACTIVE, 2018) for i in range(count)]
+      add_required(event, *sisters)
+      add_status(event, AttendanceRecord.ATTENDED, *sisters[::2])
+      add_status(event, AttendanceRecord.FREEBIED, *sisters[1::4])
+
+    add_sisters("small", 2)
+    with CaptureQueriesContext(connection) as small_roster:
+      self.client.get(url)
+
+    add_sisters("big", 12)
+    with CaptureQueriesContext(connection) as big_roster:
+      response = self.client.get(url)
+
+    self.assertEqual(len(small_roster), len(big_roster))
+    self.assertEqual(len(response.context['roster']), 14)
+    self.assertEqual(response.context['percent_attended'], 50)
+
+  def test_checkin_json_returns_new_status_and_percentages(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    other = create_sister("other", Sister.ACTIVE, 2019)
+    event = create_event("chapter", -1, 20, is_mandatory=True, is_activated=True)
+    add_required(event, sister, other)
+
+    response = self.client.post(reverse('attendance:checkin_sister_json', args=(event.id, sister.id)))
+
+    self.assertEqual(response.status_code, 200)
+    data = response.json()
+    self.assertEqual(data['sister_id'], sister.id)
+    self.assertEqual(data['status'], AttendanceRecord.ATTENDED)
+    self.assertTrue(data['is_attended'])
+    self.assertEqual(data['excused_display'], "--")
+    self.assertEqual(data['num_attended'], 1)
+    self.assertEqual(data['percent_attended'], 50)
+    self.assertEqual(data['percent_absent'], 50)
+    self.assertEqual(self.get_status(event, sister), AttendanceRecord.ATTENDED)
+    self.assertEqual(AttendanceLedger.objects.get(sister=sister).earned_points, 20)
+
+  def test_uncheck_json_restores_excuse(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    event = create_event("chapter", -1, 20, is_mandatory=True, is_activated=True)
+    add_required(event, sister)
+    add_status(event, AttendanceRecord.ATTENDED, sister)
+    Excuse.objects.create(event=event, sister=sister, text="sick", status=Excuse.APPROVED)
+
+    response = self.client.post(reverse('attendance:uncheck_sister_json', args=(event.id, sister.id)))
+
+    data = response.json()
+    self.assertEqual(data['status'], AttendanceRecord.EXCUSED)
+    self.assertFalse(data['is_attended'])
+    self.assertEqual(data['excused_display'], "Excused")
+    self.assertEqual(data['percent_excused'], 100)
+
+  def test_checkin_json_requires_post_and_staff(self):
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    event = create_event("chapter", -1, 20, is_mandatory=True, is_activated=True)
+    add_required(event, sister)
+    url = reverse('attendance:checkin_sister_json', args=(event.id, sister.id))
+
+    create_and_login_user(self.client, 'notstaff', 'siewj', False, test_email)
+    self.assertEqual(self.client.post(url).status_code, 302)
+    self.assertEqual(self.get_status(event, sister), AttendanceRecord.ABSENT)
+
+    create_and_login_user(self.client, 'bob', 'siewj', True, 'bob@example.com')
+    self.assertEqual(self.client.get(url).status_code, 405)
+    self.assertEqual(self.get_status(event, sister), AttendanceRecord.ABSENT)
+
+##############################
+##### CHECKIN SYNC TESTS #####
+##############################
+class CheckinSyncTests(TestCase):
+  def setUp(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    self.event = create_event("chapter", -1, 20, is_mandatory=True, is_activated=True)
+
+  def sync(self, *entries):
+    checkins = []
+    for key, sister, action, minutes in entries:
+      timestamp = self.event.date + datetime.timedelta(minutes=minutes)
+      checkins.append({'key': key, 'event': self.event.id, 'sister': sister.id,
+        'action': action, 'timestamp': timestamp.isoformat()})
+    return self.client.post(reverse('attendance:sync_checkins'),
+      json.dumps({'checkins': checkins}), content_type='application/json')
+
+  def get_status(self, sister):
+    return AttendanceRecord.objects.get(event=self.event, sister=sister).status
+
+  def test_sync_applies_last_tap_for_each_sister(self):
+    first = create_sister("first", Sister.ACTIVE, 2019)
+    second = create_sister("second", Sister.ACTIVE, 2019)
+    not_required = create_sister("not_required", Sister.ACTIVE, 2019)
+    add_required(self.event, first, second)
+
+    # Sent out of order; second's uncheck happened after her check-in
+    response = self.sync(
+      ('a', first, 'checkin', 1),
+      ('c', second, 'uncheck', 3),
+      ('b', second, 'checkin', 2),
+      ('d', not_required, 'checkin', 4))
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(sorted(response.json()['applied']), ['a', 'b', 'c', 'd'])
+    self.assertEqual(self.get_status(first), AttendanceRecord.ATTENDED)
+    self.assertEqual(self.get_status(second), AttendanceRecord.ABSENT)
+    self.assertEqual(self.get_status(not_required), AttendanceRecord.ATTENDED)
+    self.assertEqual(SyncedCheckin.objects.count(), 4)
+    self.assertEqual(AttendanceLedger.objects.get(sister=first).earned_points, 20)
+
+  def test_sync_ignores_replayed_keys(self):
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    add_required(self.event, sister)
+    self.sync(('a', sister, 'checkin', 1))
+    set_attendance_status(self.event, sister, AttendanceRecord.ABSENT)
+
+    response = self.sync(('a', sister, 'checkin', 1), ('a', sister, 'checkin', 1))
+
+    self.assertEqual(response.json()['ignored'], ['a', 'a'])
+    self.assertEqual(response.json()['applied'], [])
+    self.assertEqual(self.get_status(sister), AttendanceRecord.ABSENT)
+
+  def test_sync_ignores_taps_older_than_synced_ones(self):
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    add_required(self.event, sister)
+    self.sync(('b', sister, 'uncheck', 2))
+    add_status(self.event, AttendanceRecord.ABSENT, sister)
+
+    # A kiosk that was offline sends a check-in from before the uncheck
+    response = self.sync(('a', sister, 'checkin', 1))
+
+    self.assertEqual(response.json()['ignored'], ['a'])
+    self.assertEqual(response.json()['applied'], [])
+    self.assertEqual(self.get_status(sister), AttendanceRecord.ABSENT)
+    self.assertTrue(SyncedCheckin.objects.filter(key='a').exists())
+
+    response = self.sync(('c', sister, 'checkin', 3))
+
+    self.assertEqual(response.json()['applied'], ['c'])
+    self.assertEqual(self.get_status(sister), AttendanceRecord.ATTENDED)
+
+  def test_sync_uncheck_restores_excuse(self):
+    excused = create_sister("excused", Sister.ACTIVE, 2019)
+    freebied = create_sister("freebied", Sister.ACTIVE, 2019)
+    add_required(self.event, excused, freebied)
+    add_status(self.event, AttendanceRecord.ATTENDED, excused, freebied)
+    Excuse.objects.create(event=self.event, sister=excused, text="sick", status=Excuse.APPROVED)
+    Excuse.objects.create(event=self.event, sister=freebied, text="trip", status=Excuse.APPROVED, is_freebie=True)
+
+    self.sync(('a', excused, 'uncheck', 1), ('b', freebied, 'uncheck', 1))
+
+    self.assertEqual(self.get_status(excused), AttendanceRecord.EXCUSED)
+    self.assertEqual(self.get_status(freebied), AttendanceRecord.FREEBIED)
+
+  def test_sync_rejects_unknown_sisters(self):
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    add_required(self.event, sister)
+    missing = Sister(id=sister.id + 100)
+
+    response = self.sync(('a', sister, 'checkin', 1), ('b', missing, 'checkin', 1))
+
+    self.assertEqual(response.json()['applied'], ['a'])
+    self.assertEqual(response.json()['rejected'], ['b'])
+    self.assertEqual(self.get_status(sister), AttendanceRecord.ATTENDED)
+
+  def test_sync_rejects_malformed_batch(self):
+    response = self.client.post(reverse('attendance:sync_checkins'),
+      json.dumps({'checkins': [{'key': 'a', 'event': self.event.id}]}),
+      content_type='application/json')
+
+    self.assertEqual(response.status_code, 400)
+    self.assertFalse(SyncedCheckin.objects.exists())
+
+  def test_sync_query_count_does_not_depend_on_batch_size(self):
+    sisters = [create_sister("sister" + str(i), Sister.ACTIVE, 2019) for i in range(12)]
+    add_required(self.event, *sisters)
+    add_status(self.event, AttendanceRecord.ATTENDED, *sisters[6:])
+
+    with CaptureQueriesContext(connection) as small_batch:
+      self.sync(('a', sisters[0], 'checkin', 1), ('b', sisters[6], 'uncheck', 1))
+    with CaptureQueriesContext(connection) as big_batch:
+      self.sync(*[('c' + str(i), sister, 'checkin', 1) for i, sister in enumerate(sisters[1:6])] +
+        [('d' + str(i), sister, 'uncheck', 1) for i, sister in enumerate(sisters[7:])])
+
+    self.assertEqual(len(small_batch), len(big_batch))
+
+#################################
+##### ACTIVATE_EVENTS TESTS #####
+#################################
+class ActivateEventsTests(TestCase):
+  def test_activate_events_requires_group_at_every_event(self):
+    create_and_login_user(self.client, 'joe', 'bro', True, test_email)
+    semester = Semester.objects.create(term=Semester.FALL, year=2017)
+    first = create_event("first", 1, 10, semester=semester)
+    second = create_event("second", 2, 10, semester=semester)
+    skipped = create_event("skipped", 3, 10, semester=semester)
+    new_member = create_sister("new", Sister.NEW_MEMBER, 2020)
+    active = create_sister("active", Sister.ACTIVE, 2019)
+    alum = create_sister("alum", Sister.ALUM, 2016)
+    # An existing record keeps its status
+    set_attendance_status(first, new_member, AttendanceRecord.EXCUSED)
+
+    response = self.client.post(reverse('attendance:activate_events'),
+      {'events': [first.id, second.id], 'activate_group': 'all'})
+
+    self.assertRedirects(response, reverse('attendance:events') + '?semester=' + str(semester.id))
+    for event in (first, second):
+      event.refresh_from_db()
+      self.assertTrue(event.is_activated)
+      self.assertEqual(set(event.get_required_sisters()), set([new_member, active]))
+    self.assertFalse(Event.objects.get(id=skipped.id).is_activated)
+    self.assertFalse(AttendanceRecord.objects.filter(sister=alum).exists())
+    self.assertEqual(
+      AttendanceRecord.objects.get(event=first, sister=new_member).status,
+      AttendanceRecord.EXCUSED)
+
+  def test_activate_events_query_count_does_not_depend_on_size(self):
+    create_and_login_user(self.client, 'joe', 'bro', True, test_email)
+    semester = Semester.objects.create(term=Semester.FALL, year=2017)
+    url = reverse('attendance:activate_events')
+
+    def activate(prefix, count):
+      events = [create_event(prefix + str(i), i + 1, 10, semester=semester) for i in range(count)]
+      for i in range(count):
+        create_sister(prefix + str(i), Sister.ACTIVE, 2019)
+      with CaptureQueriesContext(connection) as queries:
+        self.client.post(url, {'events': [event.id for event in events], 'activate_group': 'all'})
+      return len(queries)
+
+    self.assertEqual(activate("small", 1), activate("big", 6))
+    # The events use an eligibility rule, so nothing is copied
+    self.assertFalse(AttendanceRecord.objects.exists())
+    self.assertEqual(Event.objects.get(name="big5").get_required_sisters().count(), 7)
+
+  def test_activate_events_normal_user(self):
+    create_and_login_user(self.client, 'joe', 'bro')
+    event = create_event("first", 1, 10)
+
+    self.client.post(reverse('attendance:activate_events'),
+      {'events': [event.id], 'activate_group': 'all'})
+
+    self.assertFalse(Event.objects.get(id=event.id).is_activated)
+
+#############################
+##### ELIGIBILITY TESTS #####
+#############################
+class EligibilityTests(TestCase):
+  # The event is upcoming, since past events are finalized whenever a
+  # sister is saved.
+  # Scores are taken as of after it.
+  def setUp(self):
+    self.semester = Semester.objects.create(term=Semester.FALL, year=2017)
+    self.event = create_event("chapter", 1, 20, semester=self.semester, is_mandatory=True, is_activated=True)
+    self.event.set_eligibility_rule([Sister.ACTIVE, Sister.NEW_MEMBER], 2019)
+    self.event.save()
+    self.after_event = timezone.now() + datetime.timedelta(days=2)
+
+  def get_score(self, sister):
+    return scoring.get_score(sister, self.semester.id, self.after_event)
+
+  def test_rule_is_checked_against_current_statuses(self):
+    active = create_sister("active", Sister.ACTIVE, 2019)
+    other_year = create_sister("other_year", Sister.ACTIVE, 2018)
+    abroad = create_sister("abroad", Sister.ABROAD, 2019)
+
+    self.assertEqual(set(self.event.get_required_sisters()), set([active]))
+    self.assertEqual(self.get_score(active), scoring.Score(0, 20, 0))
+    self.assertEqual(self.get_score(other_year), scoring.Score(0, 0, 0))
+
+    abroad.status = Sister.ACTIVE
+    abroad.save()
+    self.assertEqual(self.get_score(abroad), scoring.Score(0, 20, 0))
+
+  def test_overrides(self):
+    excused = create_sister("excused", Sister.ACTIVE, 2019)
+    added = create_sister("added", Sister.ALUM, 2019)
+    AttendanceRecord.objects.create(event=self.event, sister=excused, required_override=False)
+    AttendanceRecord.objects.create(event=self.event, sister=added, required_override=True,
+      status=AttendanceRecord.ATTENDED)
+
+    self.assertEqual(set(self.event.get_required_sisters()), set([added]))
+    self.assertEqual(self.get_score(excused), scoring.Score(0, 0, 0))
+    self.assertEqual(self.get_score(added), scoring.Score(20, 20, 0))
+
+  def test_event_details_roster_follows_rule(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    attended = create_sister("attended", Sister.ACTIVE, 2019)
+    absent = create_sister("absent", Sister.NEW_MEMBER, 2019)
+    create_sister("alum", Sister.ALUM, 2019)
+    set_attendance_status(self.event, attended, AttendanceRecord.ATTENDED)
+
+    response = self.client.get(reverse('attendance:event_details', args=(self.event.id,)))
+
+    statuses = dict((record.sister, record.status) for record in response.context['roster'])
+    self.assertEqual(statuses, {
+      attended: AttendanceRecord.ATTENDED,
+      absent: AttendanceRecord.ABSENT,
+    })
+    self.assertEqual(response.context['percent_attended'], 50)
+    self.assertTrue(response.context['can_finalize'])
+
+  def test_finalize_saves_snapshot(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    required = create_sister("required", Sister.ACTIVE, 2019)
+    excused = create_sister("excused", Sister.ACTIVE, 2019)
+    AttendanceRecord.objects.create(event=self.event, sister=excused, required_override=False)
+
+    self.client.post(reverse('attendance:finalize', args=(self.event.id,)))
+
+    event = Event.objects.get(id=self.event.id)
+    self.assertTrue(event.is_finalized)
+    self.assertFalse(event.uses_eligibility_rule())
+    self.assertTrue(AttendanceRecord.objects.get(event=event, sister=required).is_required)
+    self.assertFalse(AttendanceRecord.objects.get(event=event, sister=excused).is_required)
+
+    # Later status changes don't change the finalized roster
+    required.status = Sister.ALUM
+    required.save()
+    self.assertEqual(set(event.get_required_sisters()), set([required]))
+    self.assertEqual(self.get_score(required), scoring.Score(0, 20, 0))
+
+  def test_activating_finalized_event_uses_new_rule(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    active = create_sister("active", Sister.ACTIVE, 2019)
+    new_member = create_sister("new_member", Sister.NEW_MEMBER, 2020)
+    finalize_event(self.event)
+
+    self.client.post(reverse('attendance:activate', args=(self.event.id,)),
+      {'activate_group': 'new_members'})
+
+    event = Event.objects.get(id=self.event.id)
+    self.assertTrue(event.uses_eligibility_rule())
+    self.assertEqual(set(event.get_required_sisters()), set([new_member]))
+
+  def test_activating_finalized_events_at_once_uses_new_rule(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    create_sister("active", Sister.ACTIVE, 2019)
+    new_member = create_sister("new_member", Sister.NEW_MEMBER, 2020)
+    finalize_event(self.event)
+
+    self.client.post(reverse('attendance:activate_events'),
+      {'activate_group': 'new_members', 'events': [self.event.id]})
+
+    event = Event.objects.get(id=self.event.id)
+    self.assertFalse(event.is_finalized)
+    self.assertEqual(set(event.get_required_sisters()), set([new_member]))
+
+  def test_past_events_are_finalized(self):
+    new_member = create_sister("new_member", Sister.NEW_MEMBER, 2019)
+    graduating = create_sister("graduating", Sister.ACTIVE, 2019)
+    past = create_event("actives only", -1, 10, semester=self.semester, is_mandatory=True, is_activated=True)
+    past.set_eligibility_rule([Sister.ACTIVE])
+    past.save()
+    ledger.refresh_ledger(self.semester.id, [graduating.id])
+
+    # Status changes after the event don't change who was required at it
+    new_member.status = Sister.ACTIVE
+    new_member.save()
+    graduating.status = Sister.ALUM
+    graduating.save()
+
+    self.assertTrue(Event.objects.get(id=past.id).is_finalized)
+    self.assertEqual(scoring.get_score(new_member, self.semester.id), scoring.Score(0, 0, 0))
+    self.assertEqual(scoring.get_score(graduating, self.semester.id), scoring.Score(0, 10, 0))
+    row = ledger.get_ledger(self.semester.id, [graduating.id])[graduating.id]
+    self.assertEqual(row.total_points, 10)
+
+  def test_past_event_is_finalized_before_first_status_change(self):
+    new_member = create_sister("new_member", Sister.NEW_MEMBER, 2019)
+    past = create_event("actives only", -1, 10, semester=self.semester, is_mandatory=True, is_activated=True)
+    past.set_eligibility_rule([Sister.ACTIVE])
+    past.save()
+
+    # Nothing read the event before she was initiated
+    new_member.status = Sister.ACTIVE
+    new_member.save()
+
+    self.assertEqual(scoring.get_score(new_member, self.semester.id), scoring.Score(0, 0, 0))
+
+  def test_reading_past_events_does_not_finalize_them(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    active = create_sister("active", Sister.ACTIVE, 2019)
+    past = create_event("actives only", -1, 10, semester=self.semester, is_mandatory=True, is_activated=True)
+    past.set_eligibility_rule([Sister.ACTIVE])
+    past.save()
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(scoring.get_score(active, self.semester.id), scoring.Score(0, 10, 0))
+      list(export.iter_attendance_rows(self.semester.id))
+      self.client.get(reverse('attendance:event_details', args=(past.id,)))
+
+    self.assertEqual([query['sql'] for query in queries.captured_queries
+      if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))], [])
+    self.assertFalse(Event.objects.get(id=past.id).is_finalized)
+
+  def test_finalize_past_events_command(self):
+    active = create_sister("active", Sister.ACTIVE, 2019)
+    past = create_event("actives only", -1, 10, semester=self.semester, is_mandatory=True, is_activated=True)
+    past.set_eligibility_rule([Sister.ACTIVE])
+    past.save()
+
+    out = StringIO()
+    call_command('finalize_past_events', stdout=out)
+
+    self.assertIn('Finalized 1 events', out.getvalue())
+    self.assertTrue(Event.objects.get(id=past.id).is_finalized)
+    # The upcoming event keeps using its rule
+    self.assertFalse(Event.objects.get(id=self.event.id).is_finalized)
+    self.assertTrue(AttendanceRecord.objects.get(event=past, sister=active).is_required)
+    call_command('finalize_past_events', stdout=out)
+    self.assertEqual(AttendanceRecord.objects.filter(event=past).count(), 1)
+
+########################
+##### OUTBOX TESTS #####
+########################
+class OutboxTests(TestCase):
+  def test_excuse_decisions_queue_email(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    sister.user.email = 'reb@example.com'
+    sister.user.save()
+    event = create_event("chapter", 1, 20)
+    approved = create_excuse(event, sister, "sick")
+    denied = create_excuse(event, sister, "bored")
+
+    self.client.post(reverse('attendance:excuse_approve', args=(approved.id,)))
+    self.client.post(reverse('attendance:excuse_deny', args=(denied.id,)))
+
+    # Nothing is sent until the worker runs
+    self.assertEqual(len(mail.outbox), 0)
+    emails = OutgoingEmail.objects.order_by('id')
+    self.assertEqual([email.recipient for email in emails], ['reb@example.com']*2)
+    self.assertIn('approved', emails[0].body)
+    self.assertIn('sick', emails[0].body)
+    self.assertIn('denied', emails[1].body)
+
+    call_command('send_queued_emails', stdout=StringIO())
+
+    self.assertEqual(len(mail.outbox), 2)
+    self.assertEqual(mail.outbox[0].to, ['reb@example.com'])
+    self.assertEqual(mail.outbox[0].subject, 'Excuse for ' + str(event))
+    self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).count(), 2)
+
+    # Sent emails aren't sent again
+    call_command('send_queued_emails', stdout=StringIO())
+    self.assertEqual(len(mail.outbox), 2)
+
+  def test_failed_email_is_retried_with_backoff(self):
+    email = outbox.queue_email('subject', 'body', 'reb@example.com')
+    with self.settings(EMAIL_BACKEND='attendance.tests.FailingEmailBackend'):
+      self.assertEqual(outbox.send_queued_emails(), (0, 1))
+      # Not due again yet
+      self.assertEqual(outbox.send_queued_emails(), (0, 0))
+
+    email.refresh_from_db()
+    self.assertEqual(email.status, OutgoingEmail.PENDING)
+    self.assertEqual(email.attempts, 1)
+    self.assertIn('SMTP is down', email.last_error)
+    self.assertGreater(email.next_attempt_at, timezone.now())
+
+    OutgoingEmail.objects.filter(id=email.id).update(next_attempt_at=timezone.now())
+    self.assertEqual(outbox.send_queued_emails(), (1, 0))
+    self.assertEqual(len(mail.outbox), 1)
+
+  def test_email_fails_after_max_attempts(self):
+    email = outbox.queue_email('subject', 'body', 'reb@example.com')
+    OutgoingEmail.objects.filter(id=email.id).update(attempts=outbox.MAX_ATTEMPTS - 1)
+    with self.settings(EMAIL_BACKEND='attendance.tests.FailingEmailBackend'):
+      outbox.send_queued_emails()
+
+    self.assertEqual(OutgoingEmail.objects.get(id=email.id).status, OutgoingEmail.FAILED)
+
+  def test_overlapping_workers_send_each_email_once(self):
+    emails = [outbox.queue_email('subject', 'body', 'reb%d@example.com' % i) for i in range(3)]
+    # Another worker claimed the first two and is still sending them
+    self.assertEqual(outbox._claim_emails(2, timezone.now()), emails[:2])
+
+    self.assertEqual(outbox.send_queued_emails(), (1, 0))
+    self.assertEqual(outbox.send_queued_emails(), (0, 0))
+    self.assertEqual([message.to for message in mail.outbox], [['reb2@example.com']])
+
+  def test_claimed_emails_are_due_again_if_worker_dies(self):
+    outbox.queue_email('subject', 'body', 'reb@example.com')
+    claimed_at = timezone.now() - datetime.timedelta(seconds=outbox.CLAIM_TIMEOUT + 1)
+    outbox._claim_emails(1, claimed_at)
+
+    self.assertEqual(outbox.send_queued_emails(), (1, 0))
+
+# An email backend that can't send anything.
+class FailingEmailBackend(object):
+  def __init__(self, *args, **kwargs):
+    pass
+
+  def open(self):
+    raise IOError('SMTP is down')
+
+  def close(self):
+    pass
+
+###############################
+##### EXCUSE_REVIEW TESTS #####
+###############################
+class ExcuseReviewTests(TestCase):
+  def setUp(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    self.event = create_event("chapter", -1, 20, is_mandatory=True, is_activated=True)
+
+  def review(self, action, *excuses):
+    return self.client.post(reverse('attendance:excuse_review'),
+      {'action': action, 'excuses': [excuse.id for excuse in excuses]})
+
+  def test_approve_checked_excuses(self):
+    excused = create_sister("excused", Sister.ACTIVE, 2019)
+    freebied = create_sister("freebied", Sister.ACTIVE, 2019)
+    attended = create_sister("attended", Sister.ACTIVE, 2019)
+    unchecked = create_sister("unchecked", Sister.ACTIVE, 2019)
+    add_required(self.event, excused, freebied, attended)
+    add_status(self.event, AttendanceRecord.ATTENDED, attended)
+    excuses = [
+      create_excuse(self.event, excused, "sick"),
+      Excuse.objects.create(event=self.event, sister=freebied, text="trip", is_freebie=True),
+      create_excuse(self.event, attended, "late"),
+    ]
+    left_pending = create_excuse(self.event, unchecked, "bored")
+
+    response = self.review('approve', *excuses)
+
+    self.assertRedirects(response, reverse('attendance:excuse_pending'))
+    self.assertEqual(Excuse.objects.filter(status=Excuse.APPROVED).count(), 3)
+    self.assertEqual(Excuse.objects.get(id=left_pending.id).status, Excuse.PENDING)
+    def get_status(sister):
+      return AttendanceRecord.objects.get(event=self.event, sister=sister).status
+    self.assertEqual(get_status(excused), AttendanceRecord.EXCUSED)
+    self.assertEqual(get_status(freebied), AttendanceRecord.FREEBIED)
+    self.assertEqual(get_status(attended), AttendanceRecord.ATTENDED)
+    self.assertFalse(AttendanceRecord.objects.filter(sister=unchecked).exists())
+    self.assertEqual(AttendanceLedger.objects.get(sister=excused).earned_points, 15)
+
+  def test_deny_checked_excuses_queues_emails(self):
+    sisters = [create_sister("sister" + str(i), Sister.ACTIVE, 2019) for i in range(3)]
+    for sister in sisters:
+      sister.user.email = sister.user.username + '@example.com'
+      sister.user.save()
+    excuses = [create_excuse(self.event, sister, "sick") for sister in sisters]
+
+    self.review('deny', *excuses)
+
+    self.assertEqual(Excuse.objects.filter(status=Excuse.DENIED).count(), 3)
+    self.assertFalse(AttendanceRecord.objects.exists())
+    self.assertEqual(
+      sorted(OutgoingEmail.objects.values_list('recipient', flat=True)),
+      ['sister0@example.com', 'sister1@example.com', 'sister2@example.com'])
+
+    # Reviewing them again does nothing, since they aren't pending
+    self.review('approve', *excuses)
+    self.assertEqual(Excuse.objects.filter(status=Excuse.DENIED).count(), 3)
+    self.assertEqual(OutgoingEmail.objects.count(), 3)
+
+  def test_review_query_count_does_not_depend_on_size(self):
+    def approve(prefix, count):
+      sisters = [create_sister(prefix + str(i), Sister.ACTIVE, 2019) for i in range(count)]
+      add_required(self.event, *sisters[::2])
+      excuses = [create_excuse(self.event, sister, "sick") for sister in sisters]
+      with CaptureQueriesContext(connection) as queries:
+        self.review('approve', *excuses)
+      return len(queries)
+
+    self.assertEqual(approve("small", 2), approve("big", 10))
+
+  def test_unknown_action_is_rejected(self):
+    excuse = create_excuse(self.event, create_sister("reb", Sister.ACTIVE, 2019), "sick")
+    for action in ('', 'Approve', 'delete'):
+      self.assertEqual(self.review(action, excuse).status_code, 400)
+    response = self.client.post(reverse('attendance:excuse_review'), {'excuses': [excuse.id]})
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(Excuse.objects.get(id=excuse.id).status, Excuse.PENDING)
+
+  def test_non_integer_excuse_ids_are_rejected(self):
+    excuse = create_excuse(self.event, create_sister("reb", Sister.ACTIVE, 2019), "sick")
+    response = self.client.post(reverse('attendance:excuse_review'),
+      {'action': 'deny', 'excuses': [excuse.id, 'all']})
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(Excuse.objects.get(id=excuse.id).status, Excuse.PENDING)
+
+################################
+##### EXCUSE_PENDING TESTS #####
+################################
+class ExcusePendingTests(TestCase):
+  def test_pending_excuses_are_paged_by_event_date(self):
+    sister = create_sister("reb", Sister.ACTIVE, 2019)
+    semester = Semester.objects.create(term=Semester.FALL, year=2017)
+    later = create_event("later", 3, 10, semester=semester)
+    earlier = create_event("earlier", 1, 10, semester=semester)
+    excuses = [create_excuse(later, sister, str(i)) for i in range(3)] + \
+      [create_excuse(earlier, sister, str(i)) for i in range(2)]
+    create_excuse(earlier, sister, "denied", status=Excuse.DENIED)
+    expected = excuses[3:] + excuses[:3]
+
+    page, after_id = views.get_pending_excuses(page_size=2)
+    self.assertEqual(page, expected[:2])
+    page, after_id = views.get_pending_excuses(after_id=after_id, page_size=2)
+    self.assertEqual(page, expected[2:4])
+    page, after_id = views.get_pending_excuses(after_id=after_id, page_size=2)
+    self.assertEqual(page, expected[4:])
+    self.assertIsNone(after_id)
+
+    self.assertEqual(views.get_pending_excuses(event_id=earlier.id)[0], expected[:2])
+    self.assertEqual(views.get_pending_excuses(semester_id=semester.id)[0], expected)
+    self.assertEqual(views.get_pending_excuses(semester_id=semester.id + 1)[0], [])
+
+  def test_excuse_pending_query_count_does_not_depend_on_size(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    event = create_event("chapter", 1, 10)
+    url = reverse('attendance:excuse_pending')
+
+    def view_pending(prefix, count):
+      for i in range(count):
+        create_excuse(event, create_sister(prefix + str(i), Sister.ACTIVE, 2019), "sick")
+      with CaptureQueriesContext(connection) as queries:
+        response = self.client.get(url)
+      self.assertEqual(len(response.context['excuses']), Excuse.objects.count())
+      return len(queries)
+
+    # The semester directory is cached after it's first read
+    get_semesters()
+    self.assertEqual(view_pending("small", 1), view_pending("big", 8))
+
+  def test_non_integer_filters_are_rejected(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    url = reverse('attendance:excuse_pending')
+    for name in ('semester', 'event', 'after'):
+      self.assertEqual(self.client.get(url, {name: 'x'}).status_code, 400)
+      self.assertEqual(self.client.get(url, {name: ''}).status_code, 200)
+
+########################
+##### EXPORT TESTS #####
+########################
+class ExportTests(TestCase):
+  def setUp(self):
+    self.semester = Semester.objects.create(term=Semester.FALL, year=2017)
+    # Sisters first, since saving a sister finalizes past rule events
+    self.alice = self.create_named_sister("alice", Sister.ACTIVE, 2019)
+    self.bea = self.create_named_sister("bea", Sister.ACTIVE, 2018)
+    self.create_named_sister("cat", Sister.ALUM, 2016)
+    self.attended = create_event("attended", -2, 10, semester=self.semester, is_mandatory=True)
+    self.missed = create_event("missed", -1, 20, semester=self.semester, is_mandatory=True)
+    self.upcoming = create_event("upcoming", 1, 10, semester=self.semester, is_mandatory=True)
+    self.ruled = create_event("ruled", -1, 5, semester=self.semester, is_mandatory=True)
+    self.ruled.set_eligibility_rule([Sister.ACTIVE], 2019)
+    self.ruled.save()
+    for event in (self.attended, self.missed, self.upcoming):
+      set_required_sisters(event, [self.alice, self.bea])
+    set_attendance_status(self.attended, self.alice, AttendanceRecord.ATTENDED)
+    set_attendance_status(self.missed, self.bea, AttendanceRecord.EXCUSED)
+
+  def create_named_sister(self, name, status, class_year):
+    sister = create_sister(name, status, class_year)
+    sister.user.first_name = name.capitalize()
+    sister.user.save()
+    return Sister.objects.get(id=sister.id)
+
+  def test_rows(self):
+    rows = list(export.iter_attendance_rows(self.semester.id))
+
+    self.assertEqual(rows[0], ['Sister', 'Class Year', str(self.attended), str(self.missed),
+      str(self.ruled), str(self.upcoming), 'Earned Points', 'Total Points', 'Extra Points', 'Percentage'])
+    # The alum has no records and isn't eligible for the ruled event
+    self.assertEqual(rows[1:], [
+      ['Alice ', 2019, 'A', 'M', 'M', 'R', 10, 35, 0, '28.6%'],
+      ['Bea ', 2018, 'M', 'E', '', 'R', 15.0, 30, 0, '50.0%'],
+    ])
+
+  def test_view_streams_csv(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+
+    response = self.client.get(reverse('attendance:export_attendance'), {'semester': self.semester.id})
+
+    self.assertTrue(response.streaming)
+    self.assertEqual(response['Content-Type'], 'text/csv')
+    self.assertIn('attendance-fall-2017.csv', response['Content-Disposition'])
+    content = b''.join(response.streaming_content).decode('utf-8')
+    rows = list(csv.reader(content.splitlines()))
+    self.assertEqual(len(rows), 3)
+    self.assertEqual(rows[1][-1], '28.6%')
+
+  def test_view_requires_superuser(self):
+    create_and_login_user(self.client, 'bob', 'siewj', False, test_email)
+
+    response = self.client.get(reverse('attendance:export_attendance'), {'semester': self.semester.id})
+
+    self.assertEqual(response.status_code, 302)
+
+  def test_command_writes_file_per_semester(self):
+    Semester.objects.create(term=Semester.SPRING, year=2018)
+    output_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, output_dir)
+
+    call_command('export_attendance', output_dir=output_dir, stdout=StringIO())
+
+    self.assertEqual(sorted(os.listdir(output_dir)),
+      ['attendance-fall-2017.csv', 'attendance-spring-2018.csv'])
+    with open(os.path.join(output_dir, 'attendance-fall-2017.csv')) as f:
+      self.assertEqual(len(list(csv.reader(f))), 3)
+
+  def test_command_rejects_unknown_semester(self):
+    with self.assertRaises(CommandError):
+      call_command('export_attendance', semester_ids=[self.semester.id + 100], stdout=StringIO())
+
+########################
+##### MATRIX TESTS #####
+########################
+@skipUnless(matrix, "NumPy isn't installed")
+class MatrixTests(TestCase):
+  def setUp(self):
+    self.semester = Semester.objects.create(term=Semester.FALL, year=2017)
+    self.first = create_event("first", -3, 10, semester=self.semester, is_mandatory=True)
+    self.second = create_event("second", -2, 20, semester=self.semester, is_mandatory=True)
+    self.optional = create_event("optional", -1, 5, semester=self.semester)
+    create_event("upcoming", 1, 10, semester=self.semester, is_mandatory=True)
+    self.sisters = [create_sister("sister%d" % i, Sister.ACTIVE, 2019) for i in range(4)]
+    self.sister_ids = [sister.id for sister in self.sisters]
+    set_required_sisters(self.first, self.sisters)
+    set_required_sisters(self.second, self.sisters[:3])
+    set_attendance_status(self.first, self.sisters[0], AttendanceRecord.ATTENDED)
+    set_attendance_status(self.second, self.sisters[0], AttendanceRecord.ATTENDED)
+    set_attendance_status(self.first, self.sisters[1], AttendanceRecord.EXCUSED)
+    set_attendance_status(self.second, self.sisters[1], AttendanceRecord.FREEBIED)
+    set_attendance_status(self.first, self.sisters[2], AttendanceRecord.ATTENDED)
+    set_attendance_status(self.optional, self.sisters[3], AttendanceRecord.ATTENDED)
+    ExtraPoints.objects.create(sister=self.sisters[2], semester=self.semester, points=3, reason="x")
+
+  def test_scores_match_scoring(self):
+    attendance_matrix = matrix.load_matrix(self.sister_ids, self.semester.id)
+
+    self.assertEqual(attendance_matrix.get_scores(), scoring.get_scores(self.sister_ids, self.semester.id))
+
+  def test_eligibility_rules(self):
+    self.optional.set_eligibility_rule([Sister.ACTIVE], 2019)
+    self.optional.is_mandatory = True
+    self.optional.save()
+
+    attendance_matrix = matrix.load_matrix(self.sister_ids, self.semester.id)
+
+    self.assertEqual(attendance_matrix.get_scores(), scoring.get_scores(self.sister_ids, self.semester.id))
+    self.assertEqual(attendance_matrix.get_turnout()[2][1:], (1, 4, .25))
+
+  def test_turnout(self):
+    attendance_matrix = matrix.load_matrix(self.sister_ids, self.semester.id)
+
+    self.assertEqual(attendance_matrix.get_turnout(), [
+      (self.first, 2, 4, .5),
+      (self.second, 1, 3, 1/3.),
+      (self.optional, 1, 0, None),
+    ])
+
+  def test_percentiles_and_below_target(self):
+    attendance_matrix = matrix.load_matrix(self.sister_ids, self.semester.id)
+
+    # 30/30, 27.5/30 (excused + freebie), 13/30 (with extra points),
+    # 5/10 (bonus from the optional event)
+    fractions = attendance_matrix.get_fractions()
+    self.assertAlmostEqual(fractions[1], 27.5/30)
+    self.assertEqual(dict(attendance_matrix.get_percentiles(qs=(0, 100))), {0: 13/30., 100: 1})
+    self.assertEqual(attendance_matrix.get_below_target_distribution(), [
+      (0, .5, 1), (.5, .6, 1), (.6, .7, 0), (.7, .8, 0), (.8, scoring.TARGET_PERCENTAGE, 0),
+    ])
+
+  def test_no_events(self):
+    other = Semester.objects.create(term=Semester.SPRING, year=2018)
+
+    attendance_matrix = matrix.load_matrix(self.sister_ids, other.id)
+
+    self.assertEqual(attendance_matrix.get_percentiles(), [])
+    self.assertEqual(attendance_matrix.get_turnout(), [])
+    self.assertEqual(sum(count for low, high, count in attendance_matrix.get_below_target_distribution()), 0)
+
+  def test_chapter_stats_view(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+
+    response = self.client.get(reverse('attendance:chapter_stats'), {'semester': self.semester.id})
+
+    self.assertTrue(response.context['is_available'])
+    self.assertEqual(response.context['num_below_target'], 2)
+    # Latest event first
+    self.assertEqual(response.context['turnout'][0][0], self.optional)
+
+##########################
+##### FORECAST TESTS #####
+##########################
+class ForecastTests(TestCase):
+  def setUp(self):
+    self.semester = Semester.objects.create(term=Semester.FALL, year=2017)
+    self.past = create_event("past", -1, 20, semester=self.semester, is_mandatory=True)
+    self.future = create_event("future", 1, 20, semester=self.semester, is_mandatory=True)
+    self.later = create_event("later", 2, 10, semester=self.semester, is_mandatory=True)
+    create_event("optional", 3, 50, semester=self.semester)
+
+  def test_get_forecast(self):
+    # 15 of 20 so far, 30 points left: 85% of 50 is 42.5
+    forecast = scoring.get_forecast(scoring.Score(15, 20, 0), 30)
+    self.assertEqual(forecast, scoring.Forecast(30, 28, 45/50., 15/50.))
+    self.assertFalse(forecast.is_at_risk())
+
+    # An approved excuse counts towards the worst case
+    self.assertEqual(scoring.get_forecast(scoring.Score(15, 20, 0), 30, 7.5).worst_fraction, 22.5/50)
+
+    self.assertTrue(scoring.get_forecast(scoring.Score(0, 20, 0), 10).is_at_risk())
+    self.assertEqual(scoring.get_forecast(scoring.Score(20, 20, 0), 0).points_needed, 0)
+    # Exactly on target needs no rounding up
+    self.assertEqual(scoring.get_forecast(scoring.Score(0, 0, 0), 100).points_needed, 85)
+    self.assertEqual(scoring.get_forecast(scoring.Score(0, 0, 0), 0),
+      scoring.Forecast(0, 0, None, None))
+
+  def test_get_forecasts(self):
+    safe = create_sister("safe", Sister.ACTIVE, 2019)
+    at_risk = create_sister("at_risk", Sister.ACTIVE, 2019)
+    excused = create_sister("excused", Sister.ACTIVE, 2019)
+    set_required_sisters(self.past, [safe, at_risk, excused])
+    set_required_sisters(self.future, [safe, at_risk, excused])
+    set_attendance_status(self.past, safe, AttendanceRecord.ATTENDED)
+    set_attendance_status(self.past, excused, AttendanceRecord.ATTENDED)
+    set_attendance_status(self.future, excused, AttendanceRecord.EXCUSED)
+    sister_ids = [safe.id, at_risk.id, excused.id]
+    scoring.get_forecasts(sister_ids, self.semester.id)
+
+    with self.assertNumQueries(5):
+      forecasts = scoring.get_forecasts(sister_ids, self.semester.id)
+
+    self.assertEqual(forecasts[safe.id], scoring.Forecast(20, 14, 1, .5))
+    self.assertTrue(forecasts[at_risk.id].is_at_risk())
+    self.assertEqual(forecasts[excused.id].worst_fraction, 35/40.)
+
+  def test_personal_record_forecast(self):
+    user = create_and_login_user(self.client, 'bob', 'siewj', False, test_email)
+    sister = Sister.objects.create(user=user, status=Sister.ACTIVE, class_year=2019)
+    set_required_sisters(self.past, [sister])
+    set_required_sisters(self.later, [sister])
+    set_attendance_status(self.past, sister, AttendanceRecord.ATTENDED)
+
+    response = self.client.get(reverse('attendance:personal_record'), {'semester': self.semester.id})
+
+    self.assertEqual(response.context['forecast'], scoring.Forecast(10, 6, 1, 20/30.))
+    self.assertEqual(response.context['best_percentage'], "100%")
+    self.assertContains(response, "takes <b>6</b> of the <b>10</b> points")
+
+  def test_sisters_page_flags_sisters_at_risk(self):
+    create_and_login_user(self.client, 'bob', 'siewj', True, test_email)
+    safe = create_sister("safe", Sister.ACTIVE, 2019)
+    at_risk = create_sister("at_risk", Sister.ACTIVE, 2019)
+    set_required_sisters(self.past, [safe, at_risk])
+    set_attendance_status(self.past, safe, AttendanceRecord.ATTENDED)
+
+    response = self.client.get(reverse('attendance:sisters'), {'semester': self.semester.id})
+
+    at_risk_ids = [sister.id for sister in response.context['sisters'] if sister.is_at_risk]
+    self.assertEqual(at_risk_ids, [at_risk.id])
+    self.assertEqual(response.context['num_at_risk'], 1)
+
+###########################
+##### SEMESTERS TESTS #####
+###########################
+class SemestersTests(TestCase):
+  def test_semester_directory_is_cached_until_semesters_change(self):
+    older = Semester.objects.create(term=Semester.SPRING, year=2016)
+    latest = Semester.objects.create(term=Semester.FALL, year=2016)
+    self.assertEqual(get_semesters(), [latest, older])
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(get_semesters(), [latest, older])
+    self.assertEqual(len(queries), 0)
+
+    newest = Semester.objects.create(term=Semester.SPRING, year=2017)
+    self.assertEqual(get_semesters(), [newest, latest, older])
+
+    newest.delete()
+    self.assertEqual(get_semesters(), [latest, older])
@@ -11,6 +11,8 @@ urlpatterns = [
 
   # Sister-related views
   url(r'^sisters/$', views.sisters, name='sisters'),
+  url(r'^sisters/export/$', views.export_attendance, name='export_attendance'),
+  url(r'^sisters/stats/$', views.chapter_stats, name='chapter_stats'),
   # sister_record is used for an admin looking at someone else's attendance
   url(r'^sisters/(?P<sister_id>[0-9]+)/$', views.sister_record, name='sister_record'),
   # personal_record is used for a logged-in user looking at their own attendance
@@ -20,13 +22,21 @@ urlpatterns = [
   url(r'^events/$', views.events, name='events'),
   url(r'^events/(?P<event_id>[0-9]+)/$', views.event_details, name='event_details'),
   url(r'^events/(?P<event_id>[0-9]+)/activate/$', views.activate, name='activate'),
+  url(r'^events/activate/$', views.activate_events, name='activate_events'),
+  url(r'^events/(?P<event_id>[0-9]+)/finalize/$', views.finalize, name='finalize'),
   url(r'^events/(?P<event_id>[0-9]+)/checkin/sisters/(?P<sister_id>[0-9]+)$', views.checkin_sister, name='checkin_sister'),
   url(r'^events/(?P<event_id>[0-9]+)/uncheck/sisters/(?P<sister_id>[0-9]+)$', views.uncheck_sister, name='uncheck_sister'),
+  # JSON versions of checkin_sister and uncheck_sister, used by the event details page
+  url(r'^events/(?P<event_id>[0-9]+)/checkin/sisters/(?P<sister_id>[0-9]+)/json/$', views.checkin_sister_json, name='checkin_sister_json'),
+  url(r'^events/(?P<event_id>[0-9]+)/uncheck/sisters/(?P<sister_id>[0-9]+)/json/$', views.uncheck_sister_json, name='uncheck_sister_json'),
+  # Batch of check-ins queued by a kiosk while offline
+  url(r'^events/checkins/sync/$', views.sync_checkins_json, name='sync_checkins'),
 
   # Excuse-related views
   url(r'^excuses/submit/(?P<event_id>[0-9]+)/$', views.excuse_submit, name='excuse_submit'),
   
   url(r'^excuses/pending/$', views.excuse_pending, name='excuse_pending'),
+  url(r'^excuses/review/$', views.excuse_review, name='excuse_review'),
   url(r'^excuses/approve/(?P<excuse_id>[0-9]+)/$', views.excuse_approve, name='excuse_approve'),
   url(r'^excuses/deny/(?P<excuse_id>[0-9]+)/$', views.excuse_deny, name='excuse_deny'),
 
@@ -1,24 +1,39 @@
+import json
+
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.views.decorators.http import require_POST
 from django.contrib import messages
 from django.contrib.messages import get_messages
 from django.utils import timezone
-from django.core.mail import send_mail
-from django.conf import settings
 from general.views import get_sister
 from django.utils.datastructures import MultiValueDictKeyError
 from django.forms import modelformset_factory
-
-from .models import Event, User, Excuse, Semester, ExtraPoints, ExtraPointsForm
+from django.db import IntegrityError, transaction
+from django.db.models import Case, IntegerField, Q, Sum, When
+
+from .models import AttendanceRecord, Event, User, Excuse, Semester, ExtraPoints, ExtraPointsForm, finalize_event, format_eligible_statuses, set_attendance_status
+from .checkin_sync import parse_checkins, sync_checkins
+from .export import get_export_filename, iter_attendance_csv
+from .ledger import get_ledger, invalidate_ledger, refresh_ledger
+from .outbox import queue_email, queue_emails
+from .semesters import get_latest_semester, get_semester, get_semesters
+from .scoring import NOT_REQUIRED, TARGET_PERCENTAGE, Score, get_earned_points, get_event_statuses, get_forecast, get_forecasts, get_future_points, get_score
+try:
+  # Needs NumPy, which is optional (see matrix.py)
+  from . import matrix
+except ImportError:
+  matrix = None
 from general.models import Sister
+from general.roster import PRESENT_STATUSES, get_active_roster
 
 #####################
 ##### CONSTANTS #####
 #####################
 no_percentage_available_message = "There have been no mandatory events that you've needed to attend yet!"
-value_of_excused_absence = .75
+value_of_excused_absence = Event.VALUE_OF_EXCUSED_ABSENCE
 
 ##########################
 ##### HELPER METHODS #####
@@ -33,105 +48,387 @@ def get_semester_id(request):
     return int(request.GET['semester'])
   else:
     # Otherwise, use the latest semester
-    semester = Semester.objects.all()[0]
+    semester = get_latest_semester()
     return semester.id
 
 # Returns all the information necessary for a full attendance record
 # for the given sister in the given semester.
 # Assumes that both sister and semester_id are valid.
 def get_sister_record(sister, semester_id):
-  semester = Semester.objects.get(id=semester_id)
+  semester = get_semester(semester_id)
   time_threshold = timezone.now()
   #date__lte means 'date is less than or equal to'
   past_events = Event.objects.filter(semester=semester, date__lte=time_threshold).order_by('date')
   future_events = Event.objects.filter(semester=semester, date__gt=time_threshold).order_by('date')
 
-  # For past events, determine what points sister actually earned
-  # TODO: Duplicate code from calculate percentage?
+  # For past events, determine what points sister actually earned.
+  # earned_points and attendance are only set on the event objects for
+  # display; nothing is saved.
+  past_events = list(past_events)
+  statuses = get_event_statuses(past_events, [sister.id])
   overall_earned_points = 0
   overall_total_points = 0
+  # Unlike overall_earned_points, this also counts events the sister
+  # attended without being required, same as calculate_percentage.
+  percentage_earned_points = 0
   for event in past_events:
-    if sister in event.sisters_required.all():
-      if (sister in event.sisters_attended.all()) or (sister in event.sisters_freebied.all()):
-        event.earned_points = event.points
-      elif (sister in event.sisters_excused.all()):
-        event.earned_points = value_of_excused_absence*event.points
-      else:
-        event.earned_points = 0
-      event.save()
-      overall_earned_points += event.earned_points
+    event_status = statuses.get((event.id, sister.id), NOT_REQUIRED)
+    event.attendance = get_attendance_display(event_status)
+    earned_points = get_earned_points(event.points, event_status)
+    percentage_earned_points += earned_points
+    if event_status.is_required:
+      event.earned_points = earned_points
+      overall_earned_points += earned_points
       if (event.is_mandatory):
         overall_total_points += event.points
     else:
       event.earned_points = "--"
 
-
   # List of events and excuses
   # If the item is an excuse, then there is an excuse associated
   #    with that event for this particular sister.
   # Otherwise, the item is an event and there is no associated excuse.
+  future_events = list(future_events)
+  excuses = {}
+  for excuse in Excuse.objects.filter(sister=sister, event__in=future_events).order_by('id'):
+    # If there's more than one excuse for an event, show the latest
+    excuses[excuse.event_id] = excuse
   future_events_and_excuses = []
   for event in future_events:
-    try:
-      excuse = Excuse.objects.get(event=event, sister=sister)
-    except Excuse.DoesNotExist:
+    excuse = excuses.get(event.id)
+    if excuse is None:
       future_events_and_excuses.append(event)
     else:
+      # Reuse the event that's already loaded for displaying the excuse
+      excuse.event = event
       future_events_and_excuses.append(excuse)
 
   # Add in any extra points
-  extra_points = ExtraPoints.objects.filter(sister=sister, semester=semester)
-  for extra in extra_points:
-    overall_earned_points += extra.points
-
-  semesters = Semester.objects.all()
+  extra_points = list(ExtraPoints.objects.filter(sister=sister, semester=semester))
+  extra_total = sum(extra.points for extra in extra_points)
+  overall_earned_points += extra_total
+
+  score = Score(
+    earned_points=percentage_earned_points + extra_total,
+    total_points=overall_total_points,
+    extra_points=extra_total)
+  percentage = score.fraction()
+  if percentage is None:
+    percentage = no_percentage_available_message
+
+  # What she still needs from the events that are left
+  forecast = get_forecast(score, *get_future_points(future_events, [sister.id])[sister.id])
+
+  semesters = get_semesters()
   context = {
     'sister': sister,
     'past_events': past_events,
     'future_events_and_excuses': future_events_and_excuses,
     'semesters': semesters,
     'current_semester': semester,
-    'percentage': format_percentage(calculate_percentage(sister, semester_id)),
+    'percentage': format_percentage(percentage),
     'overall_total_points': overall_total_points,
     'overall_earned_points': overall_earned_points,
     'extra_points': extra_points,
+    'forecast': forecast,
+    'target_percentage': int(round(TARGET_PERCENTAGE*100)),
   }
+  if forecast.best_fraction is not None:
+    context['best_percentage'] = format_percentage(forecast.best_fraction)
+    context['worst_percentage'] = format_percentage(forecast.worst_fraction)
   return context
 
+# Returns the eligibility rule for an event activated for the given
+# group: 'all', 'new_members', or a class year.
+# The rule is a (list of Sister statuses, class year or None) pair.
+# Anyone that isn't abroad, an alum, or deaffiliated is considered
+# a possible attendee.
+def get_eligibility_rule(required_group):
+  possible_statuses = list(PRESENT_STATUSES)
+  if (required_group == 'all'):
+    return possible_statuses, None
+  elif (required_group == 'new_members'):
+    return [Sister.NEW_MEMBER], None
+  else:
+    # Value is a year
+    year = int(required_group)
+    return possible_statuses, year
+
+# Returns the attendance status a sister should have at an event
+# she didn't attend: excused or freebied if she has an approved excuse
+# for it, and absent otherwise.
+def get_status_without_attendance(event, sister):
+  excuse = Excuse.objects \
+    .filter(event=event, sister=sister, status=Excuse.APPROVED) \
+    .order_by('-id') \
+    .first()
+  if excuse is None:
+    return AttendanceRecord.ABSENT
+  elif excuse.is_freebie:
+    return AttendanceRecord.FREEBIED
+  else:
+    return AttendanceRecord.EXCUSED
+
+# Returns the number of sisters required at the event, the number who
+# attended, and the number excused (including freebies), as a dict.
+# Uses a single aggregate query, unless the event uses an eligibility
+# rule, which has to be checked against the sisters.
+def get_event_counts(event):
+  if event.uses_eligibility_rule():
+    statuses = get_event_statuses([event]).values()
+    return {
+      'num_required': len([s for s in statuses if s.is_required]),
+      'num_attended': len([s for s in statuses if s.status == AttendanceRecord.ATTENDED]),
+      'num_excused': len([s for s in statuses if s.status in (AttendanceRecord.EXCUSED, AttendanceRecord.FREEBIED)]),
+    }
+
+  def count_where(**conditions):
+    return Sum(Case(When(then=1, **conditions), default=0, output_field=IntegerField()))
+  counts = AttendanceRecord.objects.filter(event=event).aggregate(
+    num_required=count_where(is_required=True),
+    num_attended=count_where(status=AttendanceRecord.ATTENDED),
+    num_excused=count_where(status__in=[AttendanceRecord.EXCUSED, AttendanceRecord.FREEBIED]),
+  )
+  # Sums over no records are None
+  return dict((key, value or 0) for key, value in counts.items())
+
+# Returns the percent of required sisters who attended, were excused,
+# and were absent, as a dict of 2-digit integers.
+# counts is the dict returned by get_event_counts.
+def get_event_percentages(counts):
+  num_required = counts['num_required']
+
+  # TODO: Display something if no required sisters?
+  if num_required == 0:
+    return {
+      'percent_attended': 0,
+      'percent_excused': 0,
+      'percent_absent': 0,
+    }
+
+  fraction_attended = counts['num_attended']*1.0 / num_required
+  fraction_excused = counts['num_excused']*1.0 / num_required
+  fraction_absent = 1.0 - fraction_attended - fraction_excused
+
+  # Convert fraction to 2-digit integer for percentage
+  return {
+    'percent_attended': int(round(fraction_attended*100, 0)),
+    'percent_excused': int(round(fraction_excused*100, 0)),
+    'percent_absent': int(round(fraction_absent*100, 0)),
+  }
+
+# Returns the attendance records of every sister required at the event,
+# ordered by name, with each record's sister already loaded.
+# Each record holds that sister's single status for the event.
+# Sisters that an eligibility rule requires who don't have a record
+# yet get an unsaved, absent one.
+def get_event_roster(event):
+  if not event.uses_eligibility_rule():
+    return list(AttendanceRecord.objects \
+      .filter(event=event, is_required=True) \
+      .select_related('sister') \
+      .order_by('sister__display_name'))
+
+  roster = []
+  for record in AttendanceRecord.objects.filter(event=event).select_related('sister'):
+    if record.required_override is not None:
+      is_required = record.required_override
+    else:
+      is_required = event.is_eligible(record.sister.status, record.sister.class_year)
+    if is_required:
+      roster.append(record)
+  for sister in Sister.objects \
+      .filter(event.get_eligibility_q()) \
+      .exclude(attendancerecord__event=event):
+    roster.append(AttendanceRecord(event=event, sister=sister))
+  roster.sort(key=lambda record: record.sister.display_name)
+  return roster
+
+# Marks the sister as attended, which replaces any excused
+# or freebied status she had.
+def record_checkin(event, sister):
+  set_attendance_status(event, sister, AttendanceRecord.ATTENDED)
+  refresh_ledger(event.semester_id, [sister.id])
+
+# Removes the sister from the event's attendees, putting her back
+# as excused / freebied if she has an approved excuse.
+def record_uncheck(event, sister):
+  AttendanceRecord.objects \
+    .filter(event=event, sister=sister, status=AttendanceRecord.ATTENDED) \
+    .update(status=get_status_without_attendance(event, sister))
+  refresh_ledger(event.semester_id, [sister.id])
+
+# Returns what the event details page needs to redraw one sister's row
+# after checking her in or out: her status and the event's counts.
+def get_checkin_json(event, sister):
+  record = AttendanceRecord.objects.filter(event=event, sister=sister).first()
+  if record is None:
+    status = AttendanceRecord.ABSENT
+  else:
+    status = record.status
+  counts = get_event_counts(event)
+  data = {
+    'sister_id': sister.id,
+    'status': status,
+    'is_attended': status == AttendanceRecord.ATTENDED,
+    'excused_display': get_excused_display(status),
+  }
+  data.update(counts)
+  data.update(get_event_percentages(counts))
+  return data
+
+# Returns what the 'Excused?' column of the event details page shows
+# for the given AttendanceRecord status.
+def get_excused_display(status):
+  if status == AttendanceRecord.EXCUSED:
+    return "Excused"
+  elif status == AttendanceRecord.FREEBIED:
+    return "Freebied"
+  else:
+    return "--"
+
+# Queues an email telling the sister what happened to her excuse.
+# It's sent later by the send_queued_emails command (see outbox.py).
+def queue_excuse_email(excuse, event, sister, result):
+  email = get_excuse_email(excuse, event, sister, result)
+  if email:
+    queue_email(*email)
+
+# Returns a page of pending excuses ordered by event date, with each
+# excuse's event and sister already loaded, and the id to pass as
+# after_id to get the next page (None if this is the last page).
+# Only pending excuses are read, so the cost doesn't depend on how many
+# excuses have ever been filed.
+def get_pending_excuses(semester_id=None, event_id=None, after_id=None, page_size=50):
+  excuses = Excuse.objects \
+    .filter(status=Excuse.PENDING) \
+    .select_related('event', 'sister') \
+    .order_by('event__date', 'id')
+  if semester_id is not None:
+    excuses = excuses.filter(event__semester_id=semester_id)
+  if event_id is not None:
+    excuses = excuses.filter(event_id=event_id)
+  if after_id is not None:
+    # Keyset pagination: start right after the given excuse
+    after = Excuse.objects.select_related('event').filter(id=after_id).first()
+    if after is not None:
+      excuses = excuses.filter(
+        Q(event__date__gt=after.event.date) |
+        Q(event__date=after.event.date, id__gt=after.id))
+
+  # Load one extra to know whether there's another page
+  excuses = list(excuses[:page_size + 1])
+  if len(excuses) > page_size:
+    excuses = excuses[:page_size]
+    return excuses, excuses[-1].id
+  return excuses, None
+
+# Returns the (subject, body, recipient) of the email telling the sister
+# what happened to her excuse, or None if she has no email address.
+def get_excuse_email(excuse, event, sister, result):
+  if (sister.user.email):
+    message = result + \
+      'For reference, here is the excuse you submitted: \n' + \
+      excuse.text
+    return ('Excuse for ' + event.__str__(), message, sister.user.email)
+  return None
+
+# Approves (if is_approved) or denies the pending excuses with the given
+# ids all at once, the same way excuse_approve and excuse_deny do one.
+# Runs a fixed number of queries, however many excuses there are.
+# Returns the number of excuses reviewed.
+def review_excuses(excuse_ids, is_approved):
+  if is_approved:
+    new_status = Excuse.APPROVED
+    result = 'Your excuse is approved. \n'
+  else:
+    new_status = Excuse.DENIED
+    result = 'Your excuse is denied. \n'
+
+  with transaction.atomic():
+    excuses = list(Excuse.objects
+      .select_for_update()
+      .filter(id__in=excuse_ids, status=Excuse.PENDING)
+      .select_related('event', 'sister__user')
+      .order_by('id'))
+    Excuse.objects \
+      .filter(id__in=[excuse.id for excuse in excuses]) \
+      .update(status=new_status)
+    if is_approved:
+      set_excused_statuses(excuses)
+
+    # Email sisters with results
+    queue_emails([email for email in
+      (get_excuse_email(excuse, excuse.event, excuse.sister, result) for excuse in excuses)
+      if email])
+
+  if is_approved:
+    touched = {}
+    for excuse in excuses:
+      touched.setdefault(excuse.event.semester_id, set()).add(excuse.sister_id)
+    for semester_id, sister_ids in touched.items():
+      refresh_ledger(semester_id, sister_ids)
+  return len(excuses)
+
+# Marks the sister of each of the approved excuses as excused or
+# freebied at its event, unless she was already checked in.
+# Later excuses in the list win over earlier ones for the same event.
+def set_excused_statuses(excuses):
+  statuses = {}
+  for excuse in excuses:
+    if (excuse.is_freebie):
+      statuses[(excuse.event_id, excuse.sister_id)] = AttendanceRecord.FREEBIED
+    else:
+      statuses[(excuse.event_id, excuse.sister_id)] = AttendanceRecord.EXCUSED
+  if not statuses:
+    return
+
+  records = dict(
+    ((record.event_id, record.sister_id), record) for record in
+    AttendanceRecord.objects.filter(
+      event_id__in=set(event_id for event_id, sister_id in statuses),
+      sister_id__in=set(sister_id for event_id, sister_id in statuses)))
+  new_records = []
+  # Maps each status to the ids of the records that should have it
+  updates = {}
+  for (event_id, sister_id), status in statuses.items():
+    record = records.get((event_id, sister_id))
+    if record is None:
+      new_records.append(AttendanceRecord(event_id=event_id, sister_id=sister_id, status=status))
+    elif record.status not in (AttendanceRecord.ATTENDED, status):
+      updates.setdefault(status, []).append(record.id)
+  AttendanceRecord.objects.bulk_create(new_records)
+  for status, record_ids in updates.items():
+    AttendanceRecord.objects.filter(id__in=record_ids).update(status=status)
+
+# Returns a description of a sister's attendance at a past event,
+# given her scoring.EventStatus for that event.
+def get_attendance_display(event_status):
+  if event_status.status == AttendanceRecord.ATTENDED:
+    return "Attended"
+  elif event_status.status == AttendanceRecord.FREEBIED:
+    return "Used Freebie"
+  elif event_status.status == AttendanceRecord.EXCUSED:
+    return "Excused"
+  elif event_status.is_required:
+    # They were supposed to be there but weren't listed
+    # as excused or attended
+    return "Missed"
+  else:
+    return "Not Required To Attend"
+
 # Returns a sister's attendance for the given semester for events in the past.
 # Attendance is returned as a float, where 1.0 represents 100% attendance.
 # If there haven't been any mandatory events or this sister hasn't
 #   been required at any events this semester, the no_percentage_available_message
 #   will be returned instead.
 # Assumes that both sister and semester_id are valid.
+# The points themselves come from scoring.get_score, which uses the
+#   same number of queries however many events there are.
 def calculate_percentage(sister,semester_id):
-  semester = Semester.objects.get(id=semester_id)
-  time_threshold = timezone.now()
-  past_events = Event.objects.filter(semester=semester, date__lte=time_threshold)
-  
-  total_points=0
-  earned_points=0
-
-  for event in past_events:
-    if (sister in event.sisters_required.all()):
-      if (event.is_mandatory):
-        total_points+=event.points
-      if (sister in event.sisters_attended.all()) or (sister in event.sisters_freebied.all()):
-        # A freebie earns 100% of the event points
-        earned_points+=event.points
-      elif sister in event.sisters_excused.all():
-        earned_points+= value_of_excused_absence*event.points
-    elif sister in event.sisters_attended.all() and sister not in event.sisters_required.all():
-      earned_points+=event.points
-
-
-  # Add in any extra points
-  extra_points = ExtraPoints.objects.filter(sister=sister, semester=semester)
-  for extra in extra_points:
-    earned_points += extra.points
-
-  if total_points !=0:
-    return float(earned_points)/float(total_points)
+  fraction = get_score(sister, semester_id).fraction()
+  if fraction is not None:
+    return fraction
   else:
     return no_percentage_available_message
 
@@ -144,7 +441,7 @@ def calculate_percentage(sister,semester_id):
 def format_percentage(fraction):
   if (fraction != no_percentage_available_message):
     # If they're within 85%, be more granular
-    if abs(fraction - .85) <= .05:
+    if abs(fraction - TARGET_PERCENTAGE) <= .05:
       return str(round(fraction*100, 2)) + "%"
     else:
       return str(int(round(fraction*100, 0))) + "%"
@@ -160,7 +457,7 @@ def index(request):
   # Set latest_semester session variable
   # to use when rendering attendance for a default semester
   #request.session['latest_semester'] = latest_semester.id
-  latest_semester = Semester.objects.all()[0]
+  latest_semester = get_latest_semester()
   return render(request, 'attendance/index.html', {'semester': latest_semester})
 
 
@@ -173,7 +470,7 @@ def index(request):
 def events(request):
   # Get all events for this semester
   semester_id = get_semester_id(request)
-  semester = Semester.objects.get(id=semester_id)
+  semester = get_semester(semester_id)
   events = Event.objects.filter(semester=semester).order_by('date')
   
   # Get years for activation button
@@ -185,7 +482,7 @@ def events(request):
   years_list.sort()
   years_list.reverse()
 
-  semesters = Semester.objects.all()
+  semesters = get_semesters()
   context = {
     'events': events,
     'years': years_list,
@@ -201,74 +498,74 @@ def event_details(request, event_id):
   event = get_object_or_404(Event, pk=event_id)
   if (event.is_activated):
     # Event has been activated
-
-    # Get fraction attended, excused, and absent
-    # The excused set and attended set should be mutually exclusive
-    num_required = len(event.sisters_required.all())
-
-    # TODO: Display something if no required sisters?
-    if num_required == 0:
-      percent_attended = 0
-      percent_excused = 0
-      percent_absent = 0
-    else:
-      fraction_attended = len(event.sisters_attended.all())*1.0 / num_required
-      fraction_excused = (len(event.sisters_excused.all()) + len(event.sisters_freebied.all()))*1.0 / num_required
-      fraction_absent = 1.0 - fraction_attended - fraction_excused
-
-      # Convert fraction to 2-digit integer for percentage
-      percent_attended = int(round(fraction_attended*100, 0))
-      percent_excused = int(round(fraction_excused*100, 0))
-      percent_absent = int(round(fraction_absent*100, 0))
-
-    context = {
-      'percent_attended': percent_attended,
-      'percent_excused': percent_excused,
-      'percent_absent': percent_absent,
-      'event': event,
-    }
+    context = get_event_percentages(get_event_counts(event))
+    context['event'] = event
+    context['roster'] = get_event_roster(event)
+    context['can_finalize'] = event.uses_eligibility_rule()
     return render(request, 'attendance/event_details.html', context)
   else:
     # TODO: use render with a different context
     return HttpResponse("This event has not been activated yet.") 
 
 # Activate an event.
-# This records a list of sisters who should be attending, based
-# on the status of all sisters. Anyone that isn't abroad, an alum,
-# or deaffiliated is considered a possible attendee.
+# This sets the event's eligibility rule, which decides who should be
+# attending based on the status of all sisters, until the event is
+# finalized (see get_eligibility_rule). Activating a finalized event
+# replaces its snapshot with the new rule.
 @user_passes_test(lambda u: u.is_staff)
 def activate(request, event_id):  
-  # Create the list of sisters who should attend
-  required_group = request.POST['activate_group']
-  if (required_group == 'all'):
-    sisters_required = Sister.objects.exclude(status=Sister.ALUM).exclude(status=Sister.ABROAD).exclude(status=Sister.DEAFFILIATED)
-  elif (required_group == 'new_members'):
-    sisters_required = Sister.objects.filter(status=Sister.NEW_MEMBER)
-  else:
-    # Value is a year
-    year = int(required_group)
-    sisters_required = Sister.objects.filter(class_year=year).exclude(status=Sister.ALUM).exclude(status=Sister.ABROAD).exclude(status=Sister.DEAFFILIATED)
-
+  statuses, class_year = get_eligibility_rule(request.POST['activate_group'])
   event = get_object_or_404(Event, pk=event_id)
-  event.sisters_required = sisters_required
+  event.set_eligibility_rule(statuses, class_year)
   event.is_activated = True
+  # Go back to using the rule, even if the event was finalized before.
+  # Events that already happened are finalized again with the new rule
+  # the next time finalize_past_events runs.
+  event.is_finalized = False
   event.save()
+  # Everyone who's now required may have a different percentage
+  invalidate_ledger(event.semester_id)
   # Redirect to the event details page
   return HttpResponseRedirect(
     reverse('attendance:event_details', args=(event.id,)))
 
+# Activates every event checked on the events page at once, for the
+# same choice of group as activate.
+@user_passes_test(lambda u: u.is_staff)
+@require_POST
+def activate_events(request):
+  statuses, class_year = get_eligibility_rule(request.POST['activate_group'])
+  events = list(Event.objects.filter(id__in=request.POST.getlist('events')))
+  Event.objects.filter(id__in=[event.id for event in events]).update(
+    eligible_statuses=format_eligible_statuses(statuses),
+    eligible_class_year=class_year,
+    is_activated=True,
+    is_finalized=False)
+  for semester_id in set(event.semester_id for event in events):
+    invalidate_ledger(semester_id)
+
+  # Redirect to the events page for the semester the events were in
+  url = reverse('attendance:events')
+  if events:
+    url += '?semester=' + str(events[0].semester_id)
+  return HttpResponseRedirect(url)
+
+# Saves who the event's eligibility rule currently requires, so that
+# later changes to sisters' statuses don't change the event's roster.
+@user_passes_test(lambda u: u.is_staff)
+@require_POST
+def finalize(request, event_id):
+  event = get_object_or_404(Event, pk=event_id)
+  finalize_event(event)
+  return HttpResponseRedirect(
+    reverse('attendance:event_details', args=(event.id,)))
+
 # Check-in a particular sister for a particular event.
 @user_passes_test(lambda u: u.is_staff)
 def checkin_sister(request, event_id, sister_id):
   event = get_object_or_404(Event, pk=event_id)
   sister = get_object_or_404(Sister, pk=sister_id)
-  # Add sister to list of attendees
-  event.sisters_attended.add(sister)
-  # Remove from excused absences to avoid duplication
-  event.sisters_excused.remove(sister)
-  # Removed from freebied absences to avoid duplication
-  event.sisters_freebied.remove(sister)
-  event.save()
+  record_checkin(event, sister)
   # Redirect to the same event details page
   return HttpResponseRedirect(
     reverse('attendance:event_details', args=(event.id,)))
@@ -277,25 +574,55 @@ def checkin_sister(request, event_id, sister_id):
 def uncheck_sister(request, event_id, sister_id):
   event = get_object_or_404(Event, pk=event_id)
   sister = get_object_or_404(Sister, pk=sister_id)
-  # Remove sister from list of attendees
-  event.sisters_attended.remove(sister)
-  # See if sister needs to be put back on the excused / freebied lists
-  try:
-    excuse = Excuse.objects.get(event=event, sister=sister)
-  except Excuse.DoesNotExist:
-    pass
-  else:
-    if (excuse.status == Excuse.APPROVED):
-      if (excuse.is_freebie):
-        event.sisters_freebied.add(sister)
-      else:
-        event.sisters_excused.add(sister)
-  event.save()
-
+  record_uncheck(event, sister)
   # Redirect to the same event details page
   return HttpResponseRedirect(
     reverse('attendance:event_details', args=(event.id,)))
 
+# Same as checkin_sister, but returns the sister's new status and the
+# event's updated counts as JSON instead of redirecting, so the event
+# details page can update a single row.
+@user_passes_test(lambda u: u.is_staff)
+@require_POST
+def checkin_sister_json(request, event_id, sister_id):
+  event = get_object_or_404(Event, pk=event_id)
+  sister = get_object_or_404(Sister, pk=sister_id)
+  record_checkin(event, sister)
+  return JsonResponse(get_checkin_json(event, sister))
+
+# Same as uncheck_sister, but returns JSON like checkin_sister_json.
+@user_passes_test(lambda u: u.is_staff)
+@require_POST
+def uncheck_sister_json(request, event_id, sister_id):
+  event = get_object_or_404(Event, pk=event_id)
+  sister = get_object_or_404(Sister, pk=sister_id)
+  record_uncheck(event, sister)
+  return JsonResponse(get_checkin_json(event, sister))
+
+# Applies a batch of check-ins that a kiosk queued while offline.
+# The request body is JSON: {"checkins": [{"event": 1, "sister": 2,
+#   "action": "checkin" or "uncheck", "timestamp": ISO 8601 time,
+#   "key": unique string}, ...]}
+# Responds with the keys that were applied, ignored (already synced),
+# and rejected (unknown event or sister). See checkin_sync.py.
+@user_passes_test(lambda u: u.is_staff)
+@require_POST
+def sync_checkins_json(request):
+  try:
+    body = json.loads(request.body.decode('utf-8'))
+    checkins = parse_checkins(body['checkins'])
+  except (ValueError, KeyError, TypeError) as e:
+    # InvalidCheckin is a ValueError
+    return JsonResponse({'error': str(e)}, status=400)
+
+  try:
+    result = sync_checkins(checkins)
+  except IntegrityError:
+    # Another request synced some of the same keys at the same time.
+    # Nothing was applied; resending the batch will skip those keys.
+    return JsonResponse({'error': "Batch conflicted with another sync, try again"}, status=409)
+  return JsonResponse(result)
+
 ################################
 ##### SISTER-RELATED VIEWS #####
 ################################
@@ -313,19 +640,31 @@ def personal_record(request):
 @user_passes_test(lambda u: u.is_superuser)
 def sisters(request):
   semester_id = get_semester_id(request)
-  semester = Semester.objects.get(id=semester_id)
-  active_sisters = Sister.objects.exclude(status=Sister.ALUM).exclude(status=Sister.DEAFFILIATED)
-
-  # Calculate each sister's percentaage
+  semester = get_semester(semester_id)
+  # Everyone who isn't an alum or deaffiliated, including sisters abroad
+  active_sisters = get_active_roster().get_entries()
+
+  # Read every sister's percentage from the ledger
+  sister_ids = [sister.id for sister in active_sisters]
+  ledger = get_ledger(semester.id, sister_ids)
+  # and flag the ones who can't reach the target anymore
+  forecasts = get_forecasts(sister_ids, semester.id, scores=dict(
+    (sister_id, Score(row.earned_points, row.total_points, row.extra_points))
+    for sister_id, row in ledger.items()))
   for sister in active_sisters:
-    percent = calculate_percentage(sister, semester.id)
-    sister.percentage = percent
+    percentage = ledger[sister.id].percentage
+    if percentage is None:
+      percentage = no_percentage_available_message
+    sister.percentage = percentage
+    sister.is_at_risk = forecasts[sister.id].is_at_risk()
 
   if request.GET.get('order_by_percent', False):
     # If order_by_percent = True, sort sisters by percentage,
-    # lowest percentage first
+    # lowest percentage first. Sisters without a percentage go last.
     def sort_func(sister):
-      return sister.percentage
+      if sister.percentage == no_percentage_available_message:
+        return (1, 0)
+      return (0, sister.percentage)
     sorted_sisters = sorted(active_sisters, key=sort_func)
   else:
     # Otherwise, sort sisters alphabetically
@@ -341,8 +680,10 @@ def sisters(request):
   context = {
     'sisters': sorted_sisters,
     'current_semester': semester,
-    'semesters': Semester.objects.all(),
+    'semesters': get_semesters(),
     'semester_tab_url': 'attendance:sisters',
+    'num_at_risk': sum(1 for sister in sorted_sisters if sister.is_at_risk),
+    'target_percentage': int(round(TARGET_PERCENTAGE*100)),
   }
   return render(request, 'attendance/sisters.html', context)
 
@@ -357,6 +698,40 @@ def sister_record(request, sister_id):
   return render(request, 'attendance/sister_record.html', context)
 
 
+# View chapter-wide statistics for the semester: how each past event
+# was attended, and how sisters' percentages are spread out.
+@user_passes_test(lambda u: u.is_superuser)
+def chapter_stats(request):
+  semester_id = get_semester_id(request)
+  semester = get_semester(semester_id)
+  context = {
+    'current_semester': semester,
+    'semesters': get_semesters(),
+    'semester_tab_url': 'attendance:chapter_stats',
+    'is_available': matrix is not None,
+  }
+  if matrix is None:
+    return render(request, 'attendance/chapter_stats.html', context)
+
+  # Same sisters as the sisters page
+  sister_ids = [sister.id for sister in get_active_roster().get_entries()]
+  attendance_matrix = matrix.load_matrix(sister_ids, semester.id)
+  context['turnout'] = [
+    (event, num_attended, num_required,
+      '' if fraction is None else format_percentage(fraction))
+    for event, num_attended, num_required, fraction in reversed(attendance_matrix.get_turnout())
+  ]
+  context['percentiles'] = [
+    (q, format_percentage(fraction)) for q, fraction in attendance_matrix.get_percentiles()
+  ]
+  context['below_target'] = [
+    (int(round(low*100)), int(round(high*100)), count)
+    for low, high, count in attendance_matrix.get_below_target_distribution()
+  ]
+  context['num_below_target'] = sum(count for low, high, count in context['below_target'])
+  context['target_percentage'] = int(round(TARGET_PERCENTAGE*100))
+  return render(request, 'attendance/chapter_stats.html', context)
+
 ################################
 ##### EXCUSE-RELATED VIEWS #####
 ################################
@@ -409,42 +784,83 @@ def excuse_submit(request, event_id):
       reverse('attendance:personal_record') + "?semester=" + str(event.semester.id))
   
 
-# Display all pending excuses.
+# Display pending excuses, a page at a time, ordered by event date.
+# Can be filtered with ?semester=ID and ?event=ID, and ?after=ID starts
+# the page after the excuse with that id.
 @user_passes_test(lambda u: u.is_superuser)
 def excuse_pending(request):
-  excuses = Excuse.objects.filter(status=Excuse.PENDING)
-  return render(request, 'attendance/excuse_pending.html', {'excuses': excuses})
+  try:
+    semester_id, event_id, after_id = [
+      int(request.GET[name]) if request.GET.get(name) else None
+      for name in ('semester', 'event', 'after')]
+  except ValueError:
+    return HttpResponseBadRequest('Filters must be integer ids.')
+  excuses, next_after_id = get_pending_excuses(semester_id, event_id, after_id)
+
+  # Keep the filters when going to the next page
+  filters = []
+  if semester_id:
+    filters.append('semester=' + str(semester_id))
+  if event_id:
+    filters.append('event=' + str(event_id))
+  next_page_query = None
+  if next_after_id is not None:
+    next_page_query = '&'.join(filters + ['after=' + str(next_after_id)])
+
+  try:
+    current_semester = get_semester(semester_id) if semester_id else None
+  except Semester.DoesNotExist:
+    current_semester = None
+
+  context = {
+    'excuses': excuses,
+    'next_page_query': next_page_query,
+    'semesters': get_semesters(),
+    'current_semester': current_semester,
+    'semester_tab_url': 'attendance:excuse_pending',
+  }
+  return render(request, 'attendance/excuse_pending.html', context)
+
+# Approve or deny every excuse checked on the pending excuses page.
+@user_passes_test(lambda u: u.is_superuser)
+@require_POST
+def excuse_review(request):
+  action = request.POST.get('action')
+  if action not in ('approve', 'deny'):
+    return HttpResponseBadRequest('Action must be approve or deny.')
+  try:
+    excuse_ids = [int(excuse_id) for excuse_id in request.POST.getlist('excuses')]
+  except ValueError:
+    return HttpResponseBadRequest('Excuse ids must be integers.')
+  review_excuses(excuse_ids, action == 'approve')
+  return HttpResponseRedirect(
+    reverse('attendance:excuse_pending'))
 
 # Approve an excuse.
 @user_passes_test(lambda u: u.is_superuser)
 def excuse_approve(request, excuse_id):
   excuse = get_object_or_404(Excuse, pk=excuse_id)
-  excuse.status = Excuse.APPROVED
-  excuse.save()
-
-  # Add that sister to list of excused or freebie sisters
-  # if they haven't alreaady been checked in
   event = get_object_or_404(Event, pk=excuse.event.id)
   sister = get_object_or_404(Sister, pk=excuse.sister.id)
-  if (sister not in event.sisters_attended.all()):
+  with transaction.atomic():
+    excuse.status = Excuse.APPROVED
+    excuse.save()
+
+    # Mark that sister as excused or freebied
+    # if they haven't alreaady been checked in
     if (excuse.is_freebie):
-      event.sisters_freebied.add(sister)
+      status = AttendanceRecord.FREEBIED
     else:
-      event.sisters_excused.add(sister)
-    event.save()
+      status = AttendanceRecord.EXCUSED
+    record, created = AttendanceRecord.objects.get_or_create(
+      event=event, sister=sister, defaults={'status': status})
+    if (not created and record.status != AttendanceRecord.ATTENDED):
+      record.status = status
+      record.save()
 
-  # Email sister with result
-  if (sister.user.email):
-    message = 'Your excuse is approved. \n' + \
-      'For reference, here is the excuse you submitted: \n' + \
-      excuse.text
-    send_mail(
-      'Excuse for ' + event.__str__(),
-      message,
-      settings.EMAIL_HOST_USER,
-      [sister.user.email],
-      fail_silently=False,
-    )
+    # Email sister with result
+    queue_excuse_email(excuse, event, sister, 'Your excuse is approved. \n')
+  refresh_ledger(event.semester_id, [sister.id])
 
   # Go back to list of pending excuses
   return HttpResponseRedirect(
@@ -454,27 +870,27 @@ def excuse_approve(request, excuse_id):
 @user_passes_test(lambda u: u.is_superuser)
 def excuse_deny(request, excuse_id):
   excuse = get_object_or_404(Excuse, pk=excuse_id)
-  excuse.status = Excuse.DENIED
-  excuse.save()
-
-  # Email sister with result
   sister = get_object_or_404(Sister, pk=excuse.sister.id)
   event = get_object_or_404(Event, pk=excuse.event.id)
-  if (sister.user.email):
-    message = 'Your excuse is denied. \n' + \
-      'For reference, here is the excuse you submitted: \n' + \
-      excuse.text
-    send_mail(
-      'Excuse for ' + event.__str__(),
-      message,
-      settings.EMAIL_HOST_USER,
-      [sister.user.email],
-      fail_silently=False,
-    )
+  with transaction.atomic():
+    excuse.status = Excuse.DENIED
+    excuse.save()
+
+    # Email sister with result
+    queue_excuse_email(excuse, event, sister, 'Your excuse is denied. \n')
 
   return HttpResponseRedirect(
     reverse('attendance:excuse_pending'))
 
+# Download the semester's attendance as a CSV file, with a row per
+# sister and a column per event (see export.py).
+@user_passes_test(lambda u: u.is_superuser)
+def export_attendance(request):
+  semester = get_semester(get_semester_id(request))
+  response = StreamingHttpResponse(iter_attendance_csv(semester.id), content_type='text/csv')
+  response['Content-Disposition'] = 'attachment; filename="%s"' % get_export_filename(semester)
+  return response
+
 ######################################
 ##### EXTRA POINTS-RELATED VIEWS #####
 ######################################
@@ -510,6 +926,7 @@ def extra_points(request):
     if form.is_valid():
       # Save a new object from the form's data
       new_extra_points = form.save()
+      refresh_ledger(new_extra_points.semester_id, [new_extra_points.sister_id])
 
       # Set session variable so sister's name can be displayed.
       sister = Sister.objects.get(id=request.POST['sister'])
@@ -48,6 +48,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'general.middleware.SisterMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -64,6 +65,7 @@ TEMPLATES = [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
+                'elections.context_processors.election_settings',
             ],
         },
     },
@@ -72,6 +74,24 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'axo.wsgi.application'
 
+
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+#
+# The semester directory, the active roster, logged-in sisters and the
+# election settings are cached, and cleared by signals when they change.
+# This cache is per process, so when running several worker processes
+# only the one that made a change sees it right away; the others see it
+# once the entry times out (5 seconds for election settings, up to an
+# hour for the rest). Use a shared cache such as memcached to make
+# changes visible to every process immediately.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 SITE_ID = 1 # Used for flatpages
 
 # Database
@@ -5,3 +5,7 @@ from django.apps import AppConfig
 
 class ElectionsConfig(AppConfig):
     name = 'elections'
+
+    def ready(self):
+        # Connects the signal receivers
+        from . import signals
@@ -0,0 +1,11 @@
+from __future__ import unicode_literals
+
+from django.utils.functional import SimpleLazyObject
+
+from .models import get_election_settings
+
+# Makes the current ElectionSettings available to every template as
+# election_settings, e.g. {% if election_settings.voting_open %}.
+# Only read from the cache if a template uses it.
+def election_settings(request):
+  return {'election_settings': SimpleLazyObject(get_election_settings)}
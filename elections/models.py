@@ -3,8 +3,10 @@ from django.utils.encoding import python_2_unicode_compatible, smart_str
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext as _
 
+from django.core.cache import cache
 from django.db import models
 from general.models import Sister
+from general.roster import PRESENT_STATUSES, get_active_roster
 from django.forms import ModelForm
 
 # Describes which part of the elections process is open.
@@ -121,8 +123,11 @@ class LoiForm(ModelForm):
     # Only allow positions for the correct type of election
     self.fields['office'].queryset = Office.objects.filter(is_exec=exec_election)
 
-    # Only allow active sisters / new members to submit LOIs
-    self.fields['sisters'].queryset = Sister.objects.filter(status__in=[Sister.NEW_MEMBER, Sister.ACTIVE])
+    # Only allow active sisters / new members to submit LOIs.
+    # The options come from the active roster, so showing the form
+    # doesn't query every sister.
+    self.fields['sisters'].queryset = Sister.objects.filter(status__in=PRESENT_STATUSES)
+    self.fields['sisters'].choices = get_active_roster().get_choices(PRESENT_STATUSES)
 
   class Meta:
     model = Loi
@@ -234,10 +239,29 @@ class VotingSetting(models.Model):
 ##########################
 
 
+# Every elections view checks the settings, so they're kept in Django's
+# cache and cleared by the receivers in signals.py whenever they're saved.
+# With the default per-process cache (see CACHES in settings.py), other
+# processes see a change once ELECTION_SETTINGS_CACHE_TIMEOUT runs out.
+# The settings decide whether submissions are open, so it's kept short.
+ELECTION_SETTINGS_CACHE_KEY = 'elections:settings'
+# Seconds
+ELECTION_SETTINGS_CACHE_TIMEOUT = 5
+
 # Returns the current election settings.
 def get_election_settings():
-  # There should always be exactly one ElectionSettings instance.
-  return ElectionSettings.objects.all().first()
+  election_settings = cache.get(ELECTION_SETTINGS_CACHE_KEY)
+  if election_settings is None:
+    # There should always be exactly one ElectionSettings instance.
+    election_settings = ElectionSettings.objects.all().first()
+    if election_settings is not None:
+      cache.set(ELECTION_SETTINGS_CACHE_KEY, election_settings, ELECTION_SETTINGS_CACHE_TIMEOUT)
+  return election_settings
+
+# Forgets the cached election settings, so the next read gets them
+# from the database.
+def clear_election_settings_cache():
+  cache.delete(ELECTION_SETTINGS_CACHE_KEY)
 
 
 # Returns true if the sister is eligible to run / vote
@@ -247,13 +271,14 @@ def is_eligible(sister, office):
     return True
   else:
     # TODO: Better way to do this?
+    senior_class_year = get_election_settings().senior_class_year
     if office.eligible_class == Office.FRESHMAN:
-      class_year = get_election_settings().senior_class_year + 3
+      class_year = senior_class_year + 3
     elif office.eligible_class == Office.SOPHOMORE:
-      class_year = get_election_settings().senior_class_year + 2
+      class_year = senior_class_year + 2
     elif office.eligible_class == Office.JUNIOR:
-      class_year = get_election_settings().senior_class_year + 1
+      class_year = senior_class_year + 1
     else: # office.eligible_class == Office.SENIOR:
-      class_year = get_election_settings().senior_class_year
+      class_year = senior_class_year
 
     return sister.class_year == class_year
@@ -0,0 +1,13 @@
+from __future__ import unicode_literals
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ElectionSettings, clear_election_settings_cache
+
+# The election settings are cached (see get_election_settings), so they
+# have to be cleared whenever they're changed.
+@receiver(post_save, sender=ElectionSettings)
+@receiver(post_delete, sender=ElectionSettings)
+def clear_election_settings(sender, **kwargs):
+  clear_election_settings_cache()
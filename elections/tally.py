@@ -0,0 +1,102 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from itertools import groupby
+
+from django.db.models import Count
+
+from .models import FinalVote, Loi, Office, Slate
+
+# Vote counting for slating and final votes.
+# Each tally counts votes for every office of an election at once with a
+# grouped query, so the number of queries doesn't depend on how many
+# offices, candidates or voters there are.
+
+# The results for one office.
+# results: list of (candidate, num_votes), most votes first. Candidates
+#   with the same number of votes keep the order they were given in.
+# tie_groups: list of (num_votes, candidates), most votes first, where
+#   candidates is the list of every candidate with that many votes.
+class OfficeTally(object):
+  def __init__(self, office, vote_counts):
+    self.office = office
+    self.results = sorted(vote_counts, key=lambda result: -result[1])
+    self.tie_groups = [
+      (num_votes, [candidate for candidate, votes in results])
+      for num_votes, results in groupby(self.results, key=lambda result: result[1])
+    ]
+
+  # Returns the first n candidates, most votes first.
+  def get_top(self, n):
+    return [candidate for candidate, num_votes in self.results[:n]]
+
+  # Returns true if the nth and (n+1)th candidates have the same number
+  # of votes, i.e. get_top(n) had to pick between tied candidates.
+  def is_tied_at(self, n):
+    if len(self.results) <= n or n == 0:
+      return False
+    return self.results[n - 1][1] == self.results[n][1]
+
+# Returns the offices for the given type of election, each with its LOIs
+# (with their sisters prefetched) in lois_by_office, a dict mapping office
+# id to a list of LOIs.
+def get_offices_and_lois(exec_election):
+  offices = list(Office.objects.filter(is_exec=exec_election).order_by('id'))
+  lois_by_office = defaultdict(list)
+  for loi in Loi.objects \
+      .filter(office__in=offices) \
+      .order_by('id') \
+      .prefetch_related('sisters'):
+    lois_by_office[loi.office_id].append(loi)
+  return offices, lois_by_office
+
+# Returns a list of OfficeTallies with the slating results for every office
+# in the given type of election, in office order. Each candidate is an LOI
+# and gets a vote for each slate that has it as vote_1 or vote_2.
+def get_slating_tallies(exec_election):
+  offices, lois_by_office = get_offices_and_lois(exec_election)
+
+  # One row per distinct (first choice, second choice) pair
+  vote_counts = defaultdict(int)
+  for vote_1_id, vote_2_id, num_slates in Slate.objects \
+      .filter(office__in=offices) \
+      .values_list('vote_1_id', 'vote_2_id') \
+      .annotate(num_slates=Count('id')) \
+      .order_by():
+    if vote_1_id is not None:
+      vote_counts[vote_1_id] += num_slates
+    if vote_2_id is not None:
+      vote_counts[vote_2_id] += num_slates
+
+  return [
+    OfficeTally(office, [(loi, vote_counts[loi.id]) for loi in lois_by_office[office.id]])
+    for office in offices
+  ]
+
+# Returns a list of OfficeTallies with the final vote results for every
+# office in the given type of election, in office order. Each candidate is
+# the names on an LOI, "Abstain" or "I don't know".
+def get_voting_tallies(exec_election):
+  offices, lois_by_office = get_offices_and_lois(exec_election)
+
+  # One row per office and choice, keyed by (office id, vote type, LOI id)
+  vote_counts = defaultdict(int)
+  for office_id, vote_type, vote_id, num_votes in FinalVote.objects \
+      .filter(office__in=offices) \
+      .values_list('office_id', 'vote_type', 'vote_id') \
+      .annotate(num_votes=Count('id')) \
+      .order_by():
+    if vote_type != FinalVote.PERSON:
+      vote_id = None
+    vote_counts[(office_id, vote_type, vote_id)] += num_votes
+
+  tallies = []
+  for office in offices:
+    results = [
+      (loi.names_of_sisters(), vote_counts[(office.id, FinalVote.PERSON, loi.id)])
+      for loi in lois_by_office[office.id]
+    ]
+    results.append(("Abstain", vote_counts[(office.id, FinalVote.ABSTAIN, None)]))
+    results.append(("I don't know", vote_counts[(office.id, FinalVote.I_DONT_KNOW, None)]))
+    tallies.append(OfficeTally(office, results))
+  return tallies
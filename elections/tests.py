@@ -1,3 +1,361 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+from .context_processors import election_settings
+from .models import ElectionSettings, FinalVote, FinalVoteParticipant, Loi, Office, OfficeInterest, Slate, VotingSetting, get_election_settings
+from .tally import OfficeTally, get_slating_tallies, get_voting_tallies
+from . import views
+from general.models import Sister
+
+##########################
+##### HELPER METHODS #####
+##########################
+
+# Creates and returns an active sister with the given username and class year.
+def create_sister(username, class_year=2018):
+  user = User.objects.create_user(username=username, password='aoisdj', first_name=username)
+  return Sister.objects.create(user=user, status=Sister.ACTIVE, class_year=class_year)
+
+# Creates and returns an LOI for the office from the given sisters.
+def create_loi(office, *sisters):
+  loi = Loi.objects.create(office=office, loi_text='LOI')
+  loi.sisters.add(*sisters)
+  return loi
+
+# Creates the election settings for an exec election with
+# everything open, and returns them.
+def create_election_settings():
+  return ElectionSettings.objects.create(exec_election=True, ois_open=True,
+    slating_open=True, voting_open=True, senior_class_year=2018)
+
+###################################
+##### ELECTION SETTINGS TESTS #####
+###################################
+class ElectionSettingsTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.settings = ElectionSettings.objects.create(voting_open=True)
+
+  def test_settings_are_cached(self):
+    get_election_settings()
+
+    with self.assertNumQueries(0):
+      self.assertTrue(get_election_settings().voting_open)
+
+  def test_saving_settings_clears_cache(self):
+    get_election_settings()
+
+    self.settings.voting_open = False
+    self.settings.save()
+
+    with self.assertNumQueries(1):
+      self.assertFalse(get_election_settings().voting_open)
+
+  def test_deleting_settings_clears_cache(self):
+    get_election_settings()
+
+    self.settings.delete()
+
+    self.assertIsNone(get_election_settings())
+
+  def test_context_processor(self):
+    get_election_settings()
+    request = RequestFactory().get('/')
+
+    with self.assertNumQueries(0):
+      context = election_settings(request)
+      self.assertTrue(context['election_settings'].voting_open)
+
+##############################
+##### OFFICE TALLY TESTS #####
+##############################
+class OfficeTallyTests(TestCase):
+  def test_results_are_sorted_by_votes_keeping_ties_in_order(self):
+    tally = OfficeTally(None, [('a', 1), ('b', 3), ('c', 1), ('d', 3), ('e', 0)])
+
+    self.assertEqual(tally.results, [('b', 3), ('d', 3), ('a', 1), ('c', 1), ('e', 0)])
+    self.assertEqual(tally.tie_groups, [(3, ['b', 'd']), (1, ['a', 'c']), (0, ['e'])])
+    self.assertEqual(tally.get_top(2), ['b', 'd'])
+
+  def test_is_tied_at(self):
+    tally = OfficeTally(None, [('a', 3), ('b', 2), ('c', 2)])
+
+    self.assertFalse(tally.is_tied_at(0))
+    self.assertFalse(tally.is_tied_at(1))
+    self.assertTrue(tally.is_tied_at(2))
+    self.assertFalse(tally.is_tied_at(3))
+    self.assertFalse(OfficeTally(None, []).is_tied_at(2))
+
+#########################
+##### SLATING TESTS #####
+#########################
+class SlatingTallyTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    create_election_settings()
+    self.sisters = [create_sister('sister' + str(i)) for i in range(4)]
+    self.president = Office.objects.create(title='President', is_exec=True)
+    self.treasurer = Office.objects.create(title='Treasurer', is_exec=True)
+    self.nonexec = Office.objects.create(title='Social', is_exec=False)
+    self.a = create_loi(self.president, self.sisters[0])
+    self.b = create_loi(self.president, self.sisters[1])
+    self.c = create_loi(self.president, self.sisters[2])
+    self.d = create_loi(self.treasurer, self.sisters[3])
+    create_loi(self.nonexec, self.sisters[0])
+
+  def slate(self, sister, office, vote_1, vote_2=None):
+    Slate.objects.create(sister=sister, office=office, vote_1=vote_1, vote_2=vote_2)
+
+  def test_slating_tallies(self):
+    self.slate(self.sisters[0], self.president, self.b, self.c)
+    self.slate(self.sisters[1], self.president, self.b, self.c)
+    self.slate(self.sisters[2], self.president, self.a)
+    self.slate(self.sisters[3], self.president, self.c, self.a)
+    self.slate(self.sisters[0], self.treasurer, self.d)
+
+    tallies = get_slating_tallies(True)
+
+    self.assertEqual([tally.office for tally in tallies], [self.president, self.treasurer])
+    self.assertEqual(tallies[0].results, [(self.c, 3), (self.a, 2), (self.b, 2)])
+    self.assertEqual(tallies[0].tie_groups, [(3, [self.c]), (2, [self.a, self.b])])
+    self.assertTrue(tallies[0].is_tied_at(2))
+    self.assertEqual(tallies[1].results, [(self.d, 1)])
+
+  def test_slate_with_the_same_loi_twice_counts_both_votes(self):
+    self.slate(self.sisters[0], self.president, self.a, self.a)
+    self.slate(self.sisters[1], self.president, self.b)
+
+    tallies = get_slating_tallies(True)
+
+    self.assertEqual(tallies[0].results, [(self.a, 2), (self.b, 1), (self.c, 0)])
+
+  def test_query_count_does_not_depend_on_size(self):
+    self.slate(self.sisters[0], self.president, self.a, self.b)
+    with self.assertNumQueries(4):
+      get_slating_tallies(True)
+
+    for i in range(10):
+      sister = create_sister('more' + str(i))
+      loi = create_loi(self.president, sister)
+      self.slate(sister, self.president, loi, self.c)
+      self.slate(sister, self.treasurer, self.d)
+    with self.assertNumQueries(4):
+      tallies = get_slating_tallies(True)
+    self.assertEqual(tallies[0].results[0], (self.c, 10))
+
+  def test_voting_candidates_fall_back_to_top_two(self):
+    self.slate(self.sisters[0], self.president, self.b, self.c)
+    self.slate(self.sisters[1], self.president, self.c)
+    self.slate(self.sisters[0], self.treasurer, self.d)
+    VotingSetting.objects.create(office=self.treasurer, candidate_1=None, candidate_2=None)
+
+    candidates = views.get_voting_candidates(get_slating_tallies(True))
+
+    self.assertEqual(list(candidates.items()), [
+      (self.president, [self.c, self.b]),
+      (self.treasurer, []),
+    ])
+
+  def test_voting_candidates_use_voting_settings(self):
+    VotingSetting.objects.create(office=self.president, candidate_1=self.a, candidate_2=self.c)
+
+    candidates = views.get_voting_candidates(get_slating_tallies(True))
+
+    self.assertEqual(candidates[self.president], [self.a, self.c])
+    self.assertEqual(candidates[self.treasurer], [self.d])
+
+  def test_voting_settings_warns_about_ties_only_without_a_setting(self):
+    User.objects.create_superuser(username='admin', password='aoisdj', email='admin@example.com')
+    self.client.login(username='admin', password='aoisdj')
+    self.slate(self.sisters[0], self.president, self.a, self.b)
+    self.slate(self.sisters[1], self.president, self.c)
+    url = reverse('elections:voting_settings')
+
+    response = self.client.get(url)
+    self.assertTrue(response.context['slating_results'][0].has_top_two_tie)
+
+    VotingSetting.objects.create(office=self.president, candidate_1=self.a, candidate_2=self.c)
+    response = self.client.get(url)
+    self.assertFalse(response.context['slating_results'][0].has_top_two_tie)
+
+########################
+##### VOTING TESTS #####
+########################
+class VotingTallyTests(TestCase):
+  def setUp(self):
+    self.sisters = [create_sister('sister' + str(i)) for i in range(3)]
+    self.president = Office.objects.create(title='President', is_exec=True)
+    self.treasurer = Office.objects.create(title='Treasurer', is_exec=True)
+    self.a = create_loi(self.president, self.sisters[0])
+    self.b = create_loi(self.president, self.sisters[1], self.sisters[2])
+
+  def vote(self, office, vote_type, loi=None, count=1):
+    for i in range(count):
+      FinalVote.objects.create(office=office, vote_type=vote_type, vote=loi)
+
+  def test_voting_tallies(self):
+    self.vote(self.president, FinalVote.PERSON, self.b, count=3)
+    self.vote(self.president, FinalVote.PERSON, self.a)
+    self.vote(self.president, FinalVote.ABSTAIN, count=2)
+    # Only person votes count for the LOI they point to
+    self.vote(self.president, FinalVote.I_DONT_KNOW, self.a)
+    self.vote(self.treasurer, FinalVote.ABSTAIN)
+
+    tallies = get_voting_tallies(True)
+
+    self.assertEqual([tally.office for tally in tallies], [self.president, self.treasurer])
+    self.assertEqual(tallies[0].results, [
+      (self.b.names_of_sisters(), 3),
+      ("Abstain", 2),
+      (self.a.names_of_sisters(), 1),
+      ("I don't know", 1),
+    ])
+    self.assertEqual(tallies[1].results, [("Abstain", 1), ("I don't know", 0)])
+
+  def test_query_count_does_not_depend_on_size(self):
+    self.vote(self.president, FinalVote.PERSON, self.a)
+    with self.assertNumQueries(4):
+      get_voting_tallies(True)
+
+    for i in range(10):
+      loi = create_loi(self.treasurer, create_sister('more' + str(i)))
+      self.vote(self.treasurer, FinalVote.PERSON, loi, count=i)
+      self.vote(self.president, FinalVote.PERSON, self.b)
+    with self.assertNumQueries(4):
+      tallies = get_voting_tallies(True)
+    self.assertEqual(tallies[0].results[0], (self.b.names_of_sisters(), 10))
+
+###################################
+##### VOTING SUBMISSION TESTS #####
+###################################
+class VotingSubmissionTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    create_election_settings()
+    self.sister = create_sister('reb')
+    self.client.login(username='reb', password='aoisdj')
+    self.president = Office.objects.create(title='President', is_exec=True)
+    self.social = Office.objects.create(title='Social', is_exec=False)
+    self.loi = create_loi(self.president, create_sister('candidate'))
+    self.url = reverse('elections:voting_submission')
+
+  def test_has_slated_and_has_voted(self):
+    Slate.objects.create(sister=self.sister, office=self.social)
+
+    with self.assertNumQueries(1):
+      self.assertFalse(views.has_slated(self.sister, True))
+    self.assertTrue(views.has_slated(self.sister, False))
+    with self.assertNumQueries(1):
+      self.assertFalse(views.has_voted(self.sister))
+    FinalVoteParticipant.objects.create(sister=self.sister)
+    self.assertTrue(views.has_voted(self.sister))
+
+  def test_sister_who_did_not_slate_cannot_vote(self):
+    # Slating for another type of election doesn't count
+    Slate.objects.create(sister=self.sister, office=self.social)
+
+    response = self.client.post(self.url, {str(self.president.id): str(self.loi.id)})
+
+    self.assertTrue(response.context['no_slate'])
+    self.assertFalse(FinalVote.objects.exists())
+    self.assertEqual(sorted(sister.id for sister in views.get_sisters_no_slate()),
+      sorted([self.sister.id, self.loi.sisters.get().id]))
+
+  def test_sister_who_slated_votes_once(self):
+    Slate.objects.create(sister=self.sister, office=self.president, vote_1=self.loi)
+
+    response = self.client.get(self.url)
+    self.assertEqual(response.context['voting_candidates'][self.president], [self.loi])
+
+    response = self.client.post(self.url, {str(self.president.id): str(self.loi.id)})
+    self.assertTrue(response.context['has_voted'])
+    response = self.client.post(self.url, {str(self.president.id): 'Abstain'})
+    self.assertTrue(response.context['has_voted'])
+
+    self.assertEqual(list(FinalVote.objects.values_list('vote_type', 'vote_id')),
+      [(FinalVote.PERSON, self.loi.id)])
+    self.assertEqual(FinalVoteParticipant.objects.filter(sister=self.sister).count(), 1)
+
+################################
+##### OIS SUBMISSION TESTS #####
+################################
+class OisSubmissionTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    create_election_settings()
+    # 2018 is the senior class
+    self.sister = create_sister('reb', 2018)
+    self.client.login(username='reb', password='aoisdj')
+    self.president = Office.objects.create(title='President', is_exec=True)
+    self.vp = Office.objects.create(title='VP', is_exec=True)
+    self.treasurer = Office.objects.create(title='Treasurer', is_exec=True)
+    self.junior_rep = Office.objects.create(title='Junior Rep', is_exec=True, eligible_class=Office.JUNIOR)
+    self.url = reverse('elections:ois_submission')
+
+  def get_interests(self):
+    return dict(OfficeInterest.objects
+      .filter(sister=self.sister)
+      .values_list('office_id', 'interest'))
+
+  def test_get_makes_no_writes(self):
+    OfficeInterest.objects.create(sister=self.sister, office=self.president, interest=OfficeInterest.NO)
+    # The settings and the session's sister are cached after the first request
+    self.client.get(self.url)
+
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.get(self.url)
+
+    self.assertEqual([query['sql'] for query in queries
+      if not query['sql'].startswith('SELECT')], [])
+    self.assertEqual(response.context['empty_offices'], [self.vp, self.treasurer])
+    self.assertEqual(response.context['num_eligible_offices'], 3)
+    self.assertEqual(self.get_interests(), {self.president.id: OfficeInterest.NO})
+
+    for i in range(5):
+      Office.objects.create(title='Office' + str(i), is_exec=True)
+    with CaptureQueriesContext(connection) as more_queries:
+      self.client.get(self.url)
+    self.assertEqual(len(more_queries), len(queries))
+
+  def test_post_upserts_interests_and_redirects(self):
+    OfficeInterest.objects.create(sister=self.sister, office=self.president, interest=OfficeInterest.NO)
+    OfficeInterest.objects.create(sister=self.sister, office=self.vp, interest=OfficeInterest.MAYBE)
+
+    response = self.client.post(self.url, {
+      str(self.president.id): str(OfficeInterest.YES),
+      str(self.vp.id): '7',
+      str(self.treasurer.id): str(OfficeInterest.MAYBE),
+      # Not eligible, so ignored
+      str(self.junior_rep.id): str(OfficeInterest.YES),
+    })
+
+    self.assertRedirects(response, self.url + '?submitted=True')
+    self.assertEqual(self.get_interests(), {
+      self.president.id: OfficeInterest.YES,
+      self.vp.id: OfficeInterest.MAYBE,
+      self.treasurer.id: OfficeInterest.MAYBE,
+    })
+
+  def test_post_ignores_invalid_levels(self):
+    response = self.client.post(self.url, {
+      str(self.president.id): 'yes',
+      str(self.vp.id): '',
+    })
+
+    self.assertRedirects(response, self.url + '?submitted=True')
+    self.assertEqual(self.get_interests(), {})
+
+  def test_user_without_sister_cannot_submit(self):
+    User.objects.create_user(username='guest', password='aoisdj')
+    self.client.login(username='guest', password='aoisdj')
+
+    response = self.client.get(self.url)
+    self.assertEqual(response.context['num_eligible_offices'], 0)
+
+    response = self.client.post(self.url, {str(self.president.id): str(OfficeInterest.YES)})
+    self.assertEqual(response.status_code, 403)
+    self.assertFalse(OfficeInterest.objects.exists())
@@ -1,10 +1,17 @@
+from collections import OrderedDict
+
 from django.shortcuts import render
+from django.http import HttpResponseForbidden, HttpResponseRedirect
+from django.urls import reverse
+from django.db import IntegrityError, transaction
 from django.conf import settings
 from general.views import get_sister
 from django.contrib.auth.decorators import login_required, user_passes_test
 
+from .tally import get_slating_tallies, get_voting_tallies
 from .models import ElectionSettings, Office, OfficeInterest, Loi, LoiForm, Slate, FinalVote, FinalVoteParticipant, VotingSetting, is_eligible, get_election_settings
 from general.models import Sister
+from general.roster import PRESENT_STATUSES, get_active_roster
 
 # TODO: Automatically stop someone from slating/voting
 # if they haven't done OIS, slated, etc.
@@ -31,86 +38,113 @@ def is_exec_election():
 # submit an OIS for, and is augmented with the 'is_eligible' field
 # which specifies whether the sister is eligible to run for that
 # position.
-def get_ois_empty_offices(sister, all_offices):
-  empty_offices = []
-  for office in all_offices:
-    # If they're not eligible for the office, move on
-    if not office.is_eligible:
-      continue
-
-    # See if they've already submitted for this position
+# interests: dict mapping office id to the interest the sister
+# already submitted for it (see get_ois_interests).
+def get_ois_empty_offices(all_offices, interests):
+  return [office for office in all_offices
+    if office.is_eligible and office.id not in interests]
+
+# Returns a dict mapping office id to the sister's OfficeInterest
+# for each of the offices she's submitted one for.
+def get_ois_interests(sister, offices):
+  return dict(
+    (office_interest.office_id, office_interest) for office_interest in
+    OfficeInterest.objects.filter(sister=sister, office__in=offices))
+
+# Saves the sister's interest levels, given as a dict mapping office id
+# to interest, updating the ones she already submitted.
+# Runs a fixed number of queries, however many offices there are.
+def save_ois_interests(sister, offices, new_interests):
+  with transaction.atomic():
+    interests = get_ois_interests(sister, offices)
+    new_office_interests = []
+    # Maps each interest level to the ids of the rows that should have it
+    updates = {}
+    for office_id, interest in new_interests.items():
+      office_interest = interests.get(office_id)
+      if office_interest is None:
+        new_office_interests.append(
+          OfficeInterest(sister=sister, office_id=office_id, interest=interest))
+      elif office_interest.interest != interest:
+        updates.setdefault(interest, []).append(office_interest.id)
+
+    for interest, office_interest_ids in updates.items():
+      OfficeInterest.objects.filter(id__in=office_interest_ids).update(interest=interest)
     try:
-      office_interest = OfficeInterest.objects.get(sister=sister, office=office)
-    except:
-      # If not, add it to the list
-      empty_offices.append(office)
-
-  return empty_offices
+      with transaction.atomic():
+        OfficeInterest.objects.bulk_create(new_office_interests)
+    except IntegrityError:
+      # The same sister submitted twice at once and the other request
+      # created some of these first, so save them one at a time
+      for office_interest in new_office_interests:
+        OfficeInterest.objects.update_or_create(
+          sister=sister, office_id=office_interest.office_id,
+          defaults={'interest': office_interest.interest})
 
 # Slating results are used on both the slating results page
 # and the voting settings page;)
+# Returns a list of tally.OfficeTally, one per office in the current
+# election, with candidates sorted by number of votes, highest first.
 def get_slating_results():
-  slating_results = {}
-
-  # Calcuate number of votes for each candidate for each office
-  offices = Office.objects.filter(is_exec=is_exec_election())
-  for office in offices:
-    vote_counts = get_slate_votes(office)
-    slating_results[office] = vote_counts
-
-  return slating_results
-
-# Gets the number of votes during slating for
-# each candidate for this office.
-# Results are returned sorted by number of votes, highest first.
-def get_slate_votes(office):
-  # All candidates running for that office
-  lois_for_office = Loi.objects.filter(office=office)
-
-  # Stores how many votes each candidate received
-  vote_counts = {}
-  for loi in lois_for_office:
-    vote_counts[loi] = 0
+  return get_slating_tallies(is_exec_election())
 
-  # Calculate the vote counts
-  slates_for_office = Slate.objects.filter(office=office)
-  for slate in slates_for_office:
-    if slate.vote_1:
-      vote_counts[slate.vote_1] += 1
-    if slate.vote_2:
-      vote_counts[slate.vote_2] += 1
-
-  # Sort by number of votes, highest first
-  # TODO
-
-  return vote_counts
-
-# Get a list of sisters who didn't slate
+# Get a list of present sisters who didn't slate in the current election,
+# ordered by name, with one query.
 def get_sisters_no_slate():
-  sister_who_slated = []
-  for slate in Slate.objects.filter(office__is_exec=is_exec_election()):
-    # This sister did cast a slate
-    sister_who_slated.append(slate.sister)
+  # These sisters did cast a slate
+  sister_ids_who_slated = Slate.objects \
+    .filter(office__is_exec=is_exec_election()) \
+    .values('sister_id')
+
+  return Sister.objects \
+    .filter(status__in=PRESENT_STATUSES) \
+    .exclude(id__in=sister_ids_who_slated)
 
-  sisters_no_slate = Sister.objects \
-    .exclude(id__in=[s.id for s in sister_who_slated]) \
-    .exclude(status=Sister.ALUM) \
-    .exclude(status=Sister.ABROAD) \
-    .exclude(status=Sister.DEAFFILIATED)
+# Returns true if the sister cast a slate for the given type of election.
+def has_slated(sister, exec_election):
+  return Slate.objects.filter(sister=sister, office__is_exec=exec_election).exists()
 
-  return sisters_no_slate
+# Returns true if the sister already submitted her final votes.
+def has_voted(sister):
+  return FinalVoteParticipant.objects.filter(sister=sister).exists()
 
 # Get the candidates with the most number of votes
-# during slating for this office.
+# during slating for the office, given its tally.OfficeTally.
 # Will return a list of size 0, 1, or 2.
-# TODO: What if there's a tie?
-def get_top_two_from_slate(office):
-  vote_counts = get_slate_votes(office)
-  sorted_votes = sorted(vote_counts, key=vote_counts.get, reverse=True)
-  if len(sorted_votes) > 2:
-    return sorted_votes[0:2]
-  else:
-    return sorted_votes
+# Ties are broken by LOI order; use tally.is_tied_at(2) to check for one.
+def get_top_two_from_slate(tally):
+  return tally.get_top(2)
+
+# Returns a dict mapping office id to (candidate_1_id, candidate_2_id)
+# for the offices in slating_tallies that have a voting setting.
+def get_voting_settings(slating_tallies):
+  return dict(
+    (office_id, (candidate_1_id, candidate_2_id))
+    for office_id, candidate_1_id, candidate_2_id in VotingSetting.objects
+      .filter(office__in=[tally.office for tally in slating_tallies])
+      .values_list('office_id', 'candidate_1_id', 'candidate_2_id'))
+
+# Returns a dict mapping each office to its candidates for the final vote,
+# in the same order as slating_tallies (from get_slating_results).
+# The candidates are the ones chosen on the voting settings page, or the
+# top two from slating if none were chosen for that office.
+# Pass voting_settings (from get_voting_settings) if it's already loaded.
+def get_voting_candidates(slating_tallies, voting_settings=None):
+  lois = dict(
+    (loi.id, loi) for tally in slating_tallies for loi, num_votes in tally.results)
+  if voting_settings is None:
+    voting_settings = get_voting_settings(slating_tallies)
+
+  voting_candidates = OrderedDict()
+  for tally in slating_tallies:
+    if tally.office.id in voting_settings:
+      voting_candidates[tally.office] = [
+        lois[loi_id] for loi_id in voting_settings[tally.office.id] if loi_id in lois]
+    else:
+      # There is no voting setting, so select the top two
+      # results from slating
+      voting_candidates[tally.office] = get_top_two_from_slate(tally)
+  return voting_candidates
 
 # Get a candidate based on candidate_value.
 # If candidate_value is a number, find the LOI with that ID.
@@ -156,61 +190,55 @@ def index(request):
 
 @login_required
 def ois_submission(request):
-  # TODO: Display whether they've submitted it already
-
   if not get_election_settings().ois_open:
     return render(request, 'elections/ois_submission.html', {'ois_closed': True})
 
 
-  # Used to determine if a sister has started her OIS or not
-  num_eligible_offices = 0;
-
-  # Determine whether sister is eligible to run for each office
-  offices = Office.objects.filter(is_exec=is_exec_election())
+  # Determine whether sister is eligible to run for each office.
+  # is_eligible is only set for displaying; nothing is saved.
+  # Users who aren't sisters can't run for anything.
+  offices = list(Office.objects.filter(is_exec=is_exec_election()))
   sister = get_sister(request)
   for office in offices:
-    office.is_eligible = is_eligible(sister, office)
-    office.save()
-    if is_eligible(sister, office):
-      num_eligible_offices += 1
-
-  # Set what should be displayed on the page  
-  context = {
-    'offices': offices,
-    'num_eligible_offices': num_eligible_offices, 
-    'exec_election': is_exec_election(),
-    'empty_offices': get_ois_empty_offices(sister, offices)
-  }
+    office.is_eligible = sister is not None and is_eligible(sister, office)
 
   # If they pressed submit, store that data
   if request.method == 'POST':
-
+    if sister is None:
+      return HttpResponseForbidden('Only sisters can submit an OIS.')
+    valid_interests = set(interest for interest, name in OfficeInterest.INTEREST_LEVELS)
+    new_interests = {}
     for office in offices:
       # If they're not eligible for the office, move on
       if not office.is_eligible:
         continue
-
-      # See if they've already submitted for this position
-      try:
-        office_interest = OfficeInterest.objects.get(sister=sister, office=office)
-      except:
-        # If not, make a new instance
-        office_interest = OfficeInterest(sister=sister, office=office)
-      
-      # Save the level of interest given
+      # Save the level of interest given, if there is one
       try:
         interest = int(request.POST[str(office.id)])
-        office_interest.interest = interest
-        office_interest.save()
-      except:
-        pass
+      except (KeyError, ValueError):
+        continue
+      if interest in valid_interests:
+        new_interests[office.id] = interest
+    save_ois_interests(sister, offices, new_interests)
+
+    # They've submitted it. Redirect so that refreshing
+    # the page doesn't submit it again.
+    return HttpResponseRedirect(reverse('elections:ois_submission') + '?submitted=True')
+
+  # Show the interest they already submitted for each office
+  interests = get_ois_interests(sister, offices)
+  for office in offices:
+    if office.id in interests:
+      office.interest = interests[office.id].interest
 
-    # If got through the whole for loop, they've submitted it
-    context['submitted'] = True
-    # Reset what 'empty_offices' is because it's likely changed
-    context['empty_offices'] = get_ois_empty_offices(sister, offices)
-    # TODO: return HttpResponseRedirect since we successfully dealt
-    # with POST data.
+  # Set what should be displayed on the page
+  context = {
+    'offices': offices,
+    # Used to determine if a sister has started her OIS or not
+    'num_eligible_offices': sum(1 for office in offices if office.is_eligible),
+    'empty_offices': get_ois_empty_offices(offices, interests),
+    'submitted': request.GET.get('submitted', False),
+  }
 
   # TODO: Add 'I don't know' option
   # TODO: Add a 'There's only one candidate' option?
@@ -225,16 +253,8 @@ def ois_results(request):
   # Display sisters who haven't submitted OIS 
   # TODO: If they've only submitted half their OIS,
   #   are they allowed to slate/vote? 
-  sister_who_did_ois = set()
-  for ois in OfficeInterest.objects.all():
-    # This sister did cast a slate
-    sister_who_did_ois.add(ois.sister)
-
-  sisters_no_ois = Sister.objects \
-    .exclude(id__in=[s.id for s in sister_who_did_ois]) \
-    .exclude(status=Sister.ALUM) \
-    .exclude(status=Sister.ABROAD) \
-    .exclude(status=Sister.DEAFFILIATED)
+  sister_ids_who_did_ois = OfficeInterest.objects.values_list('sister_id', flat=True)
+  sisters_no_ois = get_active_roster().get_entries(PRESENT_STATUSES, exclude_ids=sister_ids_who_did_ois)
 
   context = {
     # TODO: Filter for OISes for only exec or non-exec
@@ -312,8 +332,7 @@ def slating_submission(request):
   
   # Determine if sister has already submitted her slate
   sister = get_sister(request)
-  sister_slate = Slate.objects.filter(sister=sister)
-  if sister_slate:
+  if Slate.objects.filter(sister=sister).exists():
     return render(request, 'elections/slating_submission.html', {'has_slated': True})
 
   # Submit their slate
@@ -380,12 +399,11 @@ def voting_submission(request):
 
   # Determine if sister has already submitted her votes
   sister = get_sister(request)
-  sister_vote = FinalVoteParticipant.objects.filter(sister=sister)
-  if sister_vote:
+  if has_voted(sister):
     return render(request, 'elections/voting_submission.html', {'has_voted': True})
 
   # Determine if sister is eligible to vote
-  if sister in get_sisters_no_slate():
+  if sister and sister.status in PRESENT_STATUSES and not has_slated(sister, is_exec_election()):
     # If she didn't slate, she can't vote
     return render(request, 'elections/voting_submission.html', {'no_slate': True})
  
@@ -426,66 +444,21 @@ def voting_submission(request):
   #   Have a page for CRS to select the right candidates
 
   # Get voting candidates
-  voting_candidates = {}
-
-  offices = Office.objects.filter(is_exec=is_exec_election())
-  for office in offices:
-    try:
-      voting_setting = VotingSetting.objects.get(office=office)
-      candidates = []
-      if voting_setting.candidate_1 != None:
-        candidates.append(voting_setting.candidate_1)
-      if voting_setting.candidate_2 != None:
-        candidates.append(voting_setting.candidate_2)
-      voting_candidates[office] = candidates
-      
-    except:
-      # There is no voting setting, so select the top two
-      # results from slating
-      candidates = get_top_two_from_slate(office)
-      voting_candidates[office] = candidates
+  voting_candidates = get_voting_candidates(get_slating_results())
 
   return render(request, 'elections/voting_submission.html', {'voting_candidates': voting_candidates})
 
 
 @user_passes_test(lambda u: u.is_superuser)
 def voting_results(request):
-  # Calculate number of votes for each office
-  voting_results = {}
-
-  offices = Office.objects.filter(is_exec=is_exec_election())
-
-  for office in offices:
-    # All candidates running for that office
-    lois_for_office = Loi.objects.filter(office=office)
-
-    # Stores how many votes each candidate received
-    vote_counts = {}
-    for loi in lois_for_office:
-      vote_counts[loi.names_of_sisters()] = 0
-
-    # Add the Abstain and I don't know options
-    vote_counts["Abstain"] = 0
-    vote_counts["I don't know"] = 0
-
-    # Calculate the vote counts
-    final_votes_for_office = FinalVote.objects.filter(office=office)
-    for final_vote in final_votes_for_office:
-      if final_vote.vote_type == FinalVote.ABSTAIN:
-        vote_counts["Abstain"] += 1
-      elif final_vote.vote_type == FinalVote.I_DONT_KNOW:
-        vote_counts["I don't know"] += 1
-      else:
-        vote_counts[final_vote.vote.names_of_sisters()] += 1
-
-    # Save all the votes associated with this office
-    voting_results[office] = vote_counts
-
+  # Number of votes for each choice for each office,
+  # sorted by number of votes, highest first
+  voting_results = get_voting_tallies(is_exec_election())
 
   # TODO: Display total percent of chapter that voted
   context = {
     'voting_results': voting_results,
-    'sisters_who_voted': FinalVoteParticipant.objects.all()
+    'sisters_who_voted': FinalVoteParticipant.objects.select_related('sister'),
   }
 
   return render(request, 'elections/voting_results.html', context)
@@ -532,27 +505,20 @@ def voting_settings(request):
   # So that we can show those as default checkmarks
 
   slating_results = get_slating_results()
-  for office, results in slating_results.items():
-    try:
-      voting_setting = VotingSetting.objects.get(office=office)
-      selected_candidates = [voting_setting.candidate_1, voting_setting.candidate_2]
-      
-    except:
-      # There is no voting setting, so select the top two
-      # results from slating
-      selected_candidates = get_top_two_from_slate(office)
-
-    for loi, num_votes in results.items():
-      if loi in selected_candidates:
-        loi.is_candidate = True
-        loi.save()
+  voting_settings = get_voting_settings(slating_results)
+  voting_candidates = get_voting_candidates(slating_results, voting_settings)
+  for tally in slating_results:
+    # Warn when the top two from slating had to break a tie, unless
+    # the candidates were already chosen here
+    tally.has_top_two_tie = \
+      tally.office.id not in voting_settings and tally.is_tied_at(2)
+    selected_candidates = voting_candidates[tally.office]
+    for loi, num_votes in tally.results:
+      loi.is_candidate = loi in selected_candidates
 
   context = {
     'slating_results': slating_results,
-    'sisters': Sister.objects \
-      .exclude(status=Sister.ALUM) \
-      .exclude(status=Sister.ABROAD) \
-      .exclude(status=Sister.DEAFFILIATED)
+    'sisters': get_active_roster().get_entries(PRESENT_STATUSES),
   }
 
   return render(request, 'elections/voting_settings.html', context)
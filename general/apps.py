@@ -5,3 +5,7 @@ from django.apps import AppConfig
 
 class GeneralConfig(AppConfig):
     name = 'general'
+
+    def ready(self):
+        # Connects the signal receivers
+        from . import signals
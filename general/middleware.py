@@ -0,0 +1,51 @@
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from .models import Sister
+
+# Seconds that a logged in user's sister stays in the cache, so that
+# repeat page views in the same session don't have to look her up.
+SISTER_CACHE_TIMEOUT = 60
+
+# Attaches request.sister: the Sister of the logged in user (with her
+# User already loaded), or None. She's only looked up the first time
+# request.sister is used, and at most once per request.
+# Needs to come after AuthenticationMiddleware.
+class SisterMiddleware(object):
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    request.sister = SimpleLazyObject(lambda: get_request_sister(request))
+    return self.get_response(request)
+
+# Returns the Sister of the logged in user, or None if nobody is logged
+# in or the user isn't a sister. Memoized on the request.
+def get_request_sister(request):
+  if not hasattr(request, '_cached_sister'):
+    request._cached_sister = _load_sister(request)
+  return request._cached_sister
+
+def _load_sister(request):
+  user = request.user
+  if not user.is_authenticated():
+    return None
+
+  session_key = request.session.session_key
+  cache_key = None
+  if session_key:
+    cache_key = 'general:sister:%d:%s' % (user.id, session_key)
+    cached = cache.get(cache_key)
+    if cached is not None:
+      # Cached as a 1-tuple, so that None (not a sister) can be cached too
+      return cached[0]
+
+  sister = Sister.objects \
+    .select_related('user') \
+    .filter(user_id=user.id) \
+    .first()
+  if cache_key:
+    cache.set(cache_key, (sister,), SISTER_CACHE_TIMEOUT)
+  return sister
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# Fills in display_name for the existing sisters.
+def fill_display_names(apps, schema_editor):
+  Sister = apps.get_model('general', 'Sister')
+  for sister in Sister.objects.select_related('user').iterator():
+    Sister.objects.filter(id=sister.id).update(
+      display_name="%s %s" % (sister.user.first_name, sister.user.last_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='sister',
+            options={'ordering': ['display_name']},
+        ),
+        migrations.AddField(
+            model_name='sister',
+            name='display_name',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.RunPython(fill_display_names, migrations.RunPython.noop),
+    ]
@@ -23,17 +23,23 @@ class Sister(models.Model):
   user = models.OneToOneField(User, on_delete=models.CASCADE)
   status = models.IntegerField(choices=STATUS)
   class_year = models.IntegerField()
+  # The user's first and last name, copied here so that showing or
+  # sorting sisters doesn't need to load their users.
+  # Kept up to date when the user is saved (see general/signals.py).
+  display_name = models.CharField(max_length=100, blank=True, db_index=True, editable=False)
 
   class Meta:
     # Order by first name then last name
-    ordering = ['user__first_name', 'user__last_name']
+    ordering = ['display_name']
 
   def __str__(self):
-    # TODO: Make first_name, last_name required for Users somehow
-    return "%s %s" % (self.user.first_name, self.user.last_name)
-
-
-
-
+    return self.display_name
 
+  def save(self, *args, **kwargs):
+    self.display_name = get_display_name(self.user)
+    super(Sister, self).save(*args, **kwargs)
 
+# Returns the name to show for a sister with the given user.
+def get_display_name(user):
+  # TODO: Make first_name, last_name required for Users somehow
+  return "%s %s" % (user.first_name, user.last_name)
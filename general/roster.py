@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+
+import time
+
+from django.core.cache import cache
+from django.utils.encoding import python_2_unicode_compatible
+
+from .models import Sister
+
+# Active roster.
+#
+# Attendance and elections both need to know who's currently in the
+# chapter, mostly to list names or check membership. Rather than each
+# view querying Sister, they read a snapshot of every current sister's
+# id, status, class year and name, kept in Django's cache.
+#
+# Each snapshot has a version, which changes whenever a Sister or User is
+# saved (see general/signals.py), so the next read builds a new snapshot.
+
+# Sisters who are still part of the chapter. Only these are in the roster.
+CURRENT_STATUSES = (Sister.ACTIVE, Sister.NEW_MEMBER, Sister.ABROAD)
+# Current sisters who are on campus, i.e. who can attend events and vote.
+PRESENT_STATUSES = (Sister.ACTIVE, Sister.NEW_MEMBER)
+
+VERSION_CACHE_KEY = 'general:active_roster:version'
+# Seconds. With the default per-process cache, other processes only see
+# a new version once their snapshot expires.
+CACHE_TIMEOUT = 60*60
+
+# One sister in the roster.
+# Prints as her name, so it can be used in templates like a Sister.
+@python_2_unicode_compatible
+class RosterEntry(object):
+  def __init__(self, id, status, class_year, display_name):
+    self.id = id
+    self.status = status
+    self.class_year = class_year
+    self.display_name = display_name
+
+  def __str__(self):
+    return self.display_name
+
+# A snapshot of the current sisters, ordered by name.
+class ActiveRoster(object):
+  def __init__(self, version, entries):
+    self.version = version
+    self.entries = entries
+
+  # Returns the RosterEntries of sisters with one of the given statuses
+  # (default: all of them), leaving out the ones in exclude_ids.
+  def get_entries(self, statuses=CURRENT_STATUSES, exclude_ids=()):
+    exclude_ids = set(exclude_ids)
+    return [entry for entry in self.entries
+      if entry.status in statuses and entry.id not in exclude_ids]
+
+  # Returns the set of ids of sisters with one of the given statuses.
+  def get_ids(self, statuses=CURRENT_STATUSES):
+    return set(entry.id for entry in self.get_entries(statuses))
+
+  # Returns (id, name) pairs for a select field.
+  def get_choices(self, statuses=CURRENT_STATUSES):
+    return [(entry.id, entry.display_name) for entry in self.get_entries(statuses)]
+
+# Returns the current ActiveRoster, building it if it's not cached.
+def get_active_roster():
+  version = cache.get(VERSION_CACHE_KEY)
+  if version is None:
+    version = invalidate_active_roster()
+  cache_key = 'general:active_roster:%s' % version
+  roster = cache.get(cache_key)
+  if roster is None:
+    entries = [
+      RosterEntry(*fields) for fields in
+      Sister.objects
+        .filter(status__in=CURRENT_STATUSES)
+        .order_by('display_name', 'id')
+        .values_list('id', 'status', 'class_year', 'display_name')
+    ]
+    roster = ActiveRoster(version, entries)
+    cache.set(cache_key, roster, CACHE_TIMEOUT)
+  return roster
+
+# Starts a new roster version, so the next read builds a new snapshot.
+# Returns the new version.
+def invalidate_active_roster():
+  # A timestamp rather than a counter, so that a version can't be
+  # reused if the version key is evicted from the cache
+  version = '%d' % (time.time()*1000000)
+  cache.set(VERSION_CACHE_KEY, version, None)
+  return version
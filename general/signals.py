@@ -0,0 +1,31 @@
+from __future__ import unicode_literals
+
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Sister, get_display_name
+from .roster import invalidate_active_roster
+
+# Sister.display_name is a copy of the user's name, so it has to be
+# updated whenever the user's name changes. The active roster (see
+# roster.py) has the names too, so it's out of date if any changed.
+@receiver(post_save, sender=User)
+def update_sister_display_name(sender, instance, update_fields=None, **kwargs):
+  # Logging in saves just last_login, and everyone logs in at once
+  # when voting opens
+  if update_fields is not None and set(update_fields) <= set(['last_login']):
+    return
+  num_updated = Sister.objects \
+    .filter(user_id=instance.id) \
+    .exclude(display_name=get_display_name(instance)) \
+    .update(display_name=get_display_name(instance))
+  if num_updated:
+    invalidate_active_roster()
+
+# The roster also has every current sister's status and class year,
+# so it's out of date whenever a sister changes.
+@receiver(post_save, sender=Sister)
+@receiver(post_delete, sender=Sister)
+def invalidate_roster(sender, **kwargs):
+  invalidate_active_roster()
@@ -1,3 +1,145 @@
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from .middleware import SisterMiddleware, get_request_sister
+from .models import Sister
+from .roster import PRESENT_STATUSES, get_active_roster
+
+##########################
+##### HELPER METHODS #####
+##########################
+
+# Returns a request from the given user, with a session, after
+# SisterMiddleware has run.
+def create_request(user, session_key='sessionkey1'):
+  request = RequestFactory().get('/')
+  request.user = user
+  request.session = SessionStore(session_key=session_key)
+  SisterMiddleware(lambda request: None)(request)
+  return request
+
+
+############################
+##### MIDDLEWARE TESTS #####
+############################
+class SisterMiddlewareTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.user = User.objects.create_user(username='reb', password='aoisdj', first_name='Reb')
+    self.sister = Sister.objects.create(user=self.user, status=Sister.ACTIVE, class_year=2019)
+
+  def test_sister_is_loaded_with_user_once_per_request(self):
+    request = create_request(self.user)
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(request.sister.id, self.sister.id)
+      self.assertEqual(str(request.sister), 'Reb ')
+      self.assertEqual(get_request_sister(request), self.sister)
+    self.assertEqual(len(queries), 1)
+
+  def test_sister_is_cached_for_session(self):
+    get_request_sister(create_request(self.user))
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(get_request_sister(create_request(self.user)), self.sister)
+    self.assertEqual(len(queries), 0)
+
+    # A different session looks her up again
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(get_request_sister(create_request(self.user, 'sessionkey2')), self.sister)
+    self.assertEqual(len(queries), 1)
+
+  def test_no_sister(self):
+    self.assertIsNone(get_request_sister(create_request(AnonymousUser())))
+    not_sister = User.objects.create_user(username='bob', password='aoisdj')
+    self.assertIsNone(get_request_sister(create_request(not_sister)))
+    self.assertFalse(create_request(not_sister).sister)
+
+
+##############################
+##### DISPLAY NAME TESTS #####
+##############################
+class DisplayNameTests(TestCase):
+  def test_display_name_follows_user(self):
+    user = User.objects.create_user(username='reb', password='aoisdj', first_name='Reb', last_name='Lee')
+    sister = Sister.objects.create(user=user, status=Sister.ACTIVE, class_year=2019)
+    self.assertEqual(str(sister), 'Reb Lee')
+
+    user.last_name = 'Smith'
+    user.save()
+
+    sister = Sister.objects.get(id=sister.id)
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(str(sister), 'Reb Smith')
+    self.assertEqual(len(queries), 0)
+
+  def test_sisters_are_ordered_by_name_without_joining_users(self):
+    for first_name, last_name in [('Bea', 'A'), ('Ann', 'Z'), ('Ann', 'B')]:
+      user = User.objects.create_user(username=first_name + last_name, password='aoisdj',
+        first_name=first_name, last_name=last_name)
+      Sister.objects.create(user=user, status=Sister.ACTIVE, class_year=2019)
+
+    with CaptureQueriesContext(connection) as queries:
+      names = [str(sister) for sister in Sister.objects.all()]
+    self.assertEqual(names, ['Ann B', 'Ann Z', 'Bea A'])
+    self.assertEqual(len(queries), 1)
+    self.assertNotIn('auth_user', queries[0]['sql'])
+
+
+########################
+##### ROSTER TESTS #####
+########################
+class ActiveRosterTests(TestCase):
+  def create_sister(self, first_name, status):
+    user = User.objects.create_user(username=first_name, password='aoisdj', first_name=first_name)
+    return Sister.objects.create(user=user, status=status, class_year=2019)
+
+  def test_roster_has_current_sisters_by_name(self):
+    active = self.create_sister('Bea', Sister.ACTIVE)
+    new_member = self.create_sister('Ann', Sister.NEW_MEMBER)
+    abroad = self.create_sister('Cat', Sister.ABROAD)
+    self.create_sister('Dee', Sister.ALUM)
+    self.create_sister('Eve', Sister.DEAFFILIATED)
+
+    roster = get_active_roster()
+
+    self.assertEqual([str(entry) for entry in roster.get_entries()], ['Ann ', 'Bea ', 'Cat '])
+    self.assertEqual(roster.get_ids(PRESENT_STATUSES), set([active.id, new_member.id]))
+    self.assertEqual(roster.get_choices(PRESENT_STATUSES), [(new_member.id, 'Ann '), (active.id, 'Bea ')])
+    self.assertEqual(
+      [entry.id for entry in roster.get_entries(PRESENT_STATUSES, exclude_ids=[active.id])],
+      [new_member.id])
+
+  def test_roster_is_cached_until_sisters_change(self):
+    sister = self.create_sister('Bea', Sister.ACTIVE)
+    version = get_active_roster().version
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(get_active_roster().version, version)
+    self.assertEqual(len(queries), 0)
+
+    sister.status = Sister.ALUM
+    sister.save()
+    roster = get_active_roster()
+    self.assertNotEqual(roster.version, version)
+    self.assertEqual(roster.get_entries(), [])
+
+    sister.status = Sister.ACTIVE
+    sister.save()
+    sister.user.first_name = 'Bee'
+    sister.user.save()
+    self.assertEqual([str(entry) for entry in get_active_roster().get_entries()], ['Bee '])
+
+  def test_logging_in_leaves_roster_alone(self):
+    sister = self.create_sister('Bea', Sister.ACTIVE)
+    version = get_active_roster().version
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertTrue(self.client.login(username='Bea', password='aoisdj'))
+
+    self.assertEqual(get_active_roster().version, version)
+    self.assertFalse([query for query in queries if 'general_sister' in query['sql']])
@@ -1,7 +1,7 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 
-from .models import Sister
+from .middleware import get_request_sister
 
 # TODO: Add a Q&A w/ alums section?
 
@@ -13,21 +13,15 @@ from .models import Sister
 def get_context(request):
   context = {}
   context['user'] = request.user
-  if request.user.is_authenticated():
-    try:
-      context['sister'] = Sister.objects.get(user=request.user)
-    except:
-      pass
+  sister = get_sister(request)
+  if sister:
+    context['sister'] = sister
   return context
 
 # Returns the current sister logged in, if there is one.
+# Same as request.sister (see SisterMiddleware), and shares its lookup.
 def get_sister(request):
-  context = get_context(request)
-  if context.get('sister'):
-    return context['sister']
-  else:
-    return None
-
+  return get_request_sister(request)
 
 def index(request):
   return render(request, 'general/index.html', {})